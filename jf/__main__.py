@@ -1,11 +1,11 @@
 """JF main executable"""
 
+import os
 import sys
-import json
 import argparse
 import logging
 
-from jf import run_query
+from jf import cache, codec, quarantine, run_query
 from jf.output import ipy, print_results
 from jf.input import read_input
 
@@ -30,8 +30,66 @@ def set_loggers(debug=False):
         logger_handler.setFormatter(logging.Formatter(NORMALFORMAT))
 
 
+def index_main(args):
+    """Build sidecar indexes for random access to input files"""
+    from jf.index import GZIP_SPAN, build_index
+
+    parser = argparse.ArgumentParser(
+        prog="jf index",
+        description="build sidecar indexes for random access to jsonl files",
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="print debug messages"
+    )
+    parser.add_argument(
+        "--span",
+        type=int,
+        default=GZIP_SPAN // 1024 // 1024,
+        metavar="MB",
+        help="store a gzip checkpoint every MB megabytes of decompressed data",
+    )
+    parser.add_argument("files", metavar="FILE", nargs="+", help="files to index")
+    args = parser.parse_args(args)
+    set_loggers(args.debug)
+    for fn in args.files:
+        try:
+            index = build_index(fn, args.span * 1024 * 1024)
+        except ValueError as ex:
+            logger.warning("Can not index: %s", ex)
+            continue
+        path = index.save()
+        logger.info("Wrote %s with %d records", path, index.lines)
+
+
+def is_index_command(args):
+    """
+    Check if the arguments run jf index instead of a query that is index
+
+    The subcommand is run only when its first argument after the options is
+    an existing file.
+
+    >>> is_index_command(["index", "--span", "1", "setup.py"])
+    True
+    >>> is_index_command(["index"]), is_index_command(["index", "missing.json"])
+    (False, False)
+    """
+    if args[:1] != ["index"]:
+        return False
+    rest = iter(args[1:])
+    for arg in rest:
+        if arg == "--span":
+            next(rest, None)
+        elif not arg.startswith("-"):
+            return os.path.exists(arg)
+    return False
+
+
 def main(args=None):
     """Main JF execution function"""
+    if args is None:
+        args = sys.argv[1:]
+    if is_index_command(args):
+        return index_main(args[1:])
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "query",
@@ -94,6 +152,78 @@ def main(args=None):
     parser.add_argument(
         "-k", "--kwargs", help="files to read. Overrides files argument list"
     )
+    parser.add_argument(
+        "--csv-strings",
+        action="store_true",
+        default=False,
+        help="read csv values as strings without type inference",
+    )
+    parser.add_argument(
+        "--xml-record",
+        metavar="TAG",
+        help="stream xml input as one item per TAG element",
+    )
+    parser.add_argument(
+        "-F",
+        "--follow",
+        action="store_true",
+        default=False,
+        help="keep reading records appended to FILE, also after rotation",
+    )
+    parser.add_argument(
+        "--stream-path",
+        metavar="PATH",
+        help="stream the values at PATH, e.g. results.items.*, of huge json input",
+    )
+    parser.add_argument(
+        "--grep",
+        metavar="PATTERN",
+        help="decode only json records whose raw text matches the regex PATTERN",
+    )
+    parser.add_argument(
+        "--bad-records",
+        metavar="FILE",
+        help="write json records that can not be decoded to FILE and "
+        "print only a summary of them",
+    )
+    parser.add_argument(
+        "--json-backend",
+        default="auto",
+        choices=("auto", "json") + codec.BACKENDS,
+        help="json library to use, by default the fastest one installed",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="decode input files concurrently with N worker processes",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        default=False,
+        help="yield records from parallel workers as soon as they are ready",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        default=os.environ.get("JF_CACHE_DIR"),
+        help="cache remote input files in DIR (default: $JF_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=cache.DEFAULT_MAX_SIZE // 1024 // 1024,
+        metavar="MB",
+        help="maximum size of the input cache in megabytes",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="always fetch remote input files",
+    )
     parser.add_argument(
         "files",
         metavar="FILE",
@@ -105,6 +235,8 @@ def main(args=None):
 
     if args.input is not None:
         args.files = [args.input]
+    if args.follow and (len(args.files) != 1 or args.files[0] == "-"):
+        parser.error("--follow needs exactly one FILE")
 
     if args.indent < 0:
         args.indent = None
@@ -112,6 +244,11 @@ def main(args=None):
         args.indent = None
 
     set_loggers(args.debug)
+    codec.set_backend(args.json_backend)
+    if args.cache_dir and not args.no_cache:
+        cache.set_cache_dir(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.bad_records:
+        quarantine.set_quarantine(args.bad_records)
 
     kwargs = {}
     if args.kwargs:
@@ -120,7 +257,7 @@ def main(args=None):
         kwargsre = re.compile(r"([^:,]+)")
         kwargs = kwargsre.subn(r'"\1"', args.kwargs.replace("=", ":"))[0]
         kwargs = "{%s}" % kwargs
-        kwargs = json.loads(kwargs)
+        kwargs = codec.loads(kwargs)
     inq = read_input(args, ordered_dict=args.ordered_dict, **kwargs)
     imports = None
     if "import" in args.__dict__:
@@ -183,6 +320,13 @@ def main(args=None):
         print_results(data, args)
     except FileNotFoundError as ex:
         logger.warning("%s", ex)
+    except KeyboardInterrupt:
+        if not args.follow:
+            raise
+    finally:
+        if quarantine.quarantine is not None:
+            logger.warning("%s", quarantine.quarantine.summary())
+            quarantine.set_quarantine(None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""JF local cache for remote input files"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+TMP_PREFIX = ".tmp-"
+
+cache = None
+
+
+class FileCache:
+    """
+    On-disk LRU cache of remote files
+
+    Files are stored by a hash of their key, e.g. bucket, object key and
+    ETag, so a changed object is never served from the cache. The modification
+    time of a file is updated on every hit and the least recently used files
+    are removed when the cache grows over max_size bytes.
+
+    >>> import tempfile
+    >>> tmpdir = tempfile.TemporaryDirectory()
+    >>> c = FileCache(tmpdir.name, max_size=10)
+    >>> c.get("bucket", "key", "etag") is None
+    True
+    >>> fn = c.put(("bucket", "key", "etag"), lambda f: f.write(b"data"))
+    >>> c.get("bucket", "key", "etag") == fn
+    True
+    >>> with open(fn, "rb") as f:
+    ...     f.read()
+    b'data'
+    >>> tmpdir.cleanup()
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, *key):
+        """Return the cache file name for key"""
+        digest = hashlib.sha256("\0".join(key).encode("UTF-8")).hexdigest()
+        return os.path.join(self.path, digest)
+
+    def get(self, *key):
+        """Return the cached file name for key or None on a miss"""
+        fn = self.filename(*key)
+        try:
+            os.utime(fn)
+        except FileNotFoundError:
+            return None
+        logger.debug("Cache hit for %s", "/".join(key))
+        return fn
+
+    def put(self, key, write):
+        """
+        Store a file to the cache and return its name
+
+        The file is written with write(fileobj) to a temporary file that is
+        renamed in place when complete, so concurrent readers never see a
+        partial file.
+        """
+        fn = self.filename(*key)
+        fd, tmpname = tempfile.mkstemp(dir=self.path, prefix=TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmpname, fn)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        self.evict(keep=fn)
+        return fn
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used files until the cache fits max_size
+
+        >>> import tempfile
+        >>> tmpdir = tempfile.TemporaryDirectory()
+        >>> c = FileCache(tmpdir.name, max_size=10)
+        >>> first = c.put(("a",), lambda f: f.write(b"123456"))
+        >>> second = c.put(("b",), lambda f: f.write(b"123456"))
+        >>> c.get("a"), c.get("b") == second
+        (None, True)
+        >>> tmpdir.cleanup()
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if name.startswith(TMP_PREFIX):
+                continue
+            fn = os.path.join(self.path, name)
+            try:
+                st = os.stat(fn)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fn in sorted(entries):
+            if total <= self.max_size:
+                break
+            if fn == keep:
+                continue
+            try:
+                os.unlink(fn)
+            except FileNotFoundError:
+                pass
+            logger.debug("Evicted %s from cache", fn)
+            total -= size
+
+
+def set_cache_dir(path, max_size=DEFAULT_MAX_SIZE):
+    """Enable the cache for remote inputs in path or disable it with None"""
+    global cache
+    cache = FileCache(path, max_size) if path else None
+    return cache
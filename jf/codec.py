@@ -0,0 +1,204 @@
+"""JF json codec
+
+All json decoding and encoding in jf goes through this module, so that a
+faster json library is used when one is installed. The output is always the
+same as with the standard library: the fast encoder is only used when it can
+produce identical output and everything else falls back to json.
+"""
+
+import re
+import json
+import logging
+from collections import OrderedDict
+
+from jf.meta import StructEncoder
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("orjson", "ujson", "simdjson")
+
+# orjson formats some floats differently from json and writes NaN as null
+UNSAFE_FAST_OUTPUT = re.compile(rb"null|[0-9]e|0\.0000")
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+# Integers that may not fit to 64 bits, e.g. below -2 ** 63, may be decoded as
+# floats
+BIG_NUMBER = re.compile(r"[0-9]{19}")
+BIG_NUMBER_BYTES = re.compile(rb"[0-9]{19}")
+
+backend = "json"
+_fast_loads = None
+_orjson = None
+
+
+def set_backend(name="auto"):
+    """
+    Select the json library used for decoding and encoding
+
+    With "auto" the first installed library of BACKENDS is used.
+
+    >>> set_backend("json")
+    'json'
+    >>> set_backend() in ("json",) + BACKENDS
+    True
+    """
+    global backend, _fast_loads, _orjson
+    import importlib
+
+    backend, _fast_loads, _orjson = "json", None, None
+    candidates = BACKENDS if name == "auto" else (name,)
+    for candidate in candidates:
+        if candidate == "json":
+            break
+        try:
+            module = importlib.import_module(candidate)
+        except ImportError:
+            if name != "auto":
+                logger.warning("%s is not installed, using json", candidate)
+            continue
+        backend = candidate
+        _fast_loads = module.loads
+        if candidate == "orjson":
+            _orjson = module
+        break
+    logger.debug("Using %s for json", backend)
+    return backend
+
+
+def loads(data, ordered=False):
+    """
+    Decode a json document from str or bytes
+
+    >>> loads(b'{"a": [1, 2.5, null]}')
+    {'a': [1, 2.5, None]}
+    >>> loads('{"b": 1, "a": 2}', ordered=True)
+    OrderedDict([('b', 1), ('a', 2)])
+    """
+    if ordered:
+        return json.loads(data, object_pairs_hook=OrderedDict)
+    if _fast_loads is not None:
+        big_number = BIG_NUMBER_BYTES if isinstance(data, bytes) else BIG_NUMBER
+        if not big_number.search(data):
+            try:
+                return _fast_loads(data)
+            except ValueError:
+                # Let json decide, e.g. on NaN, infinities and real errors
+                pass
+    return json.loads(data)
+
+
+class Projection:
+    """
+    Decoder that builds only some paths of json objects
+
+    The values outside the paths are skipped by jsonlgen without building
+    them. Documents that are not objects are decoded as a whole, and so is
+    invalid json, so that it raises the usual errors.
+
+    >>> proj = Projection([("id",), ("meta", "ts")])
+    >>> proj.loads(b'{"id": 1, "meta": {"ts": 2, "a": 3}, "b": [{"c": 4}]}')
+    {'id': 1, 'meta': {'ts': 2}}
+    >>> proj.loads('[{"id": 1, "b": 2}]')
+    [{'id': 1, 'b': 2}]
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self._decoder = None
+
+    def __getstate__(self):
+        return {"paths": self.paths}
+
+    def __setstate__(self, state):
+        self.__init__(state["paths"])
+
+    def tree(self):
+        """
+        Return the paths as a tree of dicts with None for whole values
+
+        >>> Projection([("a", "b"), ("a",), ("c", "d")]).tree()
+        {'a': None, 'c': {'d': None}}
+        """
+        tree = {}
+        for path in sorted(self.paths, key=len):
+            node = tree
+            for key in path[:-1]:
+                if key in node and node[key] is None:
+                    break
+                node = node.setdefault(key, {})
+            else:
+                node[path[-1]] = None
+        return tree
+
+    def loads(self, data):
+        """Decode the paths of a json document from str or bytes"""
+        if self._decoder is None:
+            from jf import jsonlgen  # cpython from jsonlgen.cc
+
+            self._decoder = jsonlgen.projection(self.tree(), loads)
+        if isinstance(data, str):
+            data = data.encode("UTF-8")
+        try:
+            ret = self._decoder(data)
+        except ValueError:
+            ret = None
+        if ret is None:
+            return loads(data)
+        return ret
+
+
+def _escape_non_ascii(match):
+    """Escape a character the same way as json with ensure_ascii"""
+    return json.dumps(match.group(0))[1:-1]
+
+
+def dumps(obj, sort_keys=False, indent=None, ensure_ascii=True, cls=StructEncoder):
+    """
+    Encode obj to a json string
+
+    >>> print(dumps({"b": 1, "a": "ä"}, sort_keys=True, indent=2))
+    {
+      "a": "\\u00e4",
+      "b": 1
+    }
+    """
+    if _orjson is not None and indent == 2 and cls is StructEncoder:
+        option = (
+            _orjson.OPT_INDENT_2
+            | _orjson.OPT_PASSTHROUGH_DATETIME
+            | _orjson.OPT_PASSTHROUGH_DATACLASS
+        )
+        if sort_keys:
+            option |= _orjson.OPT_SORT_KEYS
+        try:
+            ret = _orjson.dumps(obj, default=_struct_default, option=option)
+        except TypeError:
+            ret = None
+        if ret is not None and not UNSAFE_FAST_OUTPUT.search(ret):
+            ret = ret.decode("UTF-8")
+            if ensure_ascii:
+                ret = NON_ASCII.sub(_escape_non_ascii, ret)
+            return ret
+    return json.dumps(
+        obj, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii, cls=cls
+    )
+
+
+def clean(obj, ordered=False):
+    """
+    Convert obj to plain json types
+
+    >>> clean({"a": (1, 2)})
+    {'a': [1, 2]}
+    """
+    return loads(dumps(obj), ordered=ordered)
+
+
+def _struct_default(obj, _encoder=StructEncoder()):
+    """Convert the objects orjson does not support like StructEncoder does"""
+    if isinstance(obj, float):
+        # json writes float subclasses, e.g. numpy.float64, as numbers
+        raise TypeError("Float subclass %s" % type(obj))
+    return _encoder.default(obj)
+
+
+set_backend()
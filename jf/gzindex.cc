@@ -0,0 +1,426 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <zlib.h>
+#include <stdio.h>
+#include <string.h>
+#include <string>
+#include <vector>
+
+/* Random access to gzip files in the manner of zran.c in the zlib examples.
+ *
+ * build() decompresses a file once and records a checkpoint at a deflate
+ * block boundary every span bytes of output. A checkpoint holds the
+ * compressed offset, the bit offset within the previous byte and the last
+ * 32 kB of output, which is everything needed to start inflating there.
+ * inflater(...) continues decompression from such a checkpoint.
+*/
+
+#define WINSIZE 32768
+#define CHUNK 65536
+
+using namespace std;
+
+typedef struct {
+    long long out;
+    long long in;
+    int bits;
+    long long lines;
+    string window;
+} Checkpoint;
+
+typedef struct {
+    PyObject_HEAD
+    FILE *f;
+    z_stream strm;
+    unsigned char *input;
+    bool has_strm;
+    bool raw;
+    bool eof;
+} InflaterState;
+
+static int
+refill(z_stream *strm, FILE *f, unsigned char *input)
+{
+    /* Read more compressed data after the unread bytes of input. Returns the
+     * number of bytes read or -1 on error.
+    */
+    if (strm->avail_in && strm->next_in != input)
+        memmove(input, strm->next_in, strm->avail_in);
+    strm->next_in = input;
+    size_t got = fread(input + strm->avail_in, 1, CHUNK - strm->avail_in, f);
+    if (ferror(f))
+        return -1;
+    strm->avail_in += got;
+    return (int)got;
+}
+
+static bool
+next_member(z_stream *strm, FILE *f, unsigned char *input)
+{
+    /* Check if another gzip member follows. Anything else after a member,
+     * e.g. zero padding, ends the file like it does for gzip.
+    */
+    if (strm->avail_in < 2)
+        refill(strm, f, input);
+    return strm->avail_in >= 2 && strm->next_in[0] == 0x1f && strm->next_in[1] == 0x8b;
+}
+
+static PyObject *
+gzindex_build(PyObject *self, PyObject *args)
+{
+    const char *path;
+    long long span;
+    PyObject *check = Py_None;
+
+    if (!PyArg_ParseTuple(args, "sL|O", &path, &span, &check))
+        return NULL;
+
+    FILE *f = fopen(path, "rb");
+    if (!f)
+        return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+
+    vector<Checkpoint> points;
+    const char *error = NULL;
+    bool pyerror = false;
+    long long totin = 0, totout = 0, last = 0, lines = 0;
+    unsigned char prev = '\n';
+    unsigned char *input = new unsigned char[CHUNK];
+    unsigned char *window = new unsigned char[WINSIZE]();
+    z_stream strm;
+    memset(&strm, 0, sizeof(strm));
+
+    Py_BEGIN_ALLOW_THREADS
+    /* 47 decodes both gzip and zlib headers */
+    if (inflateInit2(&strm, 47) != Z_OK)
+        error = "can not initialize zlib";
+    while (!error) {
+        if (strm.avail_in == 0) {
+            int got = refill(&strm, f, input);
+            if (got < 0) {
+                error = "read error";
+                break;
+            }
+            if (got == 0) {
+                error = "unexpected end of file";
+                break;
+            }
+        }
+        if (strm.avail_out == 0) {
+            strm.avail_out = WINSIZE;
+            strm.next_out = window;
+        }
+        unsigned char *start = strm.next_out;
+        totin += strm.avail_in;
+        totout += strm.avail_out;
+        int ret = inflate(&strm, Z_BLOCK);
+        totin -= strm.avail_in;
+        totout -= strm.avail_out;
+        /* Records are the lines that are not empty */
+        for (unsigned char *p = start; p < strm.next_out; p++) {
+            if (*p == '\n' && prev != '\n')
+                lines++;
+            prev = *p;
+        }
+        /* The decompressed data is fed to check, e.g. a jsonlgen.linecheck */
+        if (check != Py_None && strm.next_out > start) {
+            Py_BLOCK_THREADS
+            PyObject *res = PyObject_CallMethod(
+                check, "feed", "y#", (char *)start, (Py_ssize_t)(strm.next_out - start));
+            Py_XDECREF(res);
+            Py_UNBLOCK_THREADS
+            if (!res) {
+                error = "check failed";
+                pyerror = true;
+                break;
+            }
+        }
+        if (ret == Z_NEED_DICT || ret == Z_DATA_ERROR) {
+            error = strm.msg ? strm.msg : "invalid compressed data";
+            break;
+        }
+        if (ret == Z_MEM_ERROR) {
+            error = "out of memory";
+            break;
+        }
+        if (ret == Z_STREAM_END) {
+            if (!next_member(&strm, f, input))
+                break;
+            inflateReset(&strm);
+            continue;
+        }
+        /* At the end of a block that is not the last one of the member */
+        if ((strm.data_type & 128) && !(strm.data_type & 64) && totout - last > span) {
+            Checkpoint point;
+            point.out = totout;
+            point.in = totin;
+            point.bits = strm.data_type & 7;
+            point.lines = lines;
+            unsigned left = strm.avail_out;
+            point.window.assign((char *)window + WINSIZE - left, left);
+            point.window.append((char *)window, WINSIZE - left);
+            points.push_back(point);
+            last = totout;
+        }
+    }
+    inflateEnd(&strm);
+    Py_END_ALLOW_THREADS
+
+    fclose(f);
+    delete[] input;
+    delete[] window;
+    if (pyerror)
+        return NULL;
+    if (error) {
+        PyErr_Format(PyExc_OSError, "%s: %s", path, error);
+        return NULL;
+    }
+    if (prev != '\n')
+        lines++;
+
+    PyObject *ret = PyList_New(points.size());
+    if (!ret)
+        return NULL;
+    for (size_t i = 0; i < points.size(); i++) {
+        Checkpoint &point = points[i];
+        PyObject *item = Py_BuildValue(
+            "(LLiLy#)", point.out, point.in, point.bits, point.lines,
+            point.window.data(), (Py_ssize_t)point.window.size());
+        if (!item) {
+            Py_DECREF(ret);
+            return NULL;
+        }
+        PyList_SET_ITEM(ret, i, item);
+    }
+    return Py_BuildValue("(NLL)", ret, totout, lines);
+}
+
+static void
+inflater_release(InflaterState *state)
+{
+    if (state->has_strm) {
+        inflateEnd(&state->strm);
+        state->has_strm = false;
+    }
+    if (state->f) {
+        fclose(state->f);
+        state->f = NULL;
+    }
+    delete[] state->input;
+    state->input = NULL;
+}
+
+static void
+inflater_dealloc(InflaterState *state)
+{
+    inflater_release(state);
+    Py_TYPE(state)->tp_free(state);
+}
+
+static PyObject *
+inflater_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    static const char *kwlist[] = {"path", "offset", "bits", "window", NULL};
+    const char *path;
+    long long offset = 0;
+    int bits = 0;
+    Py_buffer window = {NULL, NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s|Liy*", (char **)kwlist,
+                                     &path, &offset, &bits, &window))
+        return NULL;
+
+    InflaterState *state = (InflaterState *)type->tp_alloc(type, 0);
+    if (!state) {
+        if (window.obj)
+            PyBuffer_Release(&window);
+        return NULL;
+    }
+    state->input = new unsigned char[CHUNK];
+    memset(&state->strm, 0, sizeof(state->strm));
+    state->f = fopen(path, "rb");
+    const char *error = NULL;
+    if (!state->f) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+    } else if (!window.obj || window.len == 0) {
+        /* From the start of a member with its header */
+        if (fseeko(state->f, offset, SEEK_SET) || inflateInit2(&state->strm, 47) != Z_OK)
+            error = "can not start decompression";
+        state->has_strm = !error;
+    } else {
+        /* From a checkpoint within a member, without a header */
+        state->raw = true;
+        if (fseeko(state->f, offset - (bits ? 1 : 0), SEEK_SET)
+            || inflateInit2(&state->strm, -15) != Z_OK)
+            error = "can not start decompression";
+        state->has_strm = !error;
+        if (!error && bits) {
+            int c = getc(state->f);
+            if (c == EOF || inflatePrime(&state->strm, bits, c >> (8 - bits)) != Z_OK)
+                error = "can not prime decompression";
+        }
+        if (!error && inflateSetDictionary(&state->strm, (Bytef *)window.buf, window.len) != Z_OK)
+            error = "invalid checkpoint window";
+    }
+    if (window.obj)
+        PyBuffer_Release(&window);
+    if (error)
+        PyErr_Format(PyExc_OSError, "%s: %s", path, error);
+    if (PyErr_Occurred()) {
+        Py_DECREF(state);
+        return NULL;
+    }
+    return (PyObject *)state;
+}
+
+static PyObject *
+inflater_read(InflaterState *state, PyObject *args)
+{
+    Py_ssize_t size = CHUNK;
+
+    if (!PyArg_ParseTuple(args, "|n", &size))
+        return NULL;
+    if (!state->has_strm) {
+        PyErr_SetString(PyExc_ValueError, "read of closed inflater");
+        return NULL;
+    }
+    if (size <= 0 || size > 0x7fffffff)
+        size = CHUNK;
+    PyObject *ret = PyBytes_FromStringAndSize(NULL, size);
+    if (!ret)
+        return NULL;
+
+    z_stream *strm = &state->strm;
+    const char *error = NULL;
+    strm->next_out = (Bytef *)PyBytes_AS_STRING(ret);
+    strm->avail_out = (uInt)size;
+    Py_BEGIN_ALLOW_THREADS
+    while (strm->avail_out && !state->eof) {
+        if (strm->avail_in == 0) {
+            int got = refill(strm, state->f, state->input);
+            if (got <= 0) {
+                error = got ? "read error" : "unexpected end of file";
+                break;
+            }
+        }
+        int ret = inflate(strm, Z_NO_FLUSH);
+        if (ret == Z_NEED_DICT || ret == Z_DATA_ERROR) {
+            error = strm->msg ? strm->msg : "invalid compressed data";
+            break;
+        }
+        if (ret == Z_MEM_ERROR) {
+            error = "out of memory";
+            break;
+        }
+        if (ret != Z_STREAM_END)
+            continue;
+        if (state->raw) {
+            /* Raw inflate leaves the gzip trailer of the member unread */
+            if (strm->avail_in < 8)
+                refill(strm, state->f, state->input);
+            if (strm->avail_in < 8) {
+                state->eof = true;
+                break;
+            }
+            strm->next_in += 8;
+            strm->avail_in -= 8;
+            state->raw = false;
+        }
+        if (next_member(strm, state->f, state->input))
+            inflateReset2(strm, 31);
+        else
+            state->eof = true;
+    }
+    Py_END_ALLOW_THREADS
+
+    if (error) {
+        Py_DECREF(ret);
+        PyErr_SetString(PyExc_OSError, error);
+        return NULL;
+    }
+    _PyBytes_Resize(&ret, size - strm->avail_out);
+    return ret;
+}
+
+static PyObject *
+inflater_close(InflaterState *state, PyObject *unused)
+{
+    inflater_release(state);
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef inflater_methods[] = {
+    {"read", (PyCFunction)inflater_read, METH_VARARGS,
+     "read(size=65536) -> up to size bytes of output, b'' at the end"},
+    {"close", (PyCFunction)inflater_close, METH_NOARGS, "close the file"},
+    {NULL, NULL, 0, NULL}
+};
+
+PyTypeObject PyInflater_Type = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "inflater",                     /* tp_name */
+    sizeof(InflaterState),          /* tp_basicsize */
+    0,                              /* tp_itemsize */
+    (destructor)inflater_dealloc,   /* tp_dealloc */
+    0,                              /* tp_print */
+    0,                              /* tp_getattr */
+    0,                              /* tp_setattr */
+    0,                              /* tp_reserved */
+    0,                              /* tp_repr */
+    0,                              /* tp_as_number */
+    0,                              /* tp_as_sequence */
+    0,                              /* tp_as_mapping */
+    0,                              /* tp_hash */
+    0,                              /* tp_call */
+    0,                              /* tp_str */
+    0,                              /* tp_getattro */
+    0,                              /* tp_setattro */
+    0,                              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,             /* tp_flags */
+    "inflater(path, offset=0, bits=0, window=b'') -> gzip decompressor starting at a checkpoint", /* tp_doc */
+    0,                              /* tp_traverse */
+    0,                              /* tp_clear */
+    0,                              /* tp_richcompare */
+    0,                              /* tp_weaklistoffset */
+    0,                              /* tp_iter */
+    0,                              /* tp_iternext */
+    inflater_methods,               /* tp_methods */
+    0,                              /* tp_members */
+    0,                              /* tp_getset */
+    0,                              /* tp_base */
+    0,                              /* tp_dict */
+    0,                              /* tp_descr_get */
+    0,                              /* tp_descr_set */
+    0,                              /* tp_dictoffset */
+    0,                              /* tp_init */
+    PyType_GenericAlloc,            /* tp_alloc */
+    inflater_new,                   /* tp_new */
+};
+
+static PyMethodDef gzindex_methods[] = {
+    {"build", gzindex_build, METH_VARARGS,
+     "build(path, span, check=None) -> ([(out, in, bits, lines, window)], size, lines)"},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef gzindexmodule = {
+  PyModuleDef_HEAD_INIT,
+  "gzindex",               /* m_name */
+  "",                      /* m_doc */
+  -1,                      /* m_size */
+  gzindex_methods,         /* m_methods */
+};
+
+PyMODINIT_FUNC
+PyInit_gzindex(void)
+{
+    PyObject *module = PyModule_Create(&gzindexmodule);
+    if (!module)
+        return NULL;
+
+    if (PyType_Ready(&PyInflater_Type) < 0)
+        return NULL;
+    Py_INCREF((PyObject *)&PyInflater_Type);
+    PyModule_AddObject(module, "inflater", (PyObject *)&PyInflater_Type);
+
+    return module;
+}
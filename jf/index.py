@@ -0,0 +1,323 @@
+"""JF sidecar indexes for random access to large input files"""
+
+import io
+import os
+import zlib
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".jfidx"
+GZIP_SPAN = 4 * 1024 * 1024
+GZIP_MAGIC = b"JFGZIDX2"
+# magic, file size, file mtime, decompressed size, records, checkpoints
+GZIP_HEADER = struct.Struct("<8sqqqqq")
+# decompressed offset, compressed offset, bits, records, window size
+GZIP_POINT = struct.Struct("<qqbqI")
+LINES_MAGIC = b"JFLNIDX2"
+# magic, file size, file mtime, followed by the record offsets as array("Q")
+LINES_HEADER = struct.Struct("<8sqq")
+READ_SIZE = 1024 * 1024
+NOT_LINES = "%s does not have one json record per line"
+
+Checkpoint = namedtuple("Checkpoint", "out offset bits lines window")
+
+
+def file_stamp(fn):
+    """Return the size and modification time that invalidate an index"""
+    st = os.stat(fn)
+    return st.st_size, st.st_mtime_ns
+
+
+def read_magic(path):
+    """Return the magic bytes of an index file or None if it can not be read"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(GZIP_MAGIC))
+    except OSError:
+        return None
+
+
+def skip_lines(stream, count):
+    """Skip count records, i.e. non-empty lines, of a binary stream"""
+    while count > 0:
+        line = stream.readline()
+        if not line:
+            return
+        if line != b"\n":
+            count -= 1
+
+
+class InflaterReader(io.RawIOBase):
+    """Raw stream of a gzindex.inflater"""
+
+    def __init__(self, inflater):
+        self.inflater = inflater
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.inflater.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.inflater.close()
+        super(InflaterReader, self).close()
+
+
+def open_checkpoint(fn, point=None):
+    """Open a decompressed stream of a gzip file from the start or a checkpoint"""
+    from jf import gzindex  # cpython from gzindex.cc
+
+    if point is None:
+        inflater = gzindex.inflater(fn)
+    else:
+        inflater = gzindex.inflater(fn, point.offset, point.bits, point.window)
+    return io.BufferedReader(InflaterReader(inflater), buffer_size=READ_SIZE)
+
+
+def at_line_start(point):
+    """Check if a checkpoint is at the start of a line"""
+    return point is None or point.window.endswith(b"\n")
+
+
+class GzipIndex:
+    """
+    Checkpoints for random access to a gzip file
+
+    Like zran.c in the zlib examples, the index stores the decompressor state
+    every span bytes of output: the compressed offset, the bit offset and the
+    last 32 kB of output. It also counts the records, i.e. the non-empty
+    lines, before every checkpoint, so a jsonl file can be read from any
+    record without decompressing everything before it.
+
+    The index is saved next to the file with an .jfidx suffix and ignored
+    when the size or modification time of the file changes. Only files with
+    exactly one record on every line that is not empty can be indexed, since
+    the records are found by lines.
+    """
+
+    def __init__(self, fn, points, size, lines, stamp):
+        self.fn = fn
+        self.points = points
+        self.point_lines = [point.lines for point in points]
+        self.size = size
+        self.lines = lines
+        self.stamp = stamp
+
+    @classmethod
+    def build(cls, fn, span=GZIP_SPAN):
+        """Decompress fn once and record a checkpoint every span bytes"""
+        from jf import gzindex  # cpython from gzindex.cc
+        from jf import jsonlgen  # cpython from jsonlgen.cc
+
+        stamp = file_stamp(fn)
+        check = jsonlgen.linecheck()
+        points, size, lines = gzindex.build(fn, span, check)
+        if not check.close():
+            raise ValueError(NOT_LINES % fn)
+        points = [Checkpoint(*point) for point in points]
+        logger.info("Indexed %s with %d checkpoints", fn, len(points))
+        return cls(fn, points, size, lines, stamp)
+
+    @classmethod
+    def load(cls, fn, path=None):
+        """Load the index of fn or return None if it is missing or out of date"""
+        path = path or fn + INDEX_SUFFIX
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            magic, *header = GZIP_HEADER.unpack_from(data)
+        except struct.error:
+            return None
+        if magic != GZIP_MAGIC:
+            return None
+        file_size, mtime, size, lines, count = header
+        if (file_size, mtime) != file_stamp(fn):
+            logger.info("Ignoring out of date index %s", path)
+            return None
+        points = []
+        pos = GZIP_HEADER.size
+        for _ in range(count):
+            out, offset, bits, point_lines, length = GZIP_POINT.unpack_from(data, pos)
+            pos += GZIP_POINT.size
+            window = zlib.decompress(data[pos : pos + length])
+            pos += length
+            points.append(Checkpoint(out, offset, bits, point_lines, window))
+        return cls(fn, points, size, lines, (file_size, mtime))
+
+    def save(self, path=None):
+        """Write the index next to the file, or to path"""
+        path = path or self.fn + INDEX_SUFFIX
+        tmpname = path + ".tmp"
+        with open(tmpname, "wb") as f:
+            f.write(
+                GZIP_HEADER.pack(
+                    GZIP_MAGIC, *self.stamp, self.size, self.lines, len(self.points)
+                )
+            )
+            for point in self.points:
+                window = zlib.compress(point.window)
+                f.write(
+                    GZIP_POINT.pack(
+                        point.out, point.offset, point.bits, point.lines, len(window)
+                    )
+                )
+                f.write(window)
+        os.replace(tmpname, path)
+        return path
+
+    def open_record(self, record):
+        """
+        Open a decompressed stream at the start of a record
+
+        Decompression starts from the last checkpoint before the record, so
+        at most span bytes are decompressed to find it.
+        """
+        idx = bisect_left(self.point_lines, record)
+        point = self.points[idx - 1] if idx else None
+        stream = open_checkpoint(self.fn, point)
+        done = 0
+        if point is not None:
+            done = point.lines
+            if not at_line_start(point):
+                # The rest of record number point.lines
+                stream.readline()
+                done += 1
+        skip_lines(stream, record - done)
+        return stream
+
+    def parts(self):
+        """
+        Split the file to parts that can be decompressed independently
+
+        Returns (checkpoint, stop) pairs, where checkpoint is None for the
+        start of the file. A part holds the records that start before its
+        stop offset of decompressed data.
+        """
+        starts = [None] + self.points
+        stops = [point.out for point in self.points] + [self.size]
+        return list(zip(starts, stops))
+
+
+class LineIndex:
+    """
+    Byte offsets of the records of a plain jsonl file
+
+    The offsets are saved next to the file with an .jfidx suffix as an
+    array("Q") and memory mapped when loaded, so finding a record takes the
+    same time for any file size. The index is ignored when the size or
+    modification time of the file changes. Every line that is not empty must
+    hold exactly one record, since the records are read by lines.
+    """
+
+    def __init__(self, fn, offsets, stamp):
+        self.fn = fn
+        self.offsets = offsets
+        self.stamp = stamp
+        self.lines = len(offsets)
+
+    @classmethod
+    def build(cls, fn):
+        """Find the start offsets of all records of fn"""
+        import mmap
+        from jf import jsonlgen  # cpython from jsonlgen.cc
+
+        stamp = file_stamp(fn)
+        offsets = array("Q")
+        if stamp[0]:
+            with open(fn, "rb") as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            spans = jsonlgen.spans(buf)
+            try:
+                offsets.extend(start for start, _ in spans)
+                if not spans.strict:
+                    raise ValueError(NOT_LINES % fn)
+            finally:
+                del spans
+                buf.close()
+        logger.info("Indexed %s with %d records", fn, len(offsets))
+        return cls(fn, offsets, stamp)
+
+    @classmethod
+    def load(cls, fn, path=None):
+        """Load the index of fn or return None if it is missing or out of date"""
+        import mmap
+
+        path = path or fn + INDEX_SUFFIX
+        if read_magic(path) != LINES_MAGIC:
+            return None
+        with open(path, "rb") as f:
+            header = f.read(LINES_HEADER.size)
+            _, *stamp = LINES_HEADER.unpack(header)
+            if tuple(stamp) != file_stamp(fn):
+                logger.info("Ignoring out of date index %s", path)
+                return None
+            if os.fstat(f.fileno()).st_size == LINES_HEADER.size:
+                return cls(fn, array("Q"), tuple(stamp))
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = memoryview(buf)[LINES_HEADER.size :].cast("Q")
+        return cls(fn, offsets, tuple(stamp))
+
+    def save(self, path=None):
+        """Write the index next to the file, or to path"""
+        path = path or self.fn + INDEX_SUFFIX
+        tmpname = path + ".tmp"
+        with open(tmpname, "wb") as f:
+            f.write(LINES_HEADER.pack(LINES_MAGIC, *self.stamp))
+            f.write(self.offsets)
+        os.replace(tmpname, path)
+        return path
+
+    def open_record(self, record):
+        """Open the file at the start of a record"""
+        stream = open(self.fn, "rb", buffering=READ_SIZE)
+        if record < self.lines:
+            stream.seek(self.offsets[record])
+        else:
+            stream.seek(0, io.SEEK_END)
+        return stream
+
+    def chunks(self, chunk_size):
+        """
+        Split the file to byte ranges of about chunk_size at record starts
+
+        >>> LineIndex("x", [0, 10, 20, 30], (40, 0)).chunks(15)
+        [(0, 20), (20, 40)]
+        """
+        ret = []
+        start = 0
+        while start < self.stamp[0]:
+            idx = bisect_left(self.offsets, start + chunk_size)
+            stop = self.offsets[idx] if idx < self.lines else self.stamp[0]
+            ret.append((start, stop))
+            start = stop
+        return ret
+
+
+def load_index(fn):
+    """Load the gzip or jsonl index of fn or return None"""
+    magic = read_magic(fn + INDEX_SUFFIX)
+    if magic == GZIP_MAGIC:
+        return GzipIndex.load(fn)
+    if magic == LINES_MAGIC:
+        return LineIndex.load(fn)
+    return None
+
+
+def build_index(fn, span=GZIP_SPAN):
+    """Build the index for a gzip or plain jsonl file"""
+    with open(fn, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return GzipIndex.build(fn, span)
+    return LineIndex.build(fn)
@@ -1,19 +1,59 @@
 """JF io library"""
+import io
 import os
-import fileinput
+import re
+import sys
 import logging
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
+from itertools import islice, zip_longest
 
 from ruamel import yaml
 import json
 
 from lxml import etree
 
+from jf import codec, quarantine
+from jf.index import GzipIndex, LineIndex, at_line_start, open_checkpoint
+
 logger = logging.getLogger(__name__)
 
 UEE = "Got an unexpected exception"
 
+CHUNK_SIZE = 16 * 1024 * 1024
+CSV_CHUNK_ROWS = 10000
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_WORKERS = 4
+S3_OBJECT_WORKERS = 16
+S3_CONNECTIONS = 32
+BLOCK_SIZE = 1024 * 1024
+MEMBER_CHUNK_SIZE = 1024 * 1024
+MAX_MEMBER_CHUNKS = 4
+FOLLOW_INTERVAL = 0.1
+FOLLOW_MAX_LINE = 64 * 1024 * 1024
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".lz4": "lz4",
+}
+COMPRESSION_MAGIC_SIZE = 10
+COMPRESSION_MAGIC = (
+    (re.compile(rb"\x1f\x8b"), "gzip"),
+    (re.compile(rb"BZh[1-9]1AY&SY"), "bz2"),
+    (re.compile(rb"\x28\xb5\x2f\xfd"), "zstd"),
+    (re.compile(rb"\x04\x22\x4d\x18"), "lz4"),
+)
+# Patterns of gzip member and bz2 stream headers
+MEMBER_HEADERS = {
+    "gzip": re.compile(rb"\x1f\x8b\x08[\x00-\x1f]"),
+    "bz2": re.compile(rb"BZh[1-9]1AY&SY"),
+}
+# Formats that are read from a temporary file when the input is on s3
+RANDOM_ACCESS_FORMATS = ("xml", "parq", "parquet", "xlsx", "csv")
+
 RED = "\033[1;31m"
 BLUE = "\033[1;34m"
 CYAN = "\033[1;36m"
@@ -63,218 +103,1806 @@ def format_xml(parent):
     return ret
 
 
-def colorize_json_error(ex):
-    """Colorize input data syntax error"""
-    string = [c for c in ex.doc]
+def read_xml_records(fn, tag):
+    """
+    Stream the elements with the given tag from an xml file
+
+    Each record element is yielded as formatted by format_xml as soon as it
+    has been parsed. Finished elements are cleared, so memory usage does not
+    depend on the size of the document.
+    """
+    for _, element in etree.iterparse(fn, events=("end",), tag=tag):
+        yield format_xml(element)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def colorize_json_error(ex, context=500):
+    """
+    Colorize input data syntax error
+
+    Only context characters around the error are copied, so the cost does
+    not grow with the size of the bad record.
+
+    >>> ex = json.JSONDecodeError("Expecting value", "x" * 10 ** 6 + "]", 10 ** 6)
+    >>> colorize_json_error(ex, 2) == "xx" + RED + "]" + RESET
+    True
+    """
+    doc = ex.doc
     start = ex.pos
-    stop = ex.pos + 1
-    string[start] = RED + string[start]
-    string[stop] = RESET + string[stop]
-    return "".join(string[max(0, start - 500) : min(len(string), stop + 500)])
+    return "".join(
+        (
+            doc[max(0, start - context) : start],
+            RED,
+            doc[start : start + 1],
+            RESET,
+            doc[start + 1 : start + 1 + context],
+        )
+    )
 
 
 def import_error():
     """
     Logging function for import errors
     """
-    logger.warning("Install pandas and xlrd to read csv and excel")
+    logger.warning("Install pandas and openpyxl to read csv and excel")
     logger.warning("pip install pandas")
-    logger.warning("pip install xlrd")
+    logger.warning("pip install openpyxl")
+
 
+@lru_cache(maxsize=None)
+def s3_client():
+    """Return the s3 client shared by all s3 reads
 
-def read_s3(fn):
+    The client is thread safe and keeps a pool of connections, so concurrent
+    downloads reuse connections instead of creating new clients.
+    """
     import boto3
+    from botocore.config import Config
+
+    return boto3.client("s3", config=Config(max_pool_connections=S3_CONNECTIONS))
+
+
+def list_s3(fn):
+    """
+    List the objects under an s3 prefix or matching an s3 glob
+
+    The bucket is listed only once, starting from the part of the key before
+    the first glob character.
+    """
+    from fnmatch import fnmatchcase
+
+    bucket, key = parse_s3_url(fn)
+    prefix = key
+    globbing = any(c in key for c in "*?[")
+    if globbing:
+        prefix = key[: min(key.index(c) for c in "*?[" if c in key)]
+    paginator = s3_client().get_paginator("list_objects_v2")
+    ret = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            name = obj["Key"]
+            if name.endswith("/") or (globbing and not fnmatchcase(name, key)):
+                continue
+            ret.append("s3://%s/%s" % (bucket, name))
+    logger.debug("Found %d objects for %s", len(ret), fn)
+    return sorted(ret)
+
+
+def parse_s3_url(fn):
+    """
+    Split an s3 url to bucket and key
+
+    >>> parse_s3_url("s3://bucket/path/to/data.jsonl.gz")
+    ('bucket', 'path/to/data.jsonl.gz')
+    """
     from urllib.parse import urlparse
 
     o = urlparse(fn, allow_fragments=False)
-    bucket = o.netloc
-    key = o.path[1:]
+    return o.netloc, o.path[1:]
+
 
-    s3 = boto3.resource("s3")
-    obj = s3.Object(bucket, key)
-    body_bytes = obj.get()["Body"].read()
-    body = body_bytes
-    return body
+class S3Reader(io.RawIOBase):
+    """
+    Read an s3 object as a stream with parallel ranged GETs
+
+    The object is fetched in parts of part_size bytes. Up to workers parts are
+    downloaded ahead while the previous ones are being read, so records start
+    flowing right away and memory usage stays at about workers * part_size.
+    All parts are requested with the ETag of the object, so a concurrent
+    overwrite fails the read instead of mixing two versions.
+    """
+
+    def __init__(self, client, bucket, key, part_size=S3_PART_SIZE, workers=S3_WORKERS):
+        from concurrent.futures import ThreadPoolExecutor
+
+        head = client.head_object(Bucket=bucket, Key=key)
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.etag = head["ETag"]
+        self.size = head["ContentLength"]
+        self.part_size = part_size
+        self.workers = workers
+        self.offset = 0
+        self.pending = deque()
+        self.buf = memoryview(b"")
+        self.executor = ThreadPoolExecutor(workers)
+
+    def _fetch(self, start, stop):
+        ret = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range="bytes=%d-%d" % (start, stop - 1),
+            IfMatch=self.etag,
+        )
+        return ret["Body"].read()
 
+    def _prefetch(self):
+        while len(self.pending) < self.workers and self.offset < self.size:
+            stop = min(self.offset + self.part_size, self.size)
+            self.pending.append(self.executor.submit(self._fetch, self.offset, stop))
+            self.offset = stop
 
-def read_file(fn, openhook=fileinput.hook_compressed, ordered_dict=False, **kwargs):
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.buf:
+            self._prefetch()
+            if not self.pending:
+                return 0
+            self.buf = memoryview(self.pending.popleft().result())
+            self._prefetch()
+        size = min(len(b), len(self.buf))
+        b[:size] = self.buf[:size]
+        self.buf = self.buf[size:]
+        return size
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
+        super(S3Reader, self).close()
+
+
+def compression(fn, head=None):
     """
-    Function for converting input file to a data source
+    Return the compression format of a file from its extension or first bytes
+
+    >>> compression("data.jsonl.zst")
+    'zstd'
+    >>> compression("data.jsonl", b"\\x1f\\x8b\\x08\\x00")
+    'gzip'
+    >>> compression("data.jsonl", b'{"a": 1}') is None
+    True
     """
-    # FIXME these only output from the first line
-    inp = json.loads
-    ext = os.path.splitext(fn)[-1][1:]
-    if fn.startswith("s3://"):
-        content = read_s3(fn)
-        from tempfile import NamedTemporaryFile
+    ext = os.path.splitext(fn)[-1]
+    if ext in COMPRESSION_EXTENSIONS:
+        return COMPRESSION_EXTENSIONS[ext]
+    if head is None:
+        if not os.path.isfile(fn):
+            return None
+        with open(fn, "rb") as f:
+            head = f.read(COMPRESSION_MAGIC_SIZE)
+    for magic, name in COMPRESSION_MAGIC:
+        if magic.match(head):
+            return name
+    return None
 
-        f = NamedTemporaryFile()
-        f.write(content)
-        fn = f.name
-    if ext == "xml":
-        tree = etree.parse(fn)
-        root = tree.getroot()
-        xmldict = format_xml(root)
-        logger.info("Got dict from xml %s", xmldict)
-        yield xmldict
-        return
-    elif ext == "parq" or ext == "parquet":
-        import warnings
-        from numba import NumbaDeprecationWarning
 
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=NumbaDeprecationWarning)
-            from fastparquet import ParquetFile
+def decompress_format(stream, fmt):
+    """Wrap a binary stream to a decompressing stream of the given format"""
+    if fmt == "gzip":
+        import gzip
 
-            for val in ParquetFile(fn).to_pandas().to_dict("records", into=OrderedDict):
-                yield val
+        return gzip.GzipFile(fileobj=stream)
+    if fmt == "bz2":
+        import bz2
+
+        return bz2.BZ2File(stream)
+    if fmt == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("Install zstandard to read zstd compressed files")
+            raise
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            stream, read_across_frames=True
+        )
+        return reader
+    if fmt == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            logger.warning("Install lz4 to read lz4 compressed files")
+            raise
+        return lz4.frame.LZ4FrameFile(stream)
+    return stream
+
+
+class BlockReader(io.RawIOBase):
+    """
+    Read a stream from an iterator of bytes blocks
+
+    >>> BlockReader(iter([b"ab", b"", b"cd"])).read()
+    b'abcd'
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.buf = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buf:
+            try:
+                self.buf = memoryview(next(self.blocks))
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self.buf))
+        b[:size] = self.buf[:size]
+        self.buf = self.buf[size:]
+        return size
+
+    def close(self):
+        if hasattr(self.blocks, "close"):
+            self.blocks.close()
+        super(BlockReader, self).close()
+
+
+def read_blocks(stream, source=None, block_size=BLOCK_SIZE):
+    """
+    Yield blocks of block_size bytes from stream
+
+    stream and the source stream it wraps are closed at the end.
+    """
+    try:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                return
+            yield block
+    finally:
+        stream.close()
+        if source is not None:
+            source.close()
+
+
+def read_into(stream, block_size=BLOCK_SIZE):
+    """
+    Yield views of a reused buffer filled with blocks of stream
+
+    A view is valid only until the next one is taken, so the consumer must
+    copy what it keeps, like jsonlgen.gen does. Buffered streams are read
+    with readinto1, so a block of a pipe is yielded as soon as it arrives
+    instead of when the buffer is full. Streams without readinto, e.g.
+    text streams, are read in blocks of str instead.
+
+    >>> [bytes(block) for block in read_into(io.BytesIO(b"abcde"), 2)]
+    [b'ab', b'cd', b'e']
+    """
+    if not hasattr(stream, "readinto"):
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                return
+            yield block
+    readinto = getattr(stream, "readinto1", stream.readinto)
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    while True:
+        size = readinto(buf)
+        if not size:
             return
-    elif ext == "xlsx":
-        import xlrd
-        import pandas
+        yield view[:size]
 
-        for val in pandas.read_excel(fn).to_dict("records", into=OrderedDict):
-            yield val
-        return
-    elif ext == "csv":
-        import pandas
 
-        if ordered_dict:
-            for val in pandas.read_csv(fn, **kwargs).to_dict(
-                "records", into=OrderedDict
-            ):
-                yield val
+def background(blocks, depth=4):
+    """
+    Run an iterator of blocks in a background thread
+
+    Up to depth blocks are produced ahead, so e.g. decompression runs while
+    the previous blocks are parsed. zlib, bz2, zstd and lz4 release the GIL
+    while they work.
+
+    >>> list(background(iter([b"a", b"b"])))
+    [b'a', b'b']
+    """
+    import queue
+    import threading
+
+    blocks_queue = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                blocks_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for block in blocks:
+                if not put((block, None)):
+                    break
+            put((None, None))
+        except BaseException as ex:  # pylint: disable=broad-except
+            put((None, ex))
+        finally:
+            if hasattr(blocks, "close"):
+                blocks.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            block, ex = blocks_queue.get()
+            if ex is not None:
+                raise ex
+            if block is None:
+                return
+            yield block
+    finally:
+        stop.set()
+
+
+def decompress_members(data, fmt):
+    """
+    Decompress a sequence of whole gzip members or bz2 streams
+
+    Returns None if data does not end exactly at the end of a member, i.e.
+    when it was not split at a real member boundary.
+
+    >>> import gzip
+    >>> decompress_members(gzip.compress(b"a") + gzip.compress(b"b"), "gzip")
+    b'ab'
+    >>> decompress_members(gzip.compress(b"a")[:-1], "gzip") is None
+    True
+    """
+    import bz2
+    import zlib
+
+    ret = []
+    while data:
+        if fmt == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
         else:
-            for val in pandas.read_csv(fn, **kwargs).to_dict("records"):
-                yield val
-        return
-    elif ext == "yaml" or ext == "yml":
-        yaml.add_multi_constructor("", generic_constructor)
-        inp = yaml.safe_load
+            decompressor = bz2.BZ2Decompressor()
         try:
-            ind = inp(data)
-            if isinstance(ind, list):
-                for val in ind:
-                    yield val
-            else:
-                yield ind
-        except Exception as ex:
-            logger.warning("%s while producing input data", UEE)
-            logger.warning("Exception %s", repr(ex))
+            ret.append(decompressor.decompress(data))
+        except (zlib.error, OSError, EOFError):
+            return None
+        if not decompressor.eof:
+            return None
+        data = decompressor.unused_data
+    return b"".join(ret)
+
+
+def member_chunks(buf, fmt, chunk_size=MEMBER_CHUNK_SIZE):
+    """
+    Split a multi-member gzip or multi-stream bz2 file to ranges of members
+
+    Yields (start, stop) ranges of about chunk_size bytes that start at
+    possible member headers. The header patterns may also match inside
+    compressed data, so decompress_members verifies every range. stop is None
+    when there is no header within MAX_MEMBER_CHUNKS chunks, e.g. for a file
+    of one big member.
+    """
+    pattern = MEMBER_HEADERS[fmt]
+    start = 0
+    size = len(buf)
+    while start < size:
+        stop = size
+        if start + chunk_size < size:
+            end = min(start + MAX_MEMBER_CHUNKS * chunk_size, size)
+            match = pattern.search(buf, start + chunk_size, end)
+            if match is not None:
+                stop = match.start()
+            elif end < size:
+                yield start, None
+                return
+        yield start, stop
+        start = stop
+
+
+def parallel_decompress(fn, fmt, workers, chunk_size=MEMBER_CHUNK_SIZE):
+    """
+    Decompress the members of a gzip or bz2 file in parallel threads
+
+    Yields the decompressed blocks in order. When a range turns out not to
+    hold whole members, everything from its start, which is known to be a
+    member boundary, is decompressed serially in a background thread.
+    """
+    import mmap
+    from concurrent.futures import ThreadPoolExecutor
+
+    with open(fn, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+
+            def submit(chunk):
+                start, stop = chunk
+                if stop is None:
+                    return start, None
+                return start, executor.submit(decompress_members, buf[start:stop], fmt)
+
+            chunks = member_chunks(buf, fmt, chunk_size)
+            for start, future in bounded_map(submit, chunks, 2 * workers):
+                data = future.result() if future is not None else None
+                if data is None:
+                    logger.debug("Decompressing %s serially from %d", fn, start)
+                    f = open(fn, "rb")
+                    f.seek(start)
+                    blocks = read_blocks(decompress_format(f, fmt), f)
+                    for block in background(blocks):
+                        yield block
+                    return
+                yield data
+    finally:
+        buf.close()
+
+
+def decompress(stream, fn, workers=0):
+    """
+    Wrap a binary stream to a decompressing stream
+
+    The format is detected from the file name or the first bytes of the
+    stream. Decompression runs in a background thread and, with workers, the
+    members of a local multi-member gzip or bz2 file are decompressed in
+    parallel.
+    """
+    if hasattr(stream, "peek"):
+        head = stream.peek(COMPRESSION_MAGIC_SIZE)[:COMPRESSION_MAGIC_SIZE]
+    else:
+        head = stream.read(COMPRESSION_MAGIC_SIZE)
+        stream.seek(0)
+    fmt = compression(fn, head)
+    if fmt is None:
+        return stream
+    if workers > 1 and fmt in MEMBER_HEADERS and os.path.isfile(fn):
+        stream.close()
+        blocks = parallel_decompress(fn, fmt, workers)
     else:
-        inf = (
-            x.decode("UTF-8")
-            for x in fileinput.input(files=[fn], openhook=openhook, mode="rb")
+        blocks = background(read_blocks(decompress_format(stream, fmt), stream))
+    return io.BufferedReader(BlockReader(blocks), buffer_size=BLOCK_SIZE)
+
+
+def hook_compressed(fn, mode="rb", workers=0):
+    """
+    Open a possibly compressed file
+
+    This is an openhook for fileinput like fileinput.hook_compressed, which
+    also reads zstd and lz4 files and decompresses in the background.
+    """
+    stream = decompress(open(fn, "rb"), fn, workers)
+    if "b" not in mode:
+        return io.TextIOWrapper(stream)
+    return stream
+
+
+def cached_s3(fn):
+    """
+    Return the name of a local copy of an s3 object or None without a cache
+
+    The object is revalidated with a HEAD request on every call and fetched
+    to the cache when its ETag is not there yet.
+    """
+    from jf import cache as jfcache
+
+    cache = jfcache.cache
+    if cache is None:
+        return None
+    import shutil
+
+    bucket, key = parse_s3_url(fn)
+    client = s3_client()
+    etag = client.head_object(Bucket=bucket, Key=key)["ETag"]
+    cached = cache.get(bucket, key, etag)
+    if cached is not None:
+        return cached
+    logger.info("Fetching %s to cache", fn)
+    reader = S3Reader(client, bucket, key)
+    try:
+        # The object may have changed since the HEAD request
+        return cache.put(
+            (bucket, key, reader.etag),
+            lambda f: shutil.copyfileobj(reader, f, S3_PART_SIZE),
         )
-        for val in yield_json_and_json_lines(inf):
-            try:
-                obj = json.loads(val)
-                yield obj
-            except json.JSONDecodeError as ex:
-                logger.warning("Exception %s", repr(ex))
-                jerr = colorize_json_error(ex)
-                logger.warning("Error at code marker q4eh\ndata:\n%s", jerr)
-
-
-def read_input(args, openhook=fileinput.hook_compressed, ordered_dict=False, **kwargs):
-    """Read json, jsonl and yaml data from file defined in args"""
-    # FIXME these only output from the first line
-    fn = args.files[0]
+    finally:
+        reader.close()
+
+
+def open_s3(fn, mode="rb"):
+    """
+    Open an s3 object for streaming
+
+    This works as an openhook for fileinput, so s3 objects go through the same
+    decompression and json splitting as local files.
+    """
+    bucket, key = parse_s3_url(fn)
+    cached = cached_s3(fn)
+    if cached is not None:
+        return decompress(open(cached, "rb"), key)
+    reader = S3Reader(s3_client(), bucket, key)
+    stream = io.BufferedReader(reader, buffer_size=S3_PART_SIZE)
+    return decompress(stream, key)
+
+
+def download_s3(fn):
+    """
+    Download an s3 object to a temporary file
+
+    This is used for the formats that need random access to the file. The
+    download is streamed to disk, so the object is never fully in memory.
+    """
+    from tempfile import NamedTemporaryFile
+
+    cached = cached_s3(fn)
+    if cached is not None:
+        return open(cached, "rb")
+    bucket, key = parse_s3_url(fn)
+    f = NamedTemporaryFile(suffix=os.path.splitext(key)[-1])
+    s3_client().download_fileobj(bucket, key, f)
+    f.flush()
+    return f
+
+
+def generic_constructor(loader, tag, node):
+    """Construct yaml nodes with unknown tags as plain python values"""
+    classname = node.__class__.__name__
+    if classname == "SequenceNode":
+        return loader.construct_sequence(node)
+    elif classname == "MappingNode":
+        return loader.construct_mapping(node)
+    else:
+        return loader.construct_scalar(node)
+
+
+def yaml_loader():
+    """Return the libyaml based safe loader if available, with jf tag handling"""
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    loader.add_multi_constructor("", generic_constructor)
+    return loader
+
+
+def read_yaml(stream):
+    """
+    Yield the documents of a yaml stream one at a time
+
+    Multi-document streams are parsed incrementally, so only one document is
+    in memory at a time. Documents that are lists are yielded item by item
+    and empty documents are skipped.
+
+    >>> from io import BytesIO
+    >>> list(read_yaml(BytesIO(b"a: 1\\n---\\n- b\\n- !tag c\\n---\\n")))
+    [{'a': 1}, 'b', 'c']
+    """
+    try:
+        for doc in yaml.load_all(stream, Loader=yaml_loader()):
+            if doc is None:
+                continue
+            if isinstance(doc, list):
+                for val in doc:
+                    yield val
+            else:
+                yield doc
+    except Exception as ex:
+        logger.warning("%s while producing input data", UEE)
+        logger.warning("Exception %s", repr(ex))
+
+
+def expand_files(files):
+    """
+    Expand globs and directories in the list of input files
+
+    Directories are walked recursively and their files are read in sorted
+    order. s3 prefixes (ending with /) and globs are listed from the bucket.
+    Paths that do not exist are kept as they are.
+
+    >>> expand_files("-")
+    ['-']
+    >>> expand_files(["tests/test.j*"])
+    ['tests/test.json', 'tests/test.jsonl']
+    """
+    import glob
+
+    if isinstance(files, str):
+        files = [files]
+    ret = []
+    for fn in files:
+        globbing = any(c in fn for c in "*?[")
+        if fn.startswith("s3://") and (fn.endswith("/") or globbing):
+            ret.extend(list_s3(fn))
+        elif fn == "-" or fn.startswith("s3://"):
+            ret.append(fn)
+        elif os.path.isdir(fn):
+            for root, dirs, names in os.walk(fn):
+                dirs.sort()
+                ret.extend(os.path.join(root, name) for name in sorted(names))
+        elif globbing:
+            matches = sorted(glob.glob(fn, recursive=True))
+            ret.extend(matches if matches else [fn])
+        else:
+            ret.append(fn)
+    return ret
+
+
+def read_file(
+    fn,
+    openhook=hook_compressed,
+    ordered_dict=False,
+    yamli=False,
+    csv_strings=False,
+    columns=None,
+    comparisons=None,
+    xml_record=None,
+    workers=0,
+    limit=None,
+    grep=None,
+    projection=None,
+    stream_path=None,
+    **kwargs
+):
+    """
+    Function for converting input file to a data source
+
+    With limit, tabular files are read only up to the first limit rows. With
+    grep, json records are decoded only if their raw text passes it, and
+    with projection only the paths of it are decoded. With stream_path, the
+    values at the path of json documents are the records.
+    """
     ext = os.path.splitext(fn)[-1][1:]
-    if args.files[0].startswith("s3://"):
-        content = read_s3(args.files[0])
-        from tempfile import NamedTemporaryFile
-
-        f = NamedTemporaryFile()
-        f.write(content)
-        args.files[0] = f.name
-        fn = f.name
-    if ext == "xml":
-        tree = etree.parse(args.files[0])
+    if fn.startswith("s3://"):
+        if ext in RANDOM_ACCESS_FORMATS:
+            tmpfile = download_s3(fn)
+            fn = tmpfile.name
+        elif openhook is hook_compressed:
+            openhook = open_s3
+    if ext == "xml" and xml_record:
+        for val in read_xml_records(fn, xml_record):
+            yield val
+        return
+    elif ext == "xml":
+        tree = etree.parse(fn)
         root = tree.getroot()
         xmldict = format_xml(root)
         logger.info("Got dict from xml %s", xmldict)
         yield xmldict
         return
     elif ext == "parq" or ext == "parquet":
-        import warnings
-        from numba import NumbaDeprecationWarning
-
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=NumbaDeprecationWarning)
-            from fastparquet import ParquetFile
-
-            for val in (
-                ParquetFile(args.files[0])
-                .to_pandas()
-                .to_dict("records", into=OrderedDict)
-            ):
+        rows = read_parquet(fn, columns=columns, comparisons=comparisons, limit=limit)
+        for val in rows:
+            yield val
+        return
+    elif ext == "xlsx":
+        for val in read_excel(fn, ordered_dict, limit=limit, **kwargs):
+            yield val
+        return
+    elif ext == "csv":
+        rows = read_csv(fn, ordered_dict, strings=csv_strings, limit=limit, **kwargs)
+        for val in rows:
+            yield val
+        return
+    if stream_path and not yamli and ext not in ("yaml", "yml"):
+        stream = sys.stdin.buffer
+        if fn != "-" and openhook is hook_compressed:
+            stream = hook_compressed(fn, "rb", workers=workers)
+        elif fn != "-":
+            stream = openhook(fn, "rb")
+        records = read_stream_path(stream, stream_path, close=fn != "-")
+        for val in decode_json_records(records, ordered_dict, grep, projection):
+            yield val
+        return
+    if not yamli and can_mmap(fn, openhook):
+        records = yield_json_records_mmap(fn)
+        for val in decode_json_records(records, ordered_dict, grep, projection):
+            yield val
+        return
+    if workers > 1 and openhook is hook_compressed:
+        openhook = partial(hook_compressed, workers=workers)
+    if yamli or ext == "yaml" or ext == "yml":
+        if fn == "-":
+            for val in read_yaml(sys.stdin.buffer):
                 yield val
             return
-    elif ext == "xlsx":
-        import xlrd
+        stream = openhook(fn, "rb")
+        try:
+            for val in read_yaml(stream):
+                yield val
+        finally:
+            stream.close()
+        return
+    stream = sys.stdin.buffer if fn == "-" else openhook(fn, "rb")
+    try:
+        records = yield_json_and_json_lines(read_into(stream))
+        for val in decode_json_records(records, ordered_dict, grep, projection):
+            yield val
+    finally:
+        if fn != "-":
+            stream.close()
+
+
+def stats_may_match(low, high, op, value, null_count=None):
+    """
+    Check if a column with values between low and high may match a comparison
+
+    Timestamp statistics are compared to timestamps, dates and date strings,
+    in UTC if the value has a timezone, and binary statistics to strings as
+    UTF-8. The statistics do not include nulls or NaNs, which are not equal
+    to anything, so != can only prune when null_count is known to be 0 and
+    the column is not a float column.
+
+    >>> stats_may_match(1, 5, ">", 5)
+    False
+    >>> stats_may_match(5, 5, "!=", 5, null_count=0)
+    False
+    >>> stats_may_match(5, 5, "!=", 5, null_count=1)
+    True
+    >>> stats_may_match(1, 5, "==", "a")
+    True
+    >>> stats_may_match(b"a", b"c", "==", "d")
+    False
+    >>> import numpy
+    >>> low, high = numpy.datetime64("2023-01-01"), numpy.datetime64("2023-12-31")
+    >>> stats_may_match(low, high, ">", "2024-01-01T00:00:00+02:00")
+    False
+    """
+    import datetime
+    import numpy
+
+    if low is None or high is None:
+        return True
+    if op == "!=" and (null_count != 0 or isinstance(low, (float, numpy.floating))):
+        return True
+    if isinstance(low, numpy.datetime64):
         import pandas
 
-        for val in pandas.read_excel(args.files[0]).to_dict(
-            "records", into=OrderedDict
-        ):
+        low, high = pandas.Timestamp(low), pandas.Timestamp(high)
+        if not isinstance(value, (str, datetime.date, numpy.datetime64)):
+            return True
+        try:
+            value = pandas.Timestamp(value)
+        except ValueError:
+            return True
+        if value.tzinfo is not None:
+            # Timestamps with a timezone are stored in UTC
+            value = value.tz_convert(None)
+    elif isinstance(low, bytes) and isinstance(value, str):
+        value = value.encode("UTF-8")
+    try:
+        if op == "==":
+            return bool(low <= value <= high)
+        if op == "!=":
+            return not bool(low == value == high)
+        if op == ">":
+            return bool(high > value)
+        if op == ">=":
+            return bool(high >= value)
+        if op == "<":
+            return bool(low < value)
+        if op == "<=":
+            return bool(low <= value)
+    except TypeError:
+        pass
+    return True
+
+
+def parquet_row_groups(pf, comparisons=None):
+    """Return the indexes of the row groups that may match all comparisons"""
+    count = len(pf.row_groups)
+    keep = list(range(count))
+    if not comparisons:
+        return keep
+    stats = pf.statistics
+    for path, op, value in comparisons:
+        if len(path) != 1:
+            continue
+        low = stats["min"].get(path[0])
+        high = stats["max"].get(path[0])
+        if low is None or high is None or len(low) != count or len(high) != count:
+            continue
+        nulls = stats.get("null_count", {}).get(path[0])
+        if nulls is None or len(nulls) != count:
+            nulls = [None] * count
+        keep = [
+            idx
+            for idx in keep
+            if stats_may_match(low[idx], high[idx], op, value, nulls[idx])
+        ]
+    return keep
+
+
+def read_parquet(fn, columns=None, comparisons=None, limit=None):
+    """
+    Yield the rows of a parquet file as dicts
+
+    The file is read one row group at a time. If columns is given, only those
+    of them that exist in the file are read. Row groups whose min/max
+    statistics show that they can not match the comparisons are skipped, and
+    with limit only the row groups holding the first limit rows are read.
+    """
+    import warnings
+    from numba import NumbaDeprecationWarning
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=NumbaDeprecationWarning)
+        from fastparquet import ParquetFile
+
+        pf = ParquetFile(fn)
+    if columns is not None:
+        columns = [col for col in pf.columns if col in columns]
+        logger.debug("Reading columns %s of %s", columns, fn)
+    row_groups = parquet_row_groups(pf, comparisons)
+    logger.debug(
+        "Pruned %d of %d row groups of %s",
+        len(pf.row_groups) - len(row_groups),
+        len(pf.row_groups),
+        fn,
+    )
+    if limit is not None:
+        rows = 0
+        for pos, idx in enumerate(row_groups):
+            if rows >= limit:
+                logger.debug("Reading %d row groups for %d rows", pos, limit)
+                row_groups = row_groups[:pos]
+                break
+            rows += pf.row_groups[idx].num_rows
+    for idx in row_groups:
+        df = pf[idx].to_pandas(columns=columns)
+        if limit is not None:
+            df = df.iloc[:limit]
+            limit -= len(df)
+        for val in df.to_dict("records", into=OrderedDict):
             yield val
+
+
+def read_csv(fn, ordered_dict=False, strings=False, limit=None, **kwargs):
+    """
+    Yield the rows of a csv file as dicts
+
+    The file is read in chunks of CSV_CHUNK_ROWS rows with pandas, so memory
+    usage does not depend on the file size. With strings the values are read
+    with the csv module as strings, without any type inference. With limit
+    only the first limit rows are parsed.
+
+    >>> next(read_csv("tests/test.csv", strings=True))
+    {'a': '1', 'b': '2', 'c': '3'}
+    """
+    into = OrderedDict if ordered_dict else dict
+    if strings:
+        import csv
+
+        delimiter = kwargs.get("sep", kwargs.get("delimiter", ","))
+        with open(fn, newline="") as f:
+            for val in islice(csv.DictReader(f, delimiter=delimiter), limit):
+                yield into(val)
         return
-    elif ext == "csv":
-        import pandas
+    import pandas
 
-        if ordered_dict:
-            for val in pandas.read_csv(args.files[0], **kwargs).to_dict(
-                "records", into=OrderedDict
-            ):
-                yield val
+    kwargs.setdefault("chunksize", CSV_CHUNK_ROWS)
+    if limit is not None:
+        kwargs["nrows"] = limit
+    for chunk in pandas.read_csv(fn, **kwargs):
+        for val in chunk.to_dict("records", into=into):
+            yield val
+
+
+class RawFilter:
+    """
+    Check the raw text of json records before decoding them
+
+    A record passes if it contains all literals and matches all patterns,
+    which are regular expressions. Records may be str or bytes. A record
+    with \\u escapes may spell a literal with them, so it passes the
+    literals and is left for the decoder to check.
+
+    >>> grep = RawFilter(patterns=["ERR(OR)?"], literals=['"x"'])
+    >>> grep(b'{"a": "x", "level": "ERROR"}'), grep('{"a": "y", "level": "ERR"}')
+    (True, False)
+    >>> grep(b'{"a": "\\\\u0078", "level": "ERROR"}')
+    True
+    """
+
+    def __init__(self, patterns=(), literals=()):
+        self.patterns = list(patterns)
+        self.literals = list(literals)
+        self._str = ("\\u", self.literals, [re.compile(p) for p in self.patterns])
+        self._bytes = (
+            b"\\u",
+            [literal.encode("UTF-8") for literal in self.literals],
+            [re.compile(p.encode("UTF-8")) for p in self.patterns],
+        )
+
+    def __call__(self, record):
+        escape, literals, patterns = (
+            self._str if isinstance(record, str) else self._bytes
+        )
+        if not all(literal in record for literal in literals) and escape not in record:
+            return False
+        return all(pattern.search(record) for pattern in patterns)
+
+
+def excel_header(row):
+    """
+    Return the column names of a header row like pandas names them
+
+    >>> excel_header(["a", None, "a", 1, "a"])
+    ['a', 'Unnamed: 1', 'a.1', 1, 'a.2']
+    """
+    ret = []
+    seen = {}
+    for idx, val in enumerate(row):
+        name = "Unnamed: %d" % idx if val is None else val
+        if name in seen:
+            seen[name] += 1
+            name = "%s.%d" % (name, seen[name])
         else:
-            for val in pandas.read_csv(args.files[0], **kwargs).to_dict("records"):
-                yield val
-        return
-    data = ""
-    inp = json.loads
-    inf = (
-        x.decode("UTF-8")
-        for x in fileinput.input(files=args.files, openhook=openhook, mode="rb")
+            seen[name] = 0
+        ret.append(name)
+    return ret
+
+
+def read_excel(fn, ordered_dict=False, limit=None, sheet_name=0, **kwargs):
+    """
+    Yield the rows of an excel workbook as dicts
+
+    The sheet is read row by row with openpyxl in read-only mode, so memory
+    usage does not depend on the size of the workbook. The first row gives
+    the keys and empty rows are skipped. Like with pandas, the cells to the
+    right of the header get Unnamed: N keys and missing cells are None.
+    sheet_name selects the sheet by name or index, e.g. with --kwargs
+    sheet_name=Sales.
+
+    >>> next(read_excel("tests/test.xlsx"))
+    {'a': 1, 'b': 2, 'c': 3}
+    """
+    import openpyxl
+
+    if kwargs:
+        logger.warning("Ignoring unsupported excel options %s", sorted(kwargs))
+    into = OrderedDict if ordered_dict else dict
+    workbook = openpyxl.load_workbook(fn, read_only=True, data_only=True)
+    try:
+        names = workbook.sheetnames
+        if isinstance(sheet_name, str) and sheet_name not in names:
+            if sheet_name.isdigit():
+                sheet_name = int(sheet_name)
+        if isinstance(sheet_name, int):
+            sheet = workbook.worksheets[sheet_name]
+        else:
+            sheet = workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header_row = tuple(next(rows, ()))
+        header = excel_header(header_row)
+        rows = (row for row in rows if any(val is not None for val in row))
+        for row in islice(rows, limit):
+            if len(row) > len(header):
+                padding = (None,) * (len(row) - len(header_row))
+                header = excel_header(header_row + padding)
+            yield into(zip_longest(header, row))
+    finally:
+        workbook.close()
+
+
+def decode_json_records(records, ordered_dict=False, grep=None, projection=None):
+    """
+    Decode raw json records, logging the ones that can not be decoded
+
+    With grep, records whose raw text does not pass it are dropped before
+    decoding. With a codec.Projection, only its paths of objects are built.
+    When a quarantine is set, records that can not be decoded are written to
+    it instead of the log.
+    """
+    if grep is not None:
+        records = filter(grep, records)
+    loads = partial(codec.loads, ordered=ordered_dict)
+    if projection is not None and not ordered_dict:
+        loads = projection.loads
+    for val in records:
+        try:
+            obj = loads(val)
+            yield obj
+        except ValueError as ex:
+            if quarantine.quarantine is not None:
+                quarantine.quarantine.add(val)
+                continue
+            if not isinstance(ex, json.JSONDecodeError):
+                raise
+            logger.warning("Exception %s", repr(ex))
+            jerr = colorize_json_error(ex)
+            logger.warning("Error at code marker q4eh\ndata:\n%s", jerr)
+
+
+def can_mmap(fn, openhook=hook_compressed):
+    """Check if the file is an uncompressed regular json file we can mmap"""
+    ext = os.path.splitext(fn)[-1][1:]
+    return (
+        ext not in ("yaml", "yml")
+        and openhook is hook_compressed
+        and os.path.isfile(fn)
+        and compression(fn) is None
     )
 
-    def generic_constructor(loader, tag, node):
-        classname = node.__class__.__name__
-        if classname == "SequenceNode":
-            return loader.construct_sequence(node)
-        elif classname == "MappingNode":
-            return loader.construct_mapping(node)
+
+def _init_worker(backend, file_cache, bad_records):
+    """Take the settings of the main process into use in a worker process"""
+    from jf import cache as jfcache
+
+    codec.set_backend(backend)
+    jfcache.cache = file_cache
+    quarantine.quarantine = bad_records
+
+
+def worker_pool(workers):
+    """
+    Start a pool of worker processes with the settings of this process
+
+    The json backend, the input cache and the quarantine are module globals
+    set from the command line, which spawned workers would not see.
+    """
+    from multiprocessing import Pool
+    from jf import cache as jfcache
+
+    settings = (codec.backend, jfcache.cache, quarantine.quarantine)
+    return Pool(workers, initializer=_init_worker, initargs=settings)
+
+
+def _read_file_worker(task):
+    """Read all records of a single file in a worker process"""
+    fn, prefilter, kwargs = task
+    records = read_file(fn, **kwargs)
+    if prefilter is not None:
+        records = filter(prefilter, records)
+    return list(records)
+
+
+def read_files_parallel(files, workers, ordered=True, prefilter=None, **kwargs):
+    """
+    Decode files concurrently in a pool of worker processes
+
+    Records are yielded in file order unless ordered is False, in which case
+    files are yielded as soon as any worker finishes them. At most two files
+    per worker are in flight.
+    """
+    tasks = ((fn, prefilter, kwargs) for fn in files)
+    with worker_pool(workers) as pool:
+        if ordered:
+            submit = lambda task: pool.apply_async(_read_file_worker, (task,))
+            results = bounded_map(submit, tasks, 2 * workers)
+            results = (result.get() for result in results)
         else:
-            return loader.construct_scalar(node)
+            submit = lambda task, done: pool.apply_async(
+                _read_file_worker, (task,), callback=done, error_callback=done
+            )
+            results = bounded_map_unordered(submit, tasks, 2 * workers)
+        for records in results:
+            if isinstance(records, BaseException):
+                raise records
+            for val in records:
+                yield val
+
+
+def bounded_map(submit, tasks, size):
+    """
+    Submit tasks while yielding their results in order
+
+    At most size tasks are in flight, so results are not accumulated faster
+    than they are consumed.
+
+    >>> list(bounded_map(lambda x: 2 * x, [1, 2, 3], 2))
+    [2, 4, 6]
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(submit(task))
+        if len(pending) >= size:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def bounded_map_unordered(submit, tasks, size):
+    """
+    Submit tasks while yielding their results as soon as they are ready
+
+    submit(task, done) must call done with the result of the task once it is
+    ready. At most size tasks are in flight.
+
+    >>> sorted(bounded_map_unordered(lambda x, done: done(2 * x), [1, 2, 3], 2))
+    [2, 4, 6]
+    """
+    import queue
+
+    ready = queue.Queue()
+    pending = 0
+    for task in tasks:
+        submit(task, ready.put)
+        pending += 1
+        if pending >= size:
+            pending -= 1
+            yield ready.get()
+    while pending:
+        pending -= 1
+        yield ready.get()
+
+
+def _read_s3_object(task):
+    """Download and decode a single s3 object"""
+    from jf import cache as jfcache
+
+    fn, kwargs = task
+    bucket, key = parse_s3_url(fn)
+    ext = os.path.splitext(key)[-1][1:]
+    if ext in RANDOM_ACCESS_FORMATS or jfcache.cache is not None:
+        return list(read_file(fn, **kwargs))
+    body = s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def openhook(name, mode):
+        return decompress(io.BytesIO(body), key)
+
+    return list(read_file(fn, openhook=openhook, **kwargs))
+
+
+def read_s3_objects(files, workers=S3_OBJECT_WORKERS, **kwargs):
+    """
+    Fetch and decode many s3 objects concurrently
+
+    The objects are downloaded with the shared client on a bounded thread pool
+    and their records are yielded in the order of files.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    logger.info("Reading %d s3 objects with %d threads", len(files), workers)
+    with ThreadPoolExecutor(workers) as executor:
+        submit = lambda fn: executor.submit(_read_s3_object, (fn, kwargs))
+        for future in bounded_map(submit, files, 2 * workers):
+            for val in future.result():
+                yield val
+
+
+def jsonl_chunks(buf, chunk_size=CHUNK_SIZE):
+    """
+    Split a jsonl buffer to byte ranges at newline boundaries
+
+    >>> list(jsonl_chunks(b'{"a": 1}\\n{"a": 2}\\n{"a": 3}\\n', 10))
+    [(0, 18), (18, 27)]
+    """
+    size = len(buf)
+    start = 0
+    while start < size:
+        stop = buf.find(b"\n", min(start + chunk_size, size - 1))
+        stop = size if stop < 0 else stop + 1
+        yield start, stop
+        start = stop
+
+
+def is_jsonl(buf):
+    """
+    Check that the buffer starts with an object that fits on a single line
+
+    >>> is_jsonl(b'{"a": 1}\\n{"a": 2}')
+    True
+    >>> is_jsonl(b'{\\n  "a": 1\\n}')
+    False
+    """
+    from jf import jsonlgen  # cpython from jsonlgen.cc
+
+    stop = buf.find(b"\n", 0, CHUNK_SIZE)
+    head = buf[: stop if stop >= 0 else CHUNK_SIZE]
+    if not head.lstrip().startswith(b"{"):
+        return False
+    return any(True for _ in jsonlgen.spans(head))
+
+
+def _read_chunk_worker(task):
+    """
+    Decode the records of a byte range of a jsonl file in a worker process
+
+    Returns the decoded records, the number of raw records in the range and
+    whether every line of the range held exactly one record.
+    """
+    import mmap
+    from jf import jsonlgen  # cpython from jsonlgen.cc
+
+    fn, start, stop, prefilter, ordered_dict, grep, projection = task
+    with open(fn, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    spans = jsonlgen.spans(buf, start, stop)
+    try:
+        offsets = list(spans)
+        records = (buf[a:b] for a, b in offsets)
+        records = decode_json_records(records, ordered_dict, grep, projection)
+        if prefilter is not None:
+            records = filter(prefilter, records)
+        return list(records), len(offsets), spans.strict
+    finally:
+        del spans
+        buf.close()
+
 
-    if args.yamli or ext == "yaml" or ext == "yml":
-        yaml.add_multi_constructor("", generic_constructor)
-        inp = yaml.safe_load
-        data = "\n".join([l for l in inf])
+def read_file_chunked(
+    fn,
+    workers,
+    chunk_size=CHUNK_SIZE,
+    prefilter=None,
+    ordered_dict=False,
+    grep=None,
+    projection=None,
+):
+    """
+    Decode a single large jsonl file in parallel
+
+    The file is split at newline boundaries, or at the record offsets of its
+    index, to byte ranges which are decoded, and optionally filtered, in a
+    pool of worker processes. The records are yielded in input order and at
+    most two chunks per worker are in flight.
+
+    A newline is a record boundary only if every line before it held exactly
+    one record. When a chunk is not like that, the records after its last
+    complete one are read serially instead.
+    """
+    import mmap
+
+    index = LineIndex.load(fn)
+    if index is not None:
+        chunks = index.chunks(chunk_size)
+    else:
+        with open(fn, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            chunks = list(jsonl_chunks(buf, chunk_size))
+        finally:
+            buf.close()
+    logger.info("Decoding %s in %d chunks with %d workers", fn, len(chunks), workers)
+    rest = None
+    tasks = (
+        (fn, start, stop, prefilter, ordered_dict, grep, projection)
+        for start, stop in chunks
+        if rest is None
+    )
+    with worker_pool(workers) as pool:
+        submit = lambda task: pool.apply_async(_read_chunk_worker, (task,))
+        for (start, _), result in zip(chunks, bounded_map(submit, tasks, 2 * workers)):
+            records, count, strict = result.get()
+            if rest is not None:
+                # Let the chunks in flight finish, terminating busy workers
+                # may leave the pool locked
+                continue
+            for val in records:
+                yield val
+            if not strict:
+                rest = start, count
+    if rest is None:
+        return
+    logger.info("%s is not one record per line, reading the rest serially", fn)
+    start, count = rest
+    records = islice(yield_json_records_mmap(fn, start), count, None)
+    records = decode_json_records(records, ordered_dict, grep, projection)
+    if prefilter is not None:
+        records = filter(prefilter, records)
+    for val in records:
+        yield val
+
+
+def can_read_chunked(fn, yamli=False):
+    """Check if the file is a plain jsonl file that can be decoded in chunks"""
+    import mmap
+
+    if yamli or not can_mmap(fn) or os.path.getsize(fn) == 0:
+        return False
+    with open(fn, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return is_jsonl(buf)
+    finally:
+        buf.close()
+
+
+def jsonl_index(fn, yamli=False, build=False):
+    """
+    Return the sidecar index of a jsonl file or None
+
+    With build, a plain jsonl file without an up to date index is indexed
+    and the index is saved for the next time. gzip files are only indexed
+    with jf index, since that takes a full decompression.
+    """
+    if yamli or not os.path.isfile(fn):
+        return None
+    fmt = compression(fn)
+    if fmt == "gzip":
+        index = GzipIndex.load(fn)
+        if index is None:
+            return None
+        with open_checkpoint(fn) as stream:
+            head = stream.read(BLOCK_SIZE)
+    elif fmt is None and can_mmap(fn):
+        index = LineIndex.load(fn)
+        if index is None and not build:
+            return None
+        with open(fn, "rb") as f:
+            head = f.read(BLOCK_SIZE)
     else:
-        for val in yield_json_and_json_lines(inf):
+        return None
+    if not is_jsonl(head):
+        return None
+    if index is None:
+        try:
+            index = LineIndex.build(fn)
+        except ValueError as ex:
+            logger.info("Not indexing: %s", ex)
+            return None
+        try:
+            index.save()
+        except OSError as ex:
+            logger.info("Can not save the index of %s: %s", fn, ex)
+    return index
+
+
+def read_lines(
+    stream, ordered_dict=False, stop=None, pos=0, count=None, grep=None, projection=None
+):
+    """
+    Decode the records of a binary jsonl stream line by line
+
+    With stop, only the records that start before the stop offset are read,
+    when the stream starts from offset pos. With count, at most count
+    records are read.
+    """
+
+    def lines(pos, count):
+        with stream:
+            while stop is None or pos < stop:
+                if count is not None and count <= 0:
+                    return
+                line = stream.readline()
+                if not line:
+                    return
+                pos += len(line)
+                if line != b"\n":
+                    if count is not None:
+                        count -= 1
+                    yield line
+
+    return decode_json_records(lines(pos, count), ordered_dict, grep, projection)
+
+
+def follow_file(fn, interval=FOLLOW_INTERVAL, block_size=BLOCK_SIZE):
+    """
+    Yield blocks of a growing file as they are appended, like tail -F
+
+    The file is read from the start and then polled for new data every
+    interval seconds. When the file is truncated, or replaced by a new file
+    as on log rotation, None is yielded and reading starts again from the
+    start of the file. The blocks are views of a reused buffer.
+    """
+    import time
+
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    stream = None
+    while True:
+        if stream is None:
             try:
-                obj = json.loads(val, object_pairs_hook=OrderedDict)
-                yield obj
-            except json.JSONDecodeError as ex:
-                logger.warning("Exception %s", repr(ex))
-                jerr = colorize_json_error(ex)
-                logger.warning("Error at code marker q4eh\ndata:\n%s", jerr)
-    if data:
+                stream = open(fn, "rb", buffering=0)
+            except FileNotFoundError:
+                time.sleep(interval)
+                continue
+            inode = os.fstat(stream.fileno()).st_ino
+        size = stream.readinto(buf)
+        if size:
+            yield view[:size]
+            continue
         try:
-            ind = inp(data)
-            if isinstance(ind, list):
-                for val in ind:
-                    yield val
-            else:
-                yield ind
-        except Exception as ex:
-            logger.warning("%s while producing input data", UEE)
-            logger.warning("Exception %s", repr(ex))
+            st = os.stat(fn)
+        except FileNotFoundError:
+            # Rotated but the new file is not there yet
+            st = None
+        if st is not None and st.st_ino != inode:
+            logger.info("Following the new %s after rotation", fn)
+            stream.close()
+            stream = None
+            yield None
+        elif st is not None and st.st_size < stream.tell():
+            logger.info("Following %s from the start after truncation", fn)
+            stream.seek(0)
+            yield None
+        else:
+            time.sleep(interval)
+
+
+def follow_lines(blocks, max_line=FOLLOW_MAX_LINE):
+    """
+    Split the blocks of follow_file to non-empty lines
+
+    A partial line is dropped when the file is truncated or rotated, and so
+    is a line longer than max_line, so memory stays bounded however long
+    the file is followed.
+
+    >>> list(follow_lines([b'{"a": 1}\\n{"a"', b': 2}\\n\\n{"b', None, b'{"c": 3}\\n']))
+    [b'{"a": 1}', b'{"a": 2}', b'{"c": 3}']
+    """
+    pending = []  # pieces of the partial line, joined once it is complete
+    pending_size = 0
+    dropping = False
+    for block in blocks:
+        if block is None:
+            pending, pending_size = [], 0
+            dropping = False
+            continue
+        lines = bytes(block).split(b"\n")  # views of a reused buffer
+        last = lines.pop()
+        if lines:
+            pending.append(lines[0])
+            lines[0] = b"".join(pending)
+            pending, pending_size = [], 0
+            if dropping:
+                lines = lines[1:]
+                dropping = False
+        if last:
+            pending.append(last)
+            pending_size += len(last)
+        for line in lines:
+            if line.strip():
+                yield line
+        if pending_size > max_line:
+            logger.warning("Dropping a line longer than %d bytes", max_line)
+            pending, pending_size = [], 0
+            dropping = True
+
+
+def read_follow(fn, ordered_dict=False, grep=None, projection=None):
+    """Decode the records of a growing jsonl file as they are appended"""
+    records = follow_lines(follow_file(fn))
+    return decode_json_records(records, ordered_dict, grep, projection)
+
+
+def read_stream_path(stream, path, block_size=BLOCK_SIZE, close=True):
+    """
+    Yield the raw values at a path of huge json documents as bytes
+
+    The path is a dotted list of object keys, where * matches any key or list
+    item, e.g. results.items.* for the items of the results.items list. The
+    documents are scanned block by block and each value is yielded as soon
+    as it is complete, so only one value is held in memory at a time.
+
+    >>> list(read_stream_path(io.BytesIO(b'{"a": {"b": [1, {"c": 2}]}}'), "a.b.*"))
+    [b'1', b'{"c": 2}']
+    """
+    from jf import jsonlgen  # cpython from jsonlgen.cc
+
+    splitter = jsonlgen.pathsplitter(path.split("."))
+    try:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            for val in splitter.feed(block):
+                yield val
+    finally:
+        if close:
+            stream.close()
+    values, truncated = splitter.close()
+    for val in values:
+        yield val
+    if truncated:
+        logger.warning("Input ended in the middle of a value at %s", path)
+
+
+def read_tail(fn, count, ordered_dict=False, block_size=BLOCK_SIZE, projection=None):
+    """
+    Decode the last count records of a jsonl file by reading it backwards
+
+    Blocks are read from the end of the file until they hold count complete
+    lines, so the cost does not depend on the size of the file. When the last
+    lines are not exactly one record each, e.g. for top level lists or
+    records that span lines, the file is read as a whole instead.
+    """
+    from jf import jsonlgen  # cpython from jsonlgen.cc
+
+    with open(fn, "rb") as f:
+        pos = f.seek(0, io.SEEK_END)
+        data = b""
+        lines = []
+        while pos > 0 and count > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            data = f.read(size) + data
+            block_size *= 2
+            if data.count(b"\n") < count and pos > 0:
+                continue
+            lines = [line for line in data.split(b"\n") if line.strip()]
+            if pos > 0 and not data.startswith(b"\n"):
+                # The first line may have started before the block
+                lines = lines[1:]
+            if len(lines) >= count:
+                break
+    lines = lines[-count:] if count > 0 else []
+    check = jsonlgen.linecheck()
+    check.feed(b"\n".join(lines))
+    if not check.close():
+        logger.debug("Reading %s as a whole, it is not one record per line", fn)
+        records = read_file(fn, ordered_dict=ordered_dict)
+        for val in deque(records, maxlen=count):
+            yield val
+        return
+    for val in decode_json_records(lines, ordered_dict, projection=projection):
+        yield val
+
+
+def _read_gzip_part_worker(task):
+    """Decode the records of a part of an indexed gzip file in a worker process"""
+    fn, point, stop, prefilter, ordered_dict, grep, projection = task
+    stream = open_checkpoint(fn, point)
+    pos = 0
+    if point is not None:
+        pos = point.out
+        if not at_line_start(point):
+            # The record started in the previous part
+            pos += len(stream.readline())
+    records = read_lines(
+        stream, ordered_dict, stop, pos, grep=grep, projection=projection
+    )
+    if prefilter is not None:
+        records = filter(prefilter, records)
+    return list(records)
+
+
+def read_gzip_indexed(
+    fn, index, workers, prefilter=None, ordered_dict=False, grep=None, projection=None
+):
+    """
+    Decode a gzip compressed jsonl file in parallel using its index
+
+    The file is split at the checkpoints of the index, so every part is
+    decompressed and decoded independently in the worker processes.
+    """
+    parts = index.parts()
+    logger.info("Decoding %s in %d parts with %d workers", fn, len(parts), workers)
+    tasks = (
+        (fn, point, stop, prefilter, ordered_dict, grep, projection)
+        for point, stop in parts
+    )
+    with worker_pool(workers) as pool:
+        submit = lambda task: pool.apply_async(_read_gzip_part_worker, (task,))
+        for result in bounded_map(submit, tasks, 2 * workers):
+            for val in result.get():
+                yield val
+
+
+class InputStream:
+    """
+    Lazy stream of input records
+
+    The input files are opened only when the stream is iterated. Before that
+    the query can give hints to the readers, e.g. a filter that can already be
+    run in the worker processes.
+    """
+
+    def __init__(
+        self, args, openhook=hook_compressed, ordered_dict=False, **kwargs
+    ):
+        self.args = args
+        self.openhook = openhook
+        self.kwargs = kwargs
+        self.kwargs.update(
+            ordered_dict=ordered_dict,
+            yamli=bool(args.yamli),
+            csv_strings=bool(args.csv_strings),
+            xml_record=args.xml_record,
+            grep=RawFilter([args.grep]) if args.grep else None,
+            projection=None,
+            stream_path=args.stream_path,
+        )
+        self.follow = bool(args.follow)
+        self.prefilter = None
+        self.ranges = None
+        self.tail = None
+        self._index = None
+        self._index_loaded = False
+
+    def set_prefilter(self, fn):
+        """Set a picklable filter that readers may apply before yielding"""
+        self.prefilter = fn
+
+    def set_comparisons(self, comparisons):
+        """Tell the readers which (path, op, value) comparisons items must pass"""
+        self.kwargs["comparisons"] = comparisons
+
+    def set_raw_literals(self, literals):
+        """Tell the readers text that the raw json of every used record has"""
+        grep = self.kwargs["grep"]
+        patterns = grep.patterns if grep is not None else []
+        self.kwargs["grep"] = RawFilter(patterns, literals)
+
+    def set_limit(self, count):
+        """Tell the readers that the query uses only the first count records"""
+        self.kwargs["limit"] = count
+
+    def set_columns(self, paths):
+        """Tell the readers which column paths the query uses"""
+        self.kwargs["columns"] = set(path[0] for path in paths)
+        self.kwargs["projection"] = codec.Projection(paths)
+
+    def index(self, build=False):
+        """
+        Return the sidecar index of a single jsonl input file or None
+
+        With build, a plain jsonl file is indexed if it has no index yet.
+        """
+        if self._index is None and (build or not self._index_loaded):
+            files = expand_files(self.args.files)
+            args = self.args
+            if len(files) == 1 and not args.stream_path and not args.follow:
+                self._index = jsonl_index(files[0], self.args.yamli, build)
+            self._index_loaded = True
+        return self._index
+
+    def count_records(self, build=False):
+        """Return the number of input records if an index knows it, else None"""
+        index = self.index(build)
+        return index.lines if index is not None else None
+
+    def select_records(self, ranges):
+        """
+        Ask the readers to read only the given ranges of record numbers
+
+        ranges is a list of (start, stop) pairs, where stop may be None for
+        the end of the input. Returns True if the input will be read so.
+        """
+        if self.args.grep or self.index() is None:
+            return False
+        self.ranges = ranges
+        return True
+
+    def skip_records(self, count):
+        """
+        Ask the readers to skip the first count records
+
+        Returns True if the input will start from record number count.
+        """
+        return self.select_records([(count, None)])
+
+    def tail_records(self, count):
+        """
+        Ask the readers to read only the last count records
+
+        Returns True if the input is a single plain jsonl file, which can be
+        read backwards from its end.
+        """
+        files = expand_files(self.args.files)
+        args = self.args
+        if len(files) != 1 or args.yamli or args.grep or args.stream_path:
+            return False
+        if args.follow:
+            return False
+        if not can_mmap(files[0]):
+            return False
+        with open(files[0], "rb") as f:
+            if not is_jsonl(f.read(BLOCK_SIZE)):
+                return False
+        self.tail = count
+        return True
+
+    def read_ranges(self, index):
+        """Read the selected ranges of records using the index"""
+        for start, stop in self.ranges:
+            logger.debug("Reading records %s-%s of %s", start, stop, index.fn)
+            count = None if stop is None else stop - start
+            stream = index.open_record(start)
+            records = read_lines(
+                stream,
+                self.kwargs["ordered_dict"],
+                count=count,
+                projection=self.kwargs["projection"],
+            )
+            for val in records:
+                yield val
+
+    def __iter__(self):
+        args = self.args
+        kwargs = self.kwargs
+        files = expand_files(args.files)
+        logger.debug("Reading %d files", len(files))
+        workers = args.workers or 0
+        if self.follow:
+            logger.info("Following %s", files[0])
+            return read_follow(
+                files[0],
+                kwargs["ordered_dict"],
+                grep=kwargs["grep"],
+                projection=kwargs["projection"],
+            )
+        if self.tail is not None:
+            return read_tail(
+                files[0],
+                self.tail,
+                kwargs["ordered_dict"],
+                projection=kwargs["projection"],
+            )
+        index = self.index()
+        if index is not None and self.ranges is not None:
+            return self.read_ranges(index)
+        limit = kwargs.get("limit")
+        if limit is not None:
+            # Reading ahead in parallel would only decode records never used
+            logger.debug("Reading the first %d records serially", limit)
+            workers = 0
+        if isinstance(index, GzipIndex) and workers > 1:
+            return read_gzip_indexed(
+                files[0],
+                index,
+                workers,
+                prefilter=self.prefilter,
+                ordered_dict=kwargs["ordered_dict"],
+                grep=kwargs["grep"],
+                projection=kwargs["projection"],
+            )
+        chunked = len(files) == 1 and not args.stream_path
+        if workers > 1 and chunked and can_read_chunked(files[0], args.yamli):
+            return read_file_chunked(
+                files[0],
+                workers,
+                prefilter=self.prefilter,
+                ordered_dict=kwargs["ordered_dict"],
+                grep=kwargs["grep"],
+                projection=kwargs["projection"],
+            )
+        s3_many = len(files) > 1 and all(fn.startswith("s3://") for fn in files)
+        if s3_many and limit is None:
+            return read_s3_objects(files, max(workers, S3_OBJECT_WORKERS), **kwargs)
+        if workers > 1 and len(files) > 1 and "-" not in files:
+            logger.info("Reading %d files with %d workers", len(files), workers)
+            ordered = not args.unordered
+            return read_files_parallel(
+                files, workers, ordered=ordered, prefilter=self.prefilter, **kwargs
+            )
+        records = (
+            val
+            for fn in files
+            for val in read_file(fn, openhook=self.openhook, workers=workers, **kwargs)
+        )
+        return islice(records, limit)
+
+
+def read_input(args, openhook=hook_compressed, ordered_dict=False, **kwargs):
+    """Read json, jsonl and yaml data from files defined in args"""
+    return InputStream(args, openhook=openhook, ordered_dict=ordered_dict, **kwargs)
 
 
 def yield_json_and_json_lines(inp):
     """Yield  json and json lines"""
     from jf import jsonlgen  # cpython from jsonlgen.cc
     return jsonlgen.gen(iter(inp))
+
+
+def yield_json_records_mmap(fn, start=0):
+    """
+    Yield raw json records of a regular file as bytes
+
+    The file is memory mapped and the record boundaries are searched from the
+    raw bytes, so lines are never decoded to str before json.loads. With
+    start, the search starts from that offset, which must be a record start.
+    """
+    import mmap
+    from jf import jsonlgen  # cpython from jsonlgen.cc
+
+    if os.path.getsize(fn) == 0:
+        return
+    with open(fn, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    spans = jsonlgen.spans(buf, start)
+    try:
+        for start, stop in spans:
+            yield buf[start:stop]
+    finally:
+        del spans
+        buf.close()
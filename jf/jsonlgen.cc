@@ -4,91 +4,198 @@
 #include <sstream>
 #include <queue>
 #include <vector>
+#include <cstring>
+#include <cctype>
 
 #define DEBUG (0)
 
 using namespace std;
 
 typedef struct {
-    PyObject_HEAD
-    PyObject *iter;
-    queue<string> items;
-    vector<char> data;
     bool quote = 0;
     bool escape = 0;
     uint8_t obj = 0;
     uint8_t list = 0;
-    int item = -1;
-    int pos = -1;
+    char itemchar = 0;
+    long item = -1;
+    long pos = -1;
+} SplitState;
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *iter;
+    queue<string> items;
+    vector<char> data;
+    long base;
+    SplitState split;
+    /* Records are yielded as bytes if the input chunks are bytes */
+    bool binary;
 } JSONLgenState;
 
+/* Checks that every line that is not empty holds exactly one record. Only
+ * then do the lines of a file match its records, so that the file can be
+ * split, counted and read backwards by lines.
+ */
+typedef struct {
+    SplitState split;
+    long records = 0;
+    bool content = false;
+    bool empty = true;
+    bool strict = true;
+} LineCheck;
+
+typedef struct {
+    PyObject_HEAD
+    Py_buffer view;
+    bool has_view;
+    LineCheck check;
+    Py_ssize_t offset;
+    Py_ssize_t end;
+} JSONLspansState;
+
 static void
 jsonlgen_dealloc(JSONLgenState *jfstate)
 {
     Py_XDECREF(jfstate->iter);
+    jfstate->items.~queue<string>();
+    jfstate->data.~vector<char>();
     Py_TYPE(jfstate)->tp_free(jfstate);
 }
 
 
-void parsejsonl(string &str, JSONLgenState *s){
-    for(char& c : str){
-//        if(c == '\n' or c == ' ') {c = iff.get(); continue; }
-        s->pos++;
-        s->data.push_back(c);
-        if(DEBUG) cerr << c << " " << s->quote << s->escape << (int) s->obj << (int) s->list << " " << s->pos << " " << s->data.size() << endl;
-        if (s->escape > 0){
-            s->escape = 0;
-        }
-        else if(c == '\\'){
-            s->escape = 1;
-        }
-        else if(c == '"'){
-            if(s->list < 2){
-                if(s->item < 0){
-                    s->item = s->pos;
-                } else if (s->obj == 0){
-                    if(DEBUG) cerr << "yielding 1" << endl;
-                    s->items.push(string(s->data.begin() + s->item, s->data.begin() + s->pos + 1));
-                    s->item = -s->pos;
-                    //return ret;
-                }
-            }
-            s->quote = 1 - s->quote;
-        }
-        else if (s->quote > 0) ;
-        else if (c == '}'){
-            s->obj--;
-            if (s->obj == 0 and (not (s->item < 0) and s->data[s->item] == '{')){
-                if(DEBUG) cerr << "yielding 2" << endl;
-                s->items.push(string(s->data.begin() + s->item, s->data.begin() + s->pos + 1));
-                s->item = -s->pos;
+/* Feed one character to the record splitter.
+ *
+ * Returns true when a record ended at this character. The offset of the first
+ * character of the record is then stored to start.
+ */
+static inline bool splitchar(SplitState *s, char c, long *start){
+    s->pos++;
+    if(DEBUG) cerr << c << " " << s->quote << s->escape << (int) s->obj << (int) s->list << " " << s->pos << endl;
+    if (s->escape > 0){
+        s->escape = 0;
+    }
+    else if(c == '\\'){
+        s->escape = 1;
+    }
+    else if(c == '"'){
+        bool done = false;
+        if(s->list < 2){
+            if(s->item < 0){
+                s->item = s->pos;
+                s->itemchar = c;
+            } else if (s->obj == 0){
+                if(DEBUG) cerr << "yielding 1" << endl;
+                *start = s->item;
+                s->item = -1;
+                done = true;
             }
         }
-        else if (c == '{'){
-            s->obj++;
-            if(s->item < 0) { s->item = s->pos; }
+        s->quote = 1 - s->quote;
+        return done;
+    }
+    else if (s->quote > 0) ;
+    else if (c == '}'){
+        s->obj--;
+        if (s->obj == 0 and (not (s->item < 0) and s->itemchar == '{')){
+            if(DEBUG) cerr << "yielding 2" << endl;
+            *start = s->item;
+            s->item = -1;
+            return true;
         }
-        else if (c == '['){
-            s->list++;
-            if(s->list > 1 and s->item < 0) { s->item = s->pos; }
+    }
+    else if (c == '{'){
+        s->obj++;
+        if(s->item < 0) { s->item = s->pos; s->itemchar = c; }
+    }
+    else if (c == '['){
+        s->list++;
+        if(s->list > 1 and s->item < 0) { s->item = s->pos; s->itemchar = c; }
+    }
+    else if (c == ']') {
+        s->list--;
+        if (s->list == 1 and (not (s->item < 0) and s->itemchar == '[')){
+            if(DEBUG) cerr << "yielding 3" << endl;
+            *start = s->item;
+            s->item = -1;
+            return true;
         }
-        else if (c == ']') {
-            s->list--;
-            if (s->list == 1 and (not (s->item < 0) and s->data[s->item] == '[')){
-                if(DEBUG) cerr << "yielding 3" << endl;
-                s->items.push(string(s->data.begin() + s->item, s->data.begin() + s->pos + 1));
-                s->item = -s->pos;
-            }
+    }
+    return false;
+}
+
+
+static inline bool split_clean(const SplitState *s){
+    return !s->quote && !s->escape && s->obj == 0 && s->list == 0 && s->item < 0;
+}
+
+/* End a line of the line check */
+static inline void checkline(LineCheck *l){
+    if (!l->empty && (l->records != 1 || l->content || !split_clean(&l->split)))
+        l->strict = false;
+    l->records = 0;
+    l->content = false;
+    l->empty = true;
+}
+
+/* Feed one character to the record splitter and the line check.
+ *
+ * Anything but whitespace outside of records, e.g. the brackets and commas of
+ * a top level list, makes the input not strict.
+ */
+static inline bool checkchar(LineCheck *l, char c, long *start){
+    bool done = splitchar(&l->split, c, start);
+    if (c == '\n') {
+        checkline(l);
+        return done;
+    }
+    l->empty = false;
+    if (done)
+        l->records++;
+    else if (l->split.item < 0 and c != ' ' and c != '\t' and c != '\r')
+        l->content = true;
+    return done;
+}
+
+
+/* Split a chunk of input to records.
+ *
+ * Only the unfinished tail of the input is kept in data, so memory usage
+ * depends on the size of the largest record and not on the size of the
+ * whole stream. data[0] is the character at position base of the stream.
+ */
+void parsejsonl(const char *str, Py_ssize_t len, JSONLgenState *s){
+    long start;
+    s->data.insert(s->data.end(), str, str + len);
+    for(const char *end = str + len; str < end; str++){
+        if(splitchar(&s->split, *str, &start)){
+            s->items.push(string(s->data.begin() + (start - s->base),
+                                 s->data.begin() + (s->split.pos + 1 - s->base)));
         }
     }
-/*
-    if(s->item == -1 and s->item < s->pos)
-                    cerr << "yielding 4" << endl;
-        s->items.push(string(s->data.begin(), s->data.begin() + s->pos + 1));
-*/
+    if (s->split.item < 0) {
+        s->data.clear();
+        s->base = s->split.pos + 1;
+    } else if (s->split.item > s->base) {
+        s->data.erase(s->data.begin(), s->data.begin() + (s->split.item - s->base));
+        s->base = s->split.item;
+    }
 }
 
 
+static PyObject *
+jsonlgen_pop(JSONLgenState *jfstate)
+{
+    string &item = jfstate->items.front();
+    if(DEBUG) cerr << "Items has " << jfstate->items.size() << " items. Yielding " << item << endl;
+    PyObject *result;
+    if (jfstate->binary)
+        result = PyBytes_FromStringAndSize(item.data(), item.size());
+    else
+        result = PyUnicode_DecodeUTF8(item.data(), item.size(), "strict");
+    jfstate->items.pop();
+    return result;
+}
+
 static PyObject *
 jsonlgen_next(JSONLgenState *jfstate)
 {
@@ -96,13 +203,8 @@ jsonlgen_next(JSONLgenState *jfstate)
      * Returning NULL in this case is enough. The next() builtin will raise the
      * StopIteration error for us->
     */
-    if ( !jfstate->items.empty() ) {
-        string item = jfstate->items.front();
-        if(DEBUG) cerr << "Items has " << jfstate->items.size() << " items. Yielding " << item << endl;
-        PyObject *result = Py_BuildValue("s", item.c_str());
-        jfstate->items.pop();
-        return result;
-    }
+    if ( !jfstate->items.empty() )
+        return jsonlgen_pop(jfstate);
     PyObject *iterator = PyObject_GetIter(jfstate->iter);
 
     PyObject *elem;
@@ -111,17 +213,34 @@ jsonlgen_next(JSONLgenState *jfstate)
          * (elem will be NULL so we also return NULL).
         */
         if (elem) {
-            string str(PyUnicode_AsUTF8(elem));
-            parsejsonl(str, jfstate);
+            if (PyUnicode_Check(elem)) {
+                Py_ssize_t len;
+                const char *str = PyUnicode_AsUTF8AndSize(elem, &len);
+                if (!str) {
+                    Py_DECREF(elem);
+                    Py_DECREF(iterator);
+                    return NULL;
+                }
+                parsejsonl(str, len, jfstate);
+            } else {
+                /* Blocks of raw bytes, e.g. views of a reused buffer, are
+                 * copied to data right away */
+                Py_buffer view;
+                if (PyObject_GetBuffer(elem, &view, PyBUF_SIMPLE) < 0) {
+                    Py_DECREF(elem);
+                    Py_DECREF(iterator);
+                    return NULL;
+                }
+                jfstate->binary = true;
+                parsejsonl((const char *)view.buf, view.len, jfstate);
+                PyBuffer_Release(&view);
+            }
+            Py_DECREF(elem);
             if ( !jfstate->items.empty() ) {
-                string item = jfstate->items.front();
-                if(DEBUG) cerr << "Items has " << jfstate->items.size() << " items. Yielding " << item << endl;
-                PyObject *result = Py_BuildValue("s", item.c_str());
-                jfstate->items.pop();
-                return result;
+                Py_DECREF(iterator);
+                return jsonlgen_pop(jfstate);
             }
         }
-        Py_DECREF(elem);
     }
 
     /* The reference to the sequence is cleared in the first generator call
@@ -156,9 +275,11 @@ jsonlgen_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
 
     Py_INCREF(iter);
     jfstate->iter = iter;
-    jfstate->item = -1 ;
-    jfstate->pos = -1 ;
-    jfstate->items = queue<string>();
+    new (&jfstate->items) queue<string>();
+    new (&jfstate->data) vector<char>();
+    new (&jfstate->split) SplitState();
+    jfstate->base = 0;
+    jfstate->binary = false;
 
     return (PyObject *)jfstate;
 }
@@ -206,6 +327,962 @@ PyTypeObject PyJSONLgen_Type = {
 
 
 
+static PyObject *
+jsonlspans_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    static const char *kwlist[] = {"buffer", "start", "end", NULL};
+    PyObject *buffer;
+    Py_ssize_t start = 0;
+    Py_ssize_t end = -1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|nn", (char **)kwlist,
+                                     &buffer, &start, &end))
+        return NULL;
+
+    JSONLspansState *spstate = (JSONLspansState *)type->tp_alloc(type, 0);
+    if (!spstate)
+        return NULL;
+
+    if (PyObject_GetBuffer(buffer, &spstate->view, PyBUF_SIMPLE) < 0) {
+        Py_DECREF(spstate);
+        return NULL;
+    }
+    spstate->has_view = true;
+    if (end < 0 or end > spstate->view.len)
+        end = spstate->view.len;
+    if (start < 0)
+        start = 0;
+    new (&spstate->check) LineCheck();
+    /* Positions are counted from the start of the buffer */
+    spstate->check.split.pos = start - 1;
+    spstate->offset = start;
+    spstate->end = end;
+
+    return (PyObject *)spstate;
+}
+
+static void
+jsonlspans_release(JSONLspansState *spstate)
+{
+    if (spstate->has_view) {
+        PyBuffer_Release(&spstate->view);
+        spstate->has_view = false;
+    }
+}
+
+static void
+jsonlspans_dealloc(JSONLspansState *spstate)
+{
+    jsonlspans_release(spstate);
+    Py_TYPE(spstate)->tp_free(spstate);
+}
+
+static PyObject *
+jsonlspans_next(JSONLspansState *spstate)
+{
+    /* Scan the raw bytes of the buffer and return (start, end) of the next
+     * record. The buffer is released as soon as it is exhausted so that
+     * e.g. an mmap can be closed right after the iteration.
+    */
+    if (!spstate->has_view)
+        return NULL;
+    const char *buf = (const char *)spstate->view.buf;
+    long start;
+    while (spstate->offset < spstate->end) {
+        char c = buf[spstate->offset++];
+        if (checkchar(&spstate->check, c, &start))
+            return Py_BuildValue("(nn)", (Py_ssize_t)start, spstate->offset);
+    }
+    checkline(&spstate->check);
+    jsonlspans_release(spstate);
+    return NULL;
+}
+
+static PyObject *
+jsonlspans_strict(JSONLspansState *spstate, void *closure)
+{
+    return PyBool_FromLong(spstate->check.strict);
+}
+
+static PyGetSetDef jsonlspans_getset[] = {
+    {(char *)"strict", (getter)jsonlspans_strict, NULL,
+     (char *)"True if every line that is not empty held exactly one record, "
+     "valid once the spans are exhausted", NULL},
+    {NULL}
+};
+
+PyTypeObject PyJSONLspans_Type = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "spans",                        /* tp_name */
+    sizeof(JSONLspansState),        /* tp_basicsize */
+    0,                              /* tp_itemsize */
+    (destructor)jsonlspans_dealloc, /* tp_dealloc */
+    0,                              /* tp_print */
+    0,                              /* tp_getattr */
+    0,                              /* tp_setattr */
+    0,                              /* tp_reserved */
+    0,                              /* tp_repr */
+    0,                              /* tp_as_number */
+    0,                              /* tp_as_sequence */
+    0,                              /* tp_as_mapping */
+    0,                              /* tp_hash */
+    0,                              /* tp_call */
+    0,                              /* tp_str */
+    0,                              /* tp_getattro */
+    0,                              /* tp_setattro */
+    0,                              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,             /* tp_flags */
+    "spans(buffer, start=0, end=-1) -> iterator of (start, end) record offsets", /* tp_doc */
+    0,                              /* tp_traverse */
+    0,                              /* tp_clear */
+    0,                              /* tp_richcompare */
+    0,                              /* tp_weaklistoffset */
+    PyObject_SelfIter,              /* tp_iter */
+    (iternextfunc)jsonlspans_next,  /* tp_iternext */
+    0,                              /* tp_methods */
+    0,                              /* tp_members */
+    jsonlspans_getset,              /* tp_getset */
+    0,                              /* tp_base */
+    0,                              /* tp_dict */
+    0,                              /* tp_descr_get */
+    0,                              /* tp_descr_set */
+    0,                              /* tp_dictoffset */
+    0,                              /* tp_init */
+    PyType_GenericAlloc,            /* tp_alloc */
+    jsonlspans_new,                 /* tp_new */
+};
+
+
+typedef struct {
+    PyObject_HEAD
+    LineCheck check;
+} LineCheckState;
+
+static PyObject *
+linecheck_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    if (!PyArg_ParseTuple(args, ":linecheck"))
+        return NULL;
+    LineCheckState *st = (LineCheckState *)type->tp_alloc(type, 0);
+    if (!st)
+        return NULL;
+    new (&st->check) LineCheck();
+    return (PyObject *)st;
+}
+
+static void
+linecheck_dealloc(LineCheckState *st)
+{
+    Py_TYPE(st)->tp_free(st);
+}
+
+static PyObject *
+linecheck_feed(LineCheckState *st, PyObject *args)
+{
+    Py_buffer view;
+    if (!PyArg_ParseTuple(args, "y*:feed", &view))
+        return NULL;
+    const char *p = (const char *)view.buf;
+    long start;
+    for (const char *end = p + view.len; p < end; p++)
+        checkchar(&st->check, *p, &start);
+    PyBuffer_Release(&view);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+linecheck_close(LineCheckState *st, PyObject *args)
+{
+    checkline(&st->check);
+    return PyBool_FromLong(st->check.strict);
+}
+
+static PyMethodDef linecheck_methods[] = {
+    {"feed", (PyCFunction)linecheck_feed, METH_VARARGS,
+     "feed(data) -> check the next bytes of the input"},
+    {"close", (PyCFunction)linecheck_close, METH_NOARGS,
+     "close() -> True if every line that is not empty held exactly one record"},
+    {NULL}
+};
+
+PyTypeObject PyLineCheck_Type = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "linecheck",                      /* tp_name */
+    sizeof(LineCheckState),           /* tp_basicsize */
+    0,                                /* tp_itemsize */
+    (destructor)linecheck_dealloc,    /* tp_dealloc */
+    0,                                /* tp_print */
+    0,                                /* tp_getattr */
+    0,                                /* tp_setattr */
+    0,                                /* tp_reserved */
+    0,                                /* tp_repr */
+    0,                                /* tp_as_number */
+    0,                                /* tp_as_sequence */
+    0,                                /* tp_as_mapping */
+    0,                                /* tp_hash */
+    0,                                /* tp_call */
+    0,                                /* tp_str */
+    0,                                /* tp_getattro */
+    0,                                /* tp_setattro */
+    0,                                /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,               /* tp_flags */
+    "linecheck() -> check that json input holds one record per line", /* tp_doc */
+    0,                                /* tp_traverse */
+    0,                                /* tp_clear */
+    0,                                /* tp_richcompare */
+    0,                                /* tp_weaklistoffset */
+    0,                                /* tp_iter */
+    0,                                /* tp_iternext */
+    linecheck_methods,                /* tp_methods */
+    0,                                /* tp_members */
+    0,                                /* tp_getset */
+    0,                                /* tp_base */
+    0,                                /* tp_dict */
+    0,                                /* tp_descr_get */
+    0,                                /* tp_descr_set */
+    0,                                /* tp_dictoffset */
+    0,                                /* tp_init */
+    PyType_GenericAlloc,              /* tp_alloc */
+    linecheck_new,                    /* tp_new */
+};
+
+
+/* Projection: decode only some paths of a json object.
+ *
+ * The paths are given as a tree of dicts, where a key maps to None for a
+ * value that is decoded as a whole, or to a dict of the keys needed from an
+ * object value. Everything else is skipped without building Python objects.
+ */
+struct ProjectionNode {
+    vector<string> keys;
+    vector<PyObject *> pykeys;
+    /* Index of the node of an object value, or -1 to decode it whole */
+    vector<int> children;
+};
+
+typedef struct {
+    PyObject_HEAD
+    vector<ProjectionNode> *nodes;
+    PyObject *loads;
+} ProjectionState;
+
+struct JSONScanner {
+    const char *p;
+    const char *end;
+};
+
+static inline void skip_ws(JSONScanner *s)
+{
+    while (s->p < s->end &&
+           (*s->p == ' ' || *s->p == '\n' || *s->p == '\r' || *s->p == '\t'))
+        s->p++;
+}
+
+/* Skip a string starting at the opening quote. Sets escaped if the string
+ * has escape sequences. Control characters and invalid escapes are errors.
+ */
+static inline bool skip_string(JSONScanner *s, bool *escaped)
+{
+    const char *p = s->p + 1;
+    *escaped = false;
+    while (p < s->end) {
+        unsigned char c = *p;
+        if (c == '"') {
+            s->p = p + 1;
+            return true;
+        }
+        if (c < 0x20)
+            return false;
+        if (c != '\\') {
+            p++;
+            continue;
+        }
+        *escaped = true;
+        if (p + 1 >= s->end)
+            return false;
+        c = p[1];
+        if (c == 'u') {
+            if (s->end - p < 6)
+                return false;
+            for (int i = 2; i < 6; i++)
+                if (!isxdigit((unsigned char)p[i]))
+                    return false;
+            p += 6;
+        } else if (c && strchr("\"\\/bfnrt", c)) {
+            p += 2;
+        } else
+            return false;
+    }
+    return false;
+}
+
+static inline bool skip_digits(JSONScanner *s)
+{
+    const char *start = s->p;
+    while (s->p < s->end && *s->p >= '0' && *s->p <= '9')
+        s->p++;
+    return s->p > start;
+}
+
+/* Skip a number, which has no leading zeros or plus sign in json */
+static bool skip_number(JSONScanner *s)
+{
+    if (s->p < s->end && *s->p == '-')
+        s->p++;
+    if (s->p < s->end && *s->p == '0')
+        s->p++;
+    else if (s->p >= s->end || *s->p < '1' || *s->p > '9' || !skip_digits(s))
+        return false;
+    if (s->p < s->end && *s->p == '.') {
+        s->p++;
+        if (!skip_digits(s))
+            return false;
+    }
+    if (s->p < s->end && (*s->p == 'e' || *s->p == 'E')) {
+        s->p++;
+        if (s->p < s->end && (*s->p == '+' || *s->p == '-'))
+            s->p++;
+        if (!skip_digits(s))
+            return false;
+    }
+    return true;
+}
+
+static inline bool skip_literal(JSONScanner *s, const char *literal, size_t len)
+{
+    if ((size_t)(s->end - s->p) < len || memcmp(s->p, literal, len) != 0)
+        return false;
+    s->p += len;
+    return true;
+}
+
+/* Skip any json value, checking that it is valid json. Values nested
+ * deeper than MAX_DEPTH are errors, so that json decides on them.
+ */
+#define MAX_DEPTH 512
+
+static bool skip_value(JSONScanner *s, int depth = 0)
+{
+    bool escaped;
+    if (s->p >= s->end || depth > MAX_DEPTH)
+        return false;
+    char c = *s->p;
+    if (c == '"')
+        return skip_string(s, &escaped);
+    if (c == 't')
+        return skip_literal(s, "true", 4);
+    if (c == 'f')
+        return skip_literal(s, "false", 5);
+    if (c == 'n')
+        return skip_literal(s, "null", 4);
+    if (c != '{' && c != '[')
+        return skip_number(s);
+    char close = c == '{' ? '}' : ']';
+    s->p++;
+    skip_ws(s);
+    if (s->p < s->end && *s->p == close) {
+        s->p++;
+        return true;
+    }
+    while (true) {
+        if (close == '}') {
+            if (s->p >= s->end || *s->p != '"' || !skip_string(s, &escaped))
+                return false;
+            skip_ws(s);
+            if (s->p >= s->end || *s->p != ':')
+                return false;
+            s->p++;
+            skip_ws(s);
+        }
+        if (!skip_value(s, depth + 1))
+            return false;
+        skip_ws(s);
+        if (s->p < s->end && *s->p == ',') {
+            s->p++;
+            skip_ws(s);
+            continue;
+        }
+        if (s->p < s->end && *s->p == close) {
+            s->p++;
+            return true;
+        }
+        return false;
+    }
+}
+
+/* Decode a value of the span with the common cases done here */
+static PyObject *
+decode_value(ProjectionState *st, const char *start, const char *stop, bool escaped)
+{
+    Py_ssize_t len = stop - start;
+    if (*start == '"' && !escaped)
+        return PyUnicode_DecodeUTF8(start + 1, len - 2, "strict");
+    if (len == 4 && memcmp(start, "true", 4) == 0)
+        Py_RETURN_TRUE;
+    if (len == 5 && memcmp(start, "false", 5) == 0)
+        Py_RETURN_FALSE;
+    if (len == 4 && memcmp(start, "null", 4) == 0)
+        Py_RETURN_NONE;
+    if (len > 0 && len < 19) {
+        bool integer = true;
+        for (Py_ssize_t i = (*start == '-'); i < len; i++)
+            integer = integer && start[i] >= '0' && start[i] <= '9';
+        if (integer && len > (*start == '-'))
+            return PyLong_FromString(string(start, len).c_str(), NULL, 10);
+    }
+    PyObject *data = PyBytes_FromStringAndSize(start, len);
+    if (!data)
+        return NULL;
+    PyObject *ret = PyObject_CallFunctionObjArgs(st->loads, data, NULL);
+    Py_DECREF(data);
+    return ret;
+}
+
+static PyObject *
+projection_error(JSONScanner *s, const char *start)
+{
+    PyErr_Format(PyExc_ValueError, "Invalid json at offset %zd",
+                 (Py_ssize_t)(s->p - start));
+    return NULL;
+}
+
+/* Find the index of the key of a node, decoding escaped keys */
+static int
+find_key(ProjectionState *st, ProjectionNode &node, const char *start,
+         const char *stop, bool escaped)
+{
+    if (!escaped) {
+        size_t len = stop - start - 2;
+        for (size_t i = 0; i < node.keys.size(); i++)
+            if (node.keys[i].size() == len &&
+                memcmp(node.keys[i].data(), start + 1, len) == 0)
+                return (int)i;
+        return -1;
+    }
+    PyObject *key = decode_value(st, start, stop, escaped);
+    if (!key)
+        return -2;
+    int ret = -1;
+    for (size_t i = 0; i < node.pykeys.size() && ret < 0; i++) {
+        int eq = PyObject_RichCompareBool(key, node.pykeys[i], Py_EQ);
+        if (eq < 0) {
+            ret = -2;
+            break;
+        }
+        if (eq)
+            ret = (int)i;
+    }
+    Py_DECREF(key);
+    return ret;
+}
+
+static PyObject *
+project_object(ProjectionState *st, JSONScanner *s, int nodeidx, const char *doc)
+{
+    ProjectionNode &node = (*st->nodes)[nodeidx];
+    PyObject *ret = PyDict_New();
+    if (!ret)
+        return NULL;
+    s->p++;
+    skip_ws(s);
+    if (s->p < s->end && *s->p == '}') {
+        s->p++;
+        return ret;
+    }
+    while (true) {
+        bool escaped;
+        const char *key = s->p;
+        if (s->p >= s->end || *s->p != '"' || !skip_string(s, &escaped))
+            goto error;
+        int idx = find_key(st, node, key, s->p, escaped);
+        if (idx == -2) {
+            Py_DECREF(ret);
+            return NULL;
+        }
+        skip_ws(s);
+        if (s->p >= s->end || *s->p != ':')
+            goto error;
+        s->p++;
+        skip_ws(s);
+        const char *value = s->p;
+        if (idx >= 0) {
+            PyObject *val;
+            int child = node.children[idx];
+            if (child >= 0 && s->p < s->end && *s->p == '{') {
+                val = project_object(st, s, child, doc);
+            } else {
+                bool value_escaped = false;
+                if (s->p < s->end && *s->p == '"') {
+                    if (!skip_string(s, &value_escaped))
+                        goto error;
+                } else if (!skip_value(s))
+                    goto error;
+                if (s->p == value)
+                    goto error;
+                val = decode_value(st, value, s->p, value_escaped);
+            }
+            if (!val || PyDict_SetItem(ret, node.pykeys[idx], val) < 0) {
+                Py_XDECREF(val);
+                Py_DECREF(ret);
+                return NULL;
+            }
+            Py_DECREF(val);
+        } else if (!skip_value(s) || s->p == value)
+            goto error;
+        skip_ws(s);
+        if (s->p < s->end && *s->p == ',') {
+            s->p++;
+            skip_ws(s);
+            continue;
+        }
+        if (s->p < s->end && *s->p == '}') {
+            s->p++;
+            return ret;
+        }
+        goto error;
+    }
+error:
+    Py_DECREF(ret);
+    if (!PyErr_Occurred())
+        projection_error(s, doc);
+    return NULL;
+}
+
+/* Add the node of a dict of the path tree and return its index */
+static int
+add_projection_node(vector<ProjectionNode> *nodes, PyObject *tree)
+{
+    int idx = (int)nodes->size();
+    nodes->push_back(ProjectionNode());
+    PyObject *key, *child;
+    Py_ssize_t pos = 0;
+    while (PyDict_Next(tree, &pos, &key, &child)) {
+        if (!PyUnicode_Check(key))
+            continue;
+        Py_ssize_t len;
+        const char *utf8 = PyUnicode_AsUTF8AndSize(key, &len);
+        if (!utf8)
+            return -1;
+        int childidx = -1;
+        if (PyDict_Check(child)) {
+            /* Only objects with plain keys are projected */
+            PyObject *subkey, *subchild;
+            Py_ssize_t subpos = 0;
+            bool plain = PyDict_Size(child) > 0;
+            while (PyDict_Next(child, &subpos, &subkey, &subchild))
+                plain = plain && PyUnicode_Check(subkey);
+            if (plain) {
+                childidx = add_projection_node(nodes, child);
+                if (childidx < 0)
+                    return -1;
+            }
+        }
+        ProjectionNode &node = (*nodes)[idx];
+        node.keys.push_back(string(utf8, len));
+        Py_INCREF(key);
+        node.pykeys.push_back(key);
+        node.children.push_back(childidx);
+    }
+    return idx;
+}
+
+static void
+projection_clear_nodes(ProjectionState *st)
+{
+    if (st->nodes) {
+        for (auto &node : *st->nodes)
+            for (auto key : node.pykeys)
+                Py_DECREF(key);
+        delete st->nodes;
+        st->nodes = NULL;
+    }
+}
+
+static PyObject *
+projection_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    static const char *kwlist[] = {"tree", "loads", NULL};
+    PyObject *tree;
+    PyObject *loads;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!O", (char **)kwlist,
+                                     &PyDict_Type, &tree, &loads))
+        return NULL;
+
+    ProjectionState *st = (ProjectionState *)type->tp_alloc(type, 0);
+    if (!st)
+        return NULL;
+    st->nodes = new vector<ProjectionNode>();
+    Py_INCREF(loads);
+    st->loads = loads;
+    if (add_projection_node(st->nodes, tree) < 0) {
+        Py_DECREF(st);
+        return NULL;
+    }
+    return (PyObject *)st;
+}
+
+static void
+projection_dealloc(ProjectionState *st)
+{
+    projection_clear_nodes(st);
+    Py_XDECREF(st->loads);
+    Py_TYPE(st)->tp_free(st);
+}
+
+static PyObject *
+projection_call(ProjectionState *st, PyObject *args, PyObject *kwargs)
+{
+    /* Return the projected dict of a json document, or None if the
+     * document is not an object. Invalid json raises ValueError.
+     */
+    PyObject *data;
+    if (!PyArg_ParseTuple(args, "O", &data))
+        return NULL;
+    Py_buffer view;
+    if (PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0)
+        return NULL;
+    const char *doc = (const char *)view.buf;
+    JSONScanner s = {doc, doc + view.len};
+    skip_ws(&s);
+    PyObject *ret;
+    if (s.p >= s.end || *s.p != '{') {
+        Py_INCREF(Py_None);
+        ret = Py_None;
+    } else {
+        ret = project_object(st, &s, 0, doc);
+        skip_ws(&s);
+        if (ret && s.p != s.end) {
+            Py_DECREF(ret);
+            ret = projection_error(&s, doc);
+        }
+    }
+    PyBuffer_Release(&view);
+    return ret;
+}
+
+PyTypeObject PyProjection_Type = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "projection",                   /* tp_name */
+    sizeof(ProjectionState),        /* tp_basicsize */
+    0,                              /* tp_itemsize */
+    (destructor)projection_dealloc, /* tp_dealloc */
+    0,                              /* tp_print */
+    0,                              /* tp_getattr */
+    0,                              /* tp_setattr */
+    0,                              /* tp_reserved */
+    0,                              /* tp_repr */
+    0,                              /* tp_as_number */
+    0,                              /* tp_as_sequence */
+    0,                              /* tp_as_mapping */
+    0,                              /* tp_hash */
+    (ternaryfunc)projection_call,   /* tp_call */
+    0,                              /* tp_str */
+    0,                              /* tp_getattro */
+    0,                              /* tp_setattro */
+    0,                              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,             /* tp_flags */
+    "projection(tree, loads)(data) -> dict of the paths in tree or None", /* tp_doc */
+    0,                              /* tp_traverse */
+    0,                              /* tp_clear */
+    0,                              /* tp_richcompare */
+    0,                              /* tp_weaklistoffset */
+    0,                              /* tp_iter */
+    0,                              /* tp_iternext */
+    0,                              /* tp_methods */
+    0,                              /* tp_members */
+    0,                              /* tp_getset */
+    0,                              /* tp_base */
+    0,                              /* tp_dict */
+    0,                              /* tp_descr_get */
+    0,                              /* tp_descr_set */
+    0,                              /* tp_dictoffset */
+    0,                              /* tp_init */
+    PyType_GenericAlloc,            /* tp_alloc */
+    projection_new,                 /* tp_new */
+};
+
+
+/* Path splitter: yield the values at a path of huge json documents.
+ *
+ * The documents are fed in blocks of any size and scanned one character at a
+ * time, so only the value being captured is kept in memory. The path is a
+ * list of object keys, where "*" matches any key or any list item.
+ */
+struct PathLevel {
+    bool object;
+    bool matches;
+    string key;
+};
+
+typedef struct {
+    PyObject_HEAD
+    vector<string> *path;
+    vector<PathLevel> *stack;
+    string *captured;
+    string *key;
+    bool in_string;
+    bool string_is_key;
+    bool escape;
+    bool in_scalar;
+    bool expect_key;
+    long capture_depth;
+} PathSplitterState;
+
+static void
+pathsplitter_dealloc(PathSplitterState *st)
+{
+    delete st->path;
+    delete st->stack;
+    delete st->captured;
+    delete st->key;
+    Py_TYPE(st)->tp_free(st);
+}
+
+static PyObject *
+pathsplitter_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    static const char *kwlist[] = {"path", NULL};
+    PyObject *path;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O", (char **)kwlist, &path))
+        return NULL;
+    PyObject *seq = PySequence_Fast(path, "path must be a sequence of keys");
+    if (!seq)
+        return NULL;
+    PathSplitterState *st = (PathSplitterState *)type->tp_alloc(type, 0);
+    if (!st) {
+        Py_DECREF(seq);
+        return NULL;
+    }
+    st->path = new vector<string>();
+    st->stack = new vector<PathLevel>();
+    st->captured = new string();
+    st->key = new string();
+    st->capture_depth = -1;
+    for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(seq); i++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+        Py_ssize_t len;
+        const char *utf8 = NULL;
+        if (PyUnicode_Check(item))
+            utf8 = PyUnicode_AsUTF8AndSize(item, &len);
+        if (!utf8) {
+            if (!PyErr_Occurred())
+                PyErr_SetString(PyExc_TypeError, "path keys must be strings");
+            Py_DECREF(seq);
+            Py_DECREF(st);
+            return NULL;
+        }
+        st->path->push_back(string(utf8, len));
+    }
+    Py_DECREF(seq);
+    return (PyObject *)st;
+}
+
+/* Check if a value starting now is on the path, and if it should be captured */
+static inline bool
+path_value_start(PathSplitterState *st, char c)
+{
+    size_t depth = st->stack->size();
+    bool matches = true;
+    if (depth > 0) {
+        PathLevel &parent = st->stack->back();
+        matches = parent.matches && depth <= st->path->size();
+        if (matches) {
+            const string &want = (*st->path)[depth - 1];
+            matches = want == "*" || (parent.object && parent.key == want);
+        }
+    }
+    if (matches && depth == st->path->size() && st->capture_depth < 0) {
+        st->capture_depth = depth;
+        st->captured->assign(1, c);
+    }
+    return matches;
+}
+
+/* Return the captured value if the value that ended at this depth is it */
+static inline bool
+path_value_end(PathSplitterState *st, PyObject *ret)
+{
+    if (st->capture_depth != (long)st->stack->size())
+        return true;
+    st->capture_depth = -1;
+    PyObject *value = PyBytes_FromStringAndSize(st->captured->data(),
+                                                st->captured->size());
+    st->captured->clear();
+    if (!value)
+        return false;
+    int err = PyList_Append(ret, value);
+    Py_DECREF(value);
+    return err == 0;
+}
+
+static PyObject *
+pathsplitter_feed(PathSplitterState *st, PyObject *args)
+{
+    /* Scan a block of the documents and return the values on the path that
+     * were completed in it as a list of bytes.
+     */
+    Py_buffer view;
+    if (!PyArg_ParseTuple(args, "y*", &view))
+        return NULL;
+    PyObject *ret = PyList_New(0);
+    if (!ret) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    const char *buf = (const char *)view.buf;
+    vector<PathLevel> &stack = *st->stack;
+    bool ok = true;
+    for (Py_ssize_t i = 0; i < view.len && ok; i++) {
+        char c = buf[i];
+        if (st->capture_depth >= 0)
+            st->captured->push_back(c);
+        if (st->in_string) {
+            if (st->escape)
+                st->escape = false;
+            else if (c == '\\')
+                st->escape = true;
+            else if (c == '"') {
+                st->in_string = false;
+                if (!st->string_is_key)
+                    ok = path_value_end(st, ret);
+                else if (!stack.empty())
+                    stack.back().key.swap(*st->key);
+                st->string_is_key = false;
+                continue;
+            }
+            if (st->string_is_key)
+                st->key->push_back(c);
+            continue;
+        }
+        if (st->in_scalar) {
+            if (c != ',' && c != '}' && c != ']' && c != ' ' && c != '\n' &&
+                c != '\r' && c != '\t')
+                continue;
+            st->in_scalar = false;
+            if (st->capture_depth == (long)stack.size())
+                st->captured->pop_back();
+            ok = path_value_end(st, ret);
+            if (!ok)
+                break;
+        }
+        switch (c) {
+        case ' ': case '\n': case '\r': case '\t': case ':':
+            break;
+        case ',':
+            st->expect_key = !stack.empty() && stack.back().object;
+            break;
+        case '"':
+            st->in_string = true;
+            st->string_is_key = st->expect_key;
+            if (st->expect_key) {
+                st->expect_key = false;
+                st->key->clear();
+            } else
+                path_value_start(st, c);
+            break;
+        case '{': case '[': {
+            bool matches = path_value_start(st, c);
+            stack.push_back(PathLevel());
+            stack.back().object = c == '{';
+            stack.back().matches = matches;
+            st->expect_key = c == '{';
+            break;
+        }
+        case '}': case ']':
+            if (stack.empty()) {
+                PyErr_SetString(PyExc_ValueError, "Unbalanced json brackets");
+                ok = false;
+                break;
+            }
+            stack.pop_back();
+            st->expect_key = false;
+            ok = path_value_end(st, ret);
+            break;
+        default:
+            st->in_scalar = true;
+            path_value_start(st, c);
+        }
+    }
+    PyBuffer_Release(&view);
+    if (!ok) {
+        Py_DECREF(ret);
+        return NULL;
+    }
+    return ret;
+}
+
+static PyObject *
+pathsplitter_close(PathSplitterState *st, PyObject *args)
+{
+    /* End the input: a value ended by the end of the input is returned, and
+     * True tells that the input ended in the middle of a value on the path.
+     */
+    PyObject *ret = PyList_New(0);
+    if (!ret)
+        return NULL;
+    if (st->in_scalar) {
+        st->in_scalar = false;
+        if (!path_value_end(st, ret)) {
+            Py_DECREF(ret);
+            return NULL;
+        }
+    }
+    PyObject *truncated = PyBool_FromLong(st->capture_depth >= 0);
+    return Py_BuildValue("(NN)", ret, truncated);
+}
+
+static PyMethodDef pathsplitter_methods[] = {
+    {"feed", (PyCFunction)pathsplitter_feed, METH_VARARGS,
+     "feed(data) -> list of the values completed in data as bytes"},
+    {"close", (PyCFunction)pathsplitter_close, METH_NOARGS,
+     "close() -> (list of the last values, truncated)"},
+    {NULL, NULL, 0, NULL}
+};
+
+PyTypeObject PyPathSplitter_Type = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "pathsplitter",                   /* tp_name */
+    sizeof(PathSplitterState),        /* tp_basicsize */
+    0,                                /* tp_itemsize */
+    (destructor)pathsplitter_dealloc, /* tp_dealloc */
+    0,                                /* tp_print */
+    0,                                /* tp_getattr */
+    0,                                /* tp_setattr */
+    0,                                /* tp_reserved */
+    0,                                /* tp_repr */
+    0,                                /* tp_as_number */
+    0,                                /* tp_as_sequence */
+    0,                                /* tp_as_mapping */
+    0,                                /* tp_hash */
+    0,                                /* tp_call */
+    0,                                /* tp_str */
+    0,                                /* tp_getattro */
+    0,                                /* tp_setattro */
+    0,                                /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,               /* tp_flags */
+    "pathsplitter(path) -> splitter of the values at path of json documents", /* tp_doc */
+    0,                                /* tp_traverse */
+    0,                                /* tp_clear */
+    0,                                /* tp_richcompare */
+    0,                                /* tp_weaklistoffset */
+    0,                                /* tp_iter */
+    0,                                /* tp_iternext */
+    pathsplitter_methods,             /* tp_methods */
+    0,                                /* tp_members */
+    0,                                /* tp_getset */
+    0,                                /* tp_base */
+    0,                                /* tp_dict */
+    0,                                /* tp_descr_get */
+    0,                                /* tp_descr_set */
+    0,                                /* tp_dictoffset */
+    0,                                /* tp_init */
+    PyType_GenericAlloc,              /* tp_alloc */
+    pathsplitter_new,                 /* tp_new */
+};
+
+
 static struct PyModuleDef jsonlmodule = {
   PyModuleDef_HEAD_INIT,
   "jsonlgen",                  /* m_name */
@@ -225,5 +1302,25 @@ PyInit_jsonlgen(void)
     Py_INCREF((PyObject *)&PyJSONLgen_Type);
     PyModule_AddObject(module, "gen", (PyObject *)&PyJSONLgen_Type);
 
+    if (PyType_Ready(&PyJSONLspans_Type) < 0)
+        return NULL;
+    Py_INCREF((PyObject *)&PyJSONLspans_Type);
+    PyModule_AddObject(module, "spans", (PyObject *)&PyJSONLspans_Type);
+
+    if (PyType_Ready(&PyLineCheck_Type) < 0)
+        return NULL;
+    Py_INCREF((PyObject *)&PyLineCheck_Type);
+    PyModule_AddObject(module, "linecheck", (PyObject *)&PyLineCheck_Type);
+
+    if (PyType_Ready(&PyProjection_Type) < 0)
+        return NULL;
+    Py_INCREF((PyObject *)&PyProjection_Type);
+    PyModule_AddObject(module, "projection", (PyObject *)&PyProjection_Type);
+
+    if (PyType_Ready(&PyPathSplitter_Type) < 0)
+        return NULL;
+    Py_INCREF((PyObject *)&PyPathSplitter_Type);
+    PyModule_AddObject(module, "pathsplitter", (PyObject *)&PyPathSplitter_Type);
+
     return module;
 }
@@ -1,11 +1,11 @@
 """JF python json/yaml query engine"""
 
 import sys
-import json
 import logging
 from itertools import islice, chain
 from collections import deque, OrderedDict
 
+from jf import codec
 from jf.meta import StructEncoder, JFTransformation
 
 from pygments.lexers import get_lexer_by_name
@@ -27,7 +27,7 @@ def print_results(data, args):
         "cls": StructEncoder,
         "ensure_ascii": args.ensure_ascii,
     }
-    outfmt = json.dumps
+    outfmt = codec.dumps
     if args.yaml and not args.json:
         from ruamel import yaml
         yaml.RoundTripDumper.add_representer(
@@ -52,23 +52,17 @@ def print_results(data, args):
         for out in data:
             if args.ordered_dict:
                 if isinstance(out, list):
-                    out = json.loads(
-                        json.dumps(out, cls=StructEncoder),
-                        object_pairs_hook=OrderedDict,
-                    )
+                    out = codec.clean(out, ordered=True)
                 elif not isinstance(out, str):
-                    out = json.loads(
-                        json.dumps(out, cls=StructEncoder),
-                        object_pairs_hook=OrderedDict,
-                    )
+                    out = codec.clean(out, ordered=True)
                 elif args.raw:
                     if isinstance(out, bytes):
                         sys.stdout.write(out)
                     else:
-                        print(out)
+                        print(out, flush=bool(args.follow))
                     continue
             elif not args.raw:
-                out = json.loads(json.dumps(out, cls=StructEncoder))
+                out = codec.clean(out)
             if args.list:
                 retlist.append(out)
                 continue
@@ -88,6 +82,9 @@ def print_results(data, args):
                 sys.stdout.buffer.write(out)
             else:
                 print(ret)
+            if args.follow:
+                # Show every record right away, also through a pipe
+                sys.stdout.flush()
         if args.list:
             ret = outfmt(retlist, **out_kw_args)
             if not args.raw or args.yaml:
@@ -117,11 +114,7 @@ def result_cleaner(val):
     >>> result_cleaner({'a': 1})
     {'a': 1}
     """
-    if isinstance(val, OrderedDict):
-        return json.loads(
-            json.dumps(val, cls=StructEncoder), object_pairs_hook=OrderedDict
-        )
-    return json.loads(json.dumps(val, cls=StructEncoder))
+    return codec.clean(val, ordered=isinstance(val, OrderedDict))
 
 
 class pandasWriter(JFTransformation):
@@ -261,7 +254,7 @@ class ipy(JFTransformation):
         banner += 'named "data"\n\ndata sample:\n'
         head, data = peek(map(result_cleaner, data), 1)
         if head:
-            banner += json.dumps(head[0], indent=2, sort_keys=True)
+            banner += codec.dumps(head[0], indent=2, sort_keys=True)
         banner += "\n\n"
         if not fakerun:
             embed(banner1=banner)
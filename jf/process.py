@@ -1,11 +1,11 @@
 """JF python json/yaml query engine"""
 
 import sys
-import json
 import logging
 from datetime import datetime, timezone, timedelta
 from itertools import islice
 from collections import deque, OrderedDict
+from jf import codec
 from jf.output import result_cleaner
 from jf.meta import JFTransformation
 
@@ -56,7 +56,15 @@ def parse_value(val):
 
 class Jfislice(JFTransformation):
     """jf wrapper for itertools.islice"""
-    def _fn(self, arr):
+    def bounds(self):
+        """
+        Return the start, stop and step of the slice
+
+        >>> Jfislice(5, 10).bounds()
+        (5, 10, None)
+        >>> Jfislice(3).bounds()
+        (None, 3, None)
+        """
         args = self.args
         start = None
         step = None
@@ -70,7 +78,10 @@ class Jfislice(JFTransformation):
             stop = args[1]
         if len(args) > 2:
             step = args[2]
-        return islice(arr, start, stop, step)
+        return start, stop, step
+
+    def _fn(self, arr):
+        return islice(arr, *self.bounds())
 
 
 class FlattenItem(JFTransformation):
@@ -587,7 +598,7 @@ class Print(JFTransformation):
             n = self.args[0]
         arr = list(arr)
         for it in islice(arr, 0, n):
-            sys.stderr.write(json.dumps(it)+"\n")
+            sys.stderr.write(codec.dumps(it)+"\n")
         return arr
 
 
@@ -618,6 +629,175 @@ class Pipeline:
         return data
 
 
+def col_paths(obj):
+    """
+    Yield the paths of the input columns referenced in obj
+
+    The path of a column is the list of keys used to select it from the input
+    item. An empty path means that the whole item is used.
+
+    >>> x = Col()
+    >>> sorted(col_paths({"a": x.id, "b": [x.meta.ts > x.start]}))
+    [('id',), ('meta', 'ts'), ('start',)]
+    """
+    if isinstance(obj, Col):
+        path = []
+        selecting = True
+        for s in obj._opstrings:
+            if isinstance(s, tuple):
+                selecting = False
+                for other in s[1:]:
+                    for val in col_paths(other):
+                        yield val
+            elif selecting:
+                if isinstance(s, str):
+                    s = s.replace("__JFESCAPED__", "")
+                path.append(s)
+        yield tuple(path)
+    elif isinstance(obj, dict):
+        for val in obj.values():
+            for path in col_paths(val):
+                yield path
+    elif isinstance(obj, (list, tuple)):
+        for val in obj:
+            for path in col_paths(val):
+                yield path
+
+
+def only_cols(obj):
+    """Check that obj does not contain functions that could access anything"""
+    if isinstance(obj, Col):
+        return True
+    if isinstance(obj, dict):
+        return all(only_cols(val) for val in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return all(only_cols(val) for val in obj)
+    return not callable(obj)
+
+
+def simple_comparison(col):
+    """
+    Split a comparison of a column to a constant to (path, op, value)
+
+    Returns None if col is anything more complex.
+
+    >>> x = Col()
+    >>> simple_comparison(x.status == "error")
+    (('status',), '==', 'error')
+    >>> simple_comparison(x.a > x.b) is None
+    True
+    """
+    if not isinstance(col, Col):
+        return None
+    ops = col._opstrings
+    if len(ops) < 2 or not isinstance(ops[-1], tuple) or len(ops[-1]) != 2:
+        return None
+    op, value = ops[-1]
+    if isinstance(value, Col) or callable(value) or not isinstance(op, str):
+        return None
+    if op not in ("==", "!=", "<", ">", "<=", ">="):
+        return None
+    if not all(isinstance(key, str) for key in ops[:-1]):
+        return None
+    return tuple(key.replace("__JFESCAPED__", "") for key in ops[:-1]), op, value
+
+
+def raw_literal(comparison):
+    """
+    Return text that the raw json of an item passing a comparison contains
+
+    Only equality to a string of printable ascii characters gives a literal,
+    without the characters that some json encoders escape. The value may
+    still be spelled with \\u escapes, so the raw filter keeps the records
+    that have them.
+
+    >>> raw_literal((("level",), "==", "ERROR"))
+    '"ERROR"'
+    >>> raw_literal((("level",), "==", 'a "quote"')) is None
+    True
+    """
+    _, op, value = comparison
+    if op != "==" or not isinstance(value, str):
+        return None
+    if not all(" " <= char <= "~" for char in value):
+        return None
+    if any(char in value for char in "\"\\/<>&'"):
+        return None
+    return '"%s"' % value
+
+
+def referenced_paths(transformations):
+    """
+    Find the input columns a pipeline needs
+
+    Returns the set of column paths the pipeline reads from the input items,
+    or None if the pipeline may need the whole items. Items pass unchanged
+    through filters, slices and sorts, so the paths are only known when a map
+    builds new items out of the columns before the output.
+
+    >>> x = Col()
+    >>> referenced_paths([Filter(x.a > 1), Map({"id": x.id})]) == {("a",), ("id",)}
+    True
+    >>> referenced_paths([Filter(x.a > 1)]) is None
+    True
+    """
+    paths = set()
+    for t in transformations:
+        if isinstance(t, (First, Last, Jfislice, Identity)):
+            continue
+        if isinstance(t, (Filter, Sorted, Unique)):
+            if not t.args or not isinstance(t.args[0], Col):
+                return None
+            projecting = False
+        elif isinstance(t, (Map, YieldAll)):
+            if not t.args or not isinstance(t.args[0], (Col, dict, list, tuple)):
+                return None
+            projecting = True
+        else:
+            return None
+        if not only_cols(t.args):
+            return None
+        paths.update(col_paths(t.args))
+        if () in paths or ("dict",) in paths:
+            return None
+        if projecting:
+            return paths
+    return None
+
+
+# Transformations that yield exactly one item for every input item
+ONE_TO_ONE = (Map, Update, Hide, Identity)
+
+
+def leading_limit(transformations):
+    """
+    Find the number of input items a pipeline reads at most
+
+    Returns None if the pipeline may read all of the input, i.e. if it does
+    not start with first(N) or a slice after transformations that keep one
+    item per input item.
+
+    >>> x = Col()
+    >>> leading_limit([Map(x.a), First(3)])
+    3
+    >>> leading_limit([Jfislice(5, 10)])
+    10
+    >>> leading_limit([Filter(x.a > 1), First(3)]) is None
+    True
+    """
+    for t in transformations:
+        if isinstance(t, ONE_TO_ONE):
+            continue
+        if isinstance(t, First):
+            shown = t.args[0] if len(t.args) == 1 else 1
+            return shown if isinstance(shown, int) else 1
+        if isinstance(t, Jfislice):
+            stop = t.bounds()[1]
+            return stop if isinstance(stop, int) else None
+        return None
+    return None
+
+
 class GenProcessor:
     """Make a generator pipeline"""
 
@@ -630,8 +810,117 @@ class GenProcessor:
         """Add filter to pipeline"""
         self._filters.append(fun)
 
+    def pushdown(self):
+        """Give the input source hints about the pipeline
+
+        A leading filter on a column can be run by the input readers already,
+        e.g. in the worker processes that decode the input. The filter is kept
+        in the pipeline as well.
+
+        If the pipeline only uses some of the input columns, the readers are
+        told which ones so they can skip reading the rest. Comparisons of
+        columns to constants in the leading filters are passed on too, so that
+        e.g. parquet row groups that can not match are skipped. Equality to a
+        string also gives text that raw json records must contain to match,
+        so the others are not decoded at all. A leading first(N) or slice
+        tells the readers to stop after the records it uses.
+        """
+        if not self._filters:
+            return
+        if hasattr(self.igen, "skip_records"):
+            self.push_positions()
+        if hasattr(self.igen, "set_limit"):
+            limit = leading_limit(self._filters)
+            if limit is not None:
+                logger.debug("Pushing limit %d down to input", limit)
+                self.igen.set_limit(limit)
+        if hasattr(self.igen, "set_columns"):
+            paths = referenced_paths(self._filters)
+            if paths is not None:
+                logger.debug("Pushing columns %s down to input", paths)
+                self.igen.set_columns(paths)
+        if hasattr(self.igen, "set_comparisons"):
+            comparisons = []
+            for t in self._filters:
+                if not isinstance(t, Filter) or not t.args:
+                    break
+                comparison = simple_comparison(t.args[0])
+                if comparison is not None:
+                    comparisons.append(comparison)
+            if comparisons:
+                logger.debug("Pushing comparisons %s down to input", comparisons)
+                self.igen.set_comparisons(comparisons)
+            literals = [raw_literal(comparison) for comparison in comparisons]
+            literals = [literal for literal in literals if literal is not None]
+            if literals and hasattr(self.igen, "set_raw_literals"):
+                logger.debug("Pushing raw text %s down to input", literals)
+                self.igen.set_raw_literals(literals)
+        first = self._filters[0]
+        if not hasattr(self.igen, "set_prefilter"):
+            return
+        if not isinstance(first, Filter) or not isinstance(first.args[0], Col):
+            return
+        import pickle
+
+        try:
+            pickle.dumps(first.args[0])
+        except Exception as ex:
+            logger.debug("Can not push filter down to input: %s", ex)
+            return
+        logger.debug("Pushing filter down to input")
+        self.igen.set_prefilter(first.args[0])
+
+    def push_positions(self):
+        """
+        Let the input read only the records a slice or last(N) uses
+
+        The slice or last(N) may come after transformations that keep one
+        item per input record, e.g. map, so the positions are the same.
+
+        An input with an index can seek to a record without reading the
+        records before it. A slice is then shifted by the skipped records.
+        Without an index, last(N) reads a plain jsonl file backwards from its
+        end. firstnlast(N) reads the whole input anyway, so it may build the
+        index of a plain jsonl file on the way.
+        """
+        pos = 0
+        while isinstance(self._filters[pos], ONE_TO_ONE):
+            pos += 1
+            if pos == len(self._filters):
+                return
+        first = self._filters[pos]
+        if isinstance(first, Jfislice):
+            start, stop, step = first.bounds()
+            if not isinstance(start, int) or start <= 0:
+                return
+            if not self.igen.skip_records(start):
+                return
+            logger.debug("Skipping %d records in input", start)
+            if stop is not None:
+                stop = max(0, stop - start)
+            self._filters[pos] = Jfislice(0, stop, step)
+        elif isinstance(first, (Last, Firstnlast)):
+            shown = first.args[0] if len(first.args) == 1 else 1
+            if not isinstance(shown, int):
+                shown = 1
+            if isinstance(first, Last):
+                count = self.igen.count_records()
+                if count is None and self.igen.tail_records(shown):
+                    logger.debug("Reading %d last records backwards", shown)
+                    return
+            else:
+                count = self.igen.count_records(build=True)
+            if isinstance(first, Last) and count is not None and count > shown:
+                logger.debug("Skipping %d records in input", count - shown)
+                self.igen.skip_records(count - shown)
+            if isinstance(first, Firstnlast) and count is not None:
+                if count > 2 * shown:
+                    logger.debug("Reading %d first and last records", shown)
+                    self.igen.select_records([(0, shown), (count - shown, count)])
+
     def process(self):
         """Process items"""
+        self.pushdown()
         pipeline = Pipeline(*self._filters)
         result = pipeline.transform(self.igen, gen=True)
         return result
@@ -0,0 +1,88 @@
+"""JF quarantine for input records that can not be decoded"""
+
+import os
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+quarantine = None
+
+
+class Quarantine:
+    """
+    Write the raw input records that can not be decoded to a file
+
+    Every record is appended to the file and counted in shared counters, so
+    worker processes can quarantine records too. A worker that gets the
+    quarantine pickled, e.g. when it is spawned, opens the file again for
+    appending. The cost of a bad record is writing it out, nothing is logged
+    per record.
+
+    >>> import shutil, tempfile
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> fn = os.path.join(tmpdir, "bad.jsonl")
+    >>> q = Quarantine(fn)
+    >>> q.add(b'{"a": ')
+    >>> q.add('{"b"}\\n')
+    >>> q.close()
+    >>> open(fn, "rb").read()
+    b'{"a": \\n{"b"}\\n'
+    >>> q.summary() == "2 bad records (13 bytes) written to %s" % fn
+    True
+    >>> shutil.rmtree(tmpdir)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+        self.fd = os.open(path, flags, 0o666)
+        self.records = multiprocessing.Value("q", 0)
+        self.size = multiprocessing.Value("q", 0)
+
+    def add(self, record):
+        """Append a raw record, bytes or str, to the file as a line"""
+        if isinstance(record, str):
+            record = record.encode("UTF-8")
+        record = bytes(record)
+        if not record.endswith(b"\n"):
+            record += b"\n"
+        view = memoryview(record)
+        while view:
+            view = view[os.write(self.fd, view) :]
+        with self.records.get_lock():
+            self.records.value += 1
+        with self.size.get_lock():
+            self.size.value += len(record)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["fd"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def summary(self):
+        """Return a one line summary of the quarantined records"""
+        return "%d bad records (%d bytes) written to %s" % (
+            self.records.value,
+            self.size.value,
+            self.path,
+        )
+
+    def close(self):
+        """Close the quarantine file"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def set_quarantine(path):
+    """Quarantine bad input records to path or log them again with None"""
+    global quarantine
+    if quarantine is not None:
+        quarantine.close()
+    quarantine = Quarantine(path) if path else None
+    return quarantine
@@ -40,6 +40,12 @@ setup(
             sources=["jf/jsonlgen.cc"],
             extra_compile_args=["-std=c++11"],
         ),
+        Extension(
+            "jf.gzindex",
+            sources=["jf/gzindex.cc"],
+            libraries=["z"],
+            extra_compile_args=["-std=c++11"],
+        ),
     ],
     install_requires=[
         "pygments>=2.4.0",
@@ -61,7 +67,7 @@ setup(
         "nose>=1.3.0",
         "pandas>=0.22.0",
         "xlrd>=1.1.0",
-        "openpyxl>=2.5.4",
+        "openpyxl>=2.6.0",
         "pylint>=1.8.2",
         "pytest",
         "pytest-flake8",
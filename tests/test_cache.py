@@ -0,0 +1,47 @@
+"""Test the local input cache"""
+
+import os
+import shutil
+import time
+import tempfile
+import unittest
+
+from jf.cache import FileCache
+
+
+class TestFileCache(unittest.TestCase):
+    """Test the on-disk LRU cache"""
+
+    def setUp(self):
+        cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cachedir, ignore_errors=True)
+        self.cache = FileCache(cachedir, max_size=10)
+
+    def test_keys(self):
+        """Test that every part of the key is used"""
+        self.cache.put(("bucket", "key", "etag1"), lambda f: f.write(b"1"))
+        self.assertIsNone(self.cache.get("bucket", "key", "etag2"))
+        self.assertIsNone(self.cache.get("bucket", "key2", "etag1"))
+        self.assertIsNotNone(self.cache.get("bucket", "key", "etag1"))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used files are evicted first"""
+        first = self.cache.put(("a",), lambda f: f.write(b"1234"))
+        os.utime(first, (time.time() - 10, time.time() - 10))
+        second = self.cache.put(("b",), lambda f: f.write(b"1234"))
+        os.utime(second, (time.time() - 20, time.time() - 20))
+        self.assertEqual(self.cache.get("a"), first)
+        self.cache.put(("c",), lambda f: f.write(b"1234"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), first)
+
+    def test_failed_write(self):
+        """Test that a failed write leaves nothing behind"""
+
+        def write(f):
+            f.write(b"partial")
+            raise IOError("connection lost")
+
+        with self.assertRaises(IOError):
+            self.cache.put(("a",), write)
+        self.assertEqual(os.listdir(self.cache.path), [])
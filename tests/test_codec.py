@@ -0,0 +1,138 @@
+"""Tests for the JF json codec"""
+# -*- coding: utf-8 -*-
+import sys
+import unittest
+import importlib
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import StringIO
+
+from jf import codec
+from jf.meta import Struct
+from jf.output import print_results
+
+DATA = [
+    {"id": 1, "name": "Äiti", "tags": ["a", "€", "😀"], "nested": {"b": 2, "a": None}},
+    OrderedDict([("z", 1.5), ("y", 1e-05), ("x", 1e16), ("w", float("nan"))]),
+    {"empty": {}, "list": [], "flag": True, "text": 'quote " and \\ and \n'},
+    {"big": 2 ** 70, "neg": -0.0, "float": 0.1 + 0.2, "ctrl": "\x01\x7f"},
+    "plain string",
+    [1, 2, [3, {"k": "v"}]],
+]
+
+
+def installed_backends():
+    """Return the json backends that can be imported"""
+    ret = ["json"]
+    for name in codec.BACKENDS:
+        try:
+            importlib.import_module(name)
+            ret.append(name)
+        except ImportError:
+            pass
+    return ret
+
+
+@contextmanager
+def json_backend(name):
+    """Use the given backend temporarily"""
+    previous = codec.backend
+    codec.set_backend(name)
+    try:
+        yield
+    finally:
+        codec.set_backend(previous)
+
+
+def render(data, **kwargs):
+    """Print results to a string"""
+    args = {"raw": 0, "html_unescape": 0, "bw": 1, "forcecolor": 0}
+    args.update(kwargs)
+    old_out = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        print_results(data, Struct(**args))
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = old_out
+
+
+class TestJfCodec(unittest.TestCase):
+    """JF json codec testcases"""
+
+    def test_loads_fallback(self):
+        """Test documents the fast decoders do not accept"""
+        for name in installed_backends():
+            with json_backend(name):
+                self.assertEqual(codec.loads('{"a": %d}' % 2 ** 70), {"a": 2 ** 70})
+                for val in (-(2 ** 63) - 1, -9999999999999999999, 2 ** 64):
+                    self.assertEqual(codec.loads('{"a": %d}' % val), {"a": val})
+                    self.assertEqual(codec.loads(b"[%d]" % val), [val])
+                self.assertEqual(codec.loads(b'[1.5, "\\u00e4"]'), [1.5, "ä"])
+
+    def test_loads_error(self):
+        """Test that decoding errors are the ones from json"""
+        from json import JSONDecodeError
+
+        for name in installed_backends():
+            with json_backend(name):
+                with self.assertRaises(JSONDecodeError):
+                    codec.loads('{"a": 1, b: 2}')
+
+    def test_byte_identical_output(self):
+        """Test that all backends print exactly the same output"""
+        options = itertools.product([0, 1], [None, 2, 4], [0, 1], [0, 1])
+        for sort_keys, indent, ensure_ascii, ordered_dict in options:
+            kwargs = dict(
+                sort_keys=sort_keys,
+                indent=indent,
+                ensure_ascii=ensure_ascii,
+                ordered_dict=ordered_dict,
+            )
+            with json_backend("json"):
+                expected = render(DATA, **kwargs)
+            for name in installed_backends():
+                with json_backend(name):
+                    self.assertEqual(render(DATA, **kwargs), expected, (name, kwargs))
+
+    def test_projection(self):
+        """Test that projected documents give the same values for their paths"""
+        import pickle
+        from json import JSONDecodeError
+        from jf.process import Col
+
+        paths = [("id",), ("nested", "b"), ("tags",), ("text",), ("big",), ("z",)]
+        paths += [("nested", "missing"), ("list", "x"), ("tags", 1), ("ctrl",)]
+        projection = pickle.loads(pickle.dumps(codec.Projection(paths)))
+        for doc in DATA:
+            data = codec.dumps(doc)
+            for raw in (data, data.encode("UTF-8"), "\n %s \n" % data):
+                full, projected = codec.loads(raw), projection.loads(raw)
+                for path in paths:
+                    expected = codec.dumps(Col(list(path)).transform(full))
+                    result = codec.dumps(Col(list(path)).transform(projected))
+                    self.assertEqual(result, expected, (data, path))
+        result = projection.loads(b'{"i\\u0064": 1, "id2": 2, "nested": {"b": 3}}')
+        self.assertEqual(result, {"id": 1, "nested": {"b": 3}})
+        result = projection.loads(b'{"id": -9223372036854775809, "z": -1e400}')
+        self.assertEqual(result["id"], -9223372036854775809)
+        invalid = [
+            '{"id": 1, "a": [}',
+            '{"id": 1} 2',
+            '{"a": "x}',
+            '{"id": 01}',
+            '{"id": -01}',
+            '{"id": 1.}',
+            '{"text": "a\tb"}',
+            '{"a\x01": 1, "id": 1}',
+            '{"z": tru, "id": 1}',
+            '{"a": [1, nul], "id": 1}',
+            '{"a": {"b" 1}, "id": 1}',
+            '{"a": "\\x", "id": 1}',
+            '{"a": "\\u12", "id": 1}',
+            '{"a": +1, "id": 1}',
+        ]
+        for data in invalid:
+            with self.assertRaises(JSONDecodeError, msg=data):
+                projection.loads(data)
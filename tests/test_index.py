@@ -0,0 +1,258 @@
+"""Tests for the JF sidecar indexes"""
+
+import os
+import zlib
+import shutil
+import tempfile
+import unittest
+
+from jf.index import GzipIndex, LineIndex, INDEX_SUFFIX
+from jf.input import read_input, read_tail
+from jf.meta import Struct
+from jf.process import Col, Filter, Firstnlast, Jfislice, Last, Map, GenProcessor
+
+
+def jsonl(start, stop):
+    """Return jsonl records with some empty lines in between"""
+    return b"".join(
+        b'{"a": %d, "b": "%s"}\n%s' % (idx, b"x" * (idx % 30), b"\n" * (idx % 7 == 0))
+        for idx in range(start, stop)
+    )
+
+
+def gzip_member(data):
+    """Compress data to a gzip member of many small deflate blocks"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31, 1)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TestGzipIndex(unittest.TestCase):
+    """Test random access to gzip compressed jsonl"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, "data.jsonl.gz")
+        # Two members and a last record without a newline
+        with open(self.fn, "wb") as f:
+            f.write(gzip_member(jsonl(0, 3000)))
+            f.write(gzip_member(jsonl(3000, 5000) + b'{"a": 5000}'))
+        self.records = [{"a": idx, "b": "x" * (idx % 30)} for idx in range(5000)]
+        self.records.append({"a": 5000})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build(self):
+        """Test counting records and saving the checkpoints"""
+        index = GzipIndex.build(self.fn, 10000)
+        self.assertEqual(index.lines, 5001)
+        self.assertGreater(len(index.points), 10)
+        index.save()
+        loaded = GzipIndex.load(self.fn)
+        self.assertEqual(loaded.points, index.points)
+        self.assertEqual(loaded.lines, index.lines)
+
+    def test_out_of_date(self):
+        """Test ignoring the index when the file has changed"""
+        GzipIndex.build(self.fn, 10000).save()
+        with open(self.fn, "ab") as f:
+            f.write(gzip_member(b'{"a": 1}\n'))
+        self.assertIsNone(GzipIndex.load(self.fn))
+        self.assertIsNone(GzipIndex.load(self.fn + ".missing"))
+
+    def test_open_record(self):
+        """Test seeking to records around the checkpoints"""
+        index = GzipIndex.build(self.fn, 10000)
+        for record in [0, 1, 2999, 3000, 5000] + [p.lines for p in index.points]:
+            for val in (record - 1, record, record + 1):
+                if not 0 <= val <= 5000:
+                    continue
+                with index.open_record(val) as stream:
+                    line = b"\n"
+                    while line == b"\n":
+                        line = stream.readline()
+                self.assertTrue(line.startswith(b'{"a": %d' % val), (val, line))
+
+    def test_skip_records(self):
+        """Test pushing slices and last down to an indexed file"""
+        GzipIndex.build(self.fn, 10000).save()
+        args = Struct(files=[self.fn])
+        query = [Jfislice(4000, 4003)]
+        result = list(GenProcessor(read_input(args), query).process())
+        self.assertEqual(result, self.records[4000:4003])
+        self.assertEqual(query[0].bounds(), (0, 3, None))
+        inp = read_input(args)
+        result = list(GenProcessor(inp, [Last(2)]).process())
+        self.assertEqual(result, self.records[-2:])
+        self.assertEqual(inp.ranges, [(4999, None)])
+
+    def test_parallel_parts(self):
+        """Test decoding the parts of an indexed file in worker processes"""
+        GzipIndex.build(self.fn, 10000).save()
+        args = Struct(files=[self.fn], workers=3)
+        self.assertEqual(list(read_input(args)), self.records)
+
+    def test_not_jsonl(self):
+        """Test that other json is not indexed"""
+        from jf.__main__ import main
+
+        with open(self.fn, "wb") as f:
+            f.write(gzip_member(b'[\n{"a": 1},\n\n{"a": 2}\n]\n'))
+        with self.assertRaises(ValueError):
+            GzipIndex.build(self.fn, 10000)
+        main(["index", self.fn])
+        self.assertFalse(os.path.exists(self.fn + INDEX_SUFFIX))
+        inp = read_input(Struct(files=[self.fn]))
+        self.assertIsNone(inp.count_records())
+        result = list(GenProcessor(inp, [Jfislice(1, 2)]).process())
+        self.assertEqual(result, [{"a": 2}])
+
+    def test_list_lines(self):
+        """Test that lines of lists, whose items are records, are not indexed"""
+        with open(self.fn, "wb") as f:
+            data = b'{"a": 0}\n{"a": 1}\n[{"a": 2}, {"a": 3}]\n{"a": 4}\n'
+            f.write(gzip_member(data))
+        with self.assertRaises(ValueError):
+            GzipIndex.build(self.fn, 10000)
+        inp = read_input(Struct(files=[self.fn]))
+        result = list(GenProcessor(inp, [Jfislice(2, 5)]).process())
+        self.assertEqual(result, [{"a": 2}, {"a": 3}, {"a": 4}])
+
+    def test_index_command(self):
+        """Test building an index with jf index"""
+        from jf.__main__ import main
+
+        main(["index", "--span", "1", self.fn])
+        self.assertEqual(GzipIndex.load(self.fn).lines, 5001)
+
+    def test_index_query(self):
+        """Test that a query that is index is not taken as the subcommand"""
+        from jf.__main__ import is_index_command
+
+        self.assertTrue(is_index_command(["index", "-d", self.fn]))
+        self.assertFalse(is_index_command(["index", self.fn + ".missing"]))
+        self.assertFalse(is_index_command(["--", "index", self.fn]))
+
+
+class TestLineIndex(unittest.TestCase):
+    """Test random access to plain jsonl"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, "data.jsonl")
+        with open(self.fn, "wb") as f:
+            f.write(jsonl(0, 1000))
+        self.records = [{"a": idx, "b": "x" * (idx % 30)} for idx in range(1000)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def query(self, transformations):
+        """Run a list of transformations on the file"""
+        inp = read_input(Struct(files=[self.fn]))
+        return list(GenProcessor(inp, transformations).process())
+
+    def test_build(self):
+        """Test finding the record offsets and saving them"""
+        index = LineIndex.build(self.fn)
+        self.assertEqual(index.lines, 1000)
+        index.save()
+        loaded = LineIndex.load(self.fn)
+        self.assertEqual(list(loaded.offsets), list(index.offsets))
+        with open(self.fn, "ab") as f:
+            f.write(b'{"a": 1000}\n')
+        self.assertIsNone(LineIndex.load(self.fn))
+
+    def test_lazy_build(self):
+        """Test indexing the file on the first firstnlast(N)"""
+        self.assertEqual(self.query([Jfislice(990, 992)]), self.records[990:992])
+        self.assertEqual(self.query([Last(3)]), self.records[-3:])
+        self.assertFalse(os.path.exists(self.fn + INDEX_SUFFIX))
+        result = self.query([Firstnlast(3)])
+        self.assertEqual(result, [self.records[:3], self.records[-3:]])
+        self.assertEqual(LineIndex.load(self.fn).lines, 1000)
+        query = [Jfislice(990, 992)]
+        self.assertEqual(self.query(query), self.records[990:992])
+        self.assertEqual(query[0].bounds(), (0, 2, None))
+
+    def test_tail(self):
+        """Test reading the last records backwards from the end"""
+        for count in (0, 1, 7, 100, 999, 1000, 2000):
+            for block_size in (1, 100, 1 << 20):
+                result = list(read_tail(self.fn, count, block_size=block_size))
+                expected = self.records[-count:] if count else []
+                self.assertEqual(result, expected, (count, block_size))
+        with open(self.fn, "ab") as f:
+            f.write(b'{"a": 1000}')
+        self.assertEqual(list(read_tail(self.fn, 1, block_size=5)), [{"a": 1000}])
+
+    def test_tail_multiline(self):
+        """Test reading the tail of a file with a record that spans lines"""
+        with open(self.fn, "ab") as f:
+            f.write(b'{"a": 1000,\n "b": "x"}\n{"a": 1001}\n[{"a": 1002}]\n')
+        records = self.records + [{"a": 1000, "b": "x"}, {"a": 1001}, {"a": 1002}]
+        for count in (1, 2, 3, 4):
+            result = list(read_tail(self.fn, count, block_size=5))
+            self.assertEqual(result, records[-count:], count)
+
+    def test_tail_after_map(self):
+        """Test pushing last(N) through transformations of every record"""
+        x = Col()
+        inp = read_input(Struct(files=[self.fn]))
+        query = [Map(x.a), Last(2)]
+        self.assertEqual(list(GenProcessor(inp, query).process()), [998, 999])
+        self.assertEqual(inp.tail, 2)
+        inp = read_input(Struct(files=[self.fn]))
+        query = [Filter(x.a < 10), Last(2)]
+        self.assertEqual(list(GenProcessor(inp, query).process()), self.records[8:10])
+        self.assertIsNone(inp.tail)
+
+    def test_firstnlast(self):
+        """Test reading only the first and last records"""
+        LineIndex.build(self.fn).save()
+        inp = read_input(Struct(files=[self.fn]))
+        result = list(GenProcessor(inp, [Firstnlast(2)]).process())
+        self.assertEqual(result, [self.records[:2], self.records[-2:]])
+        self.assertEqual(inp.ranges, [(0, 2), (998, 1000)])
+
+    def test_not_line_records(self):
+        """Test that files not of one record per line are not indexed"""
+        layouts = [
+            '{"a": 0}\n{"a": 1}\n[{"a": 2}, {"a": 3}]\n{"a": 4}\n{"a": 5}\n',
+            '{"a": 0}\n{"a": 1,\n "b": 1}\n{"a": 2}\n{"a": 3}\n{"a": 4}\n',
+        ]
+        for layout in layouts:
+            with open(self.fn, "w") as f:
+                f.write(layout)
+            records = list(read_input(Struct(files=[self.fn])))
+            result = self.query([Firstnlast(1)])
+            self.assertEqual(result, [records[:1], records[-1:]])
+            self.assertFalse(os.path.exists(self.fn + INDEX_SUFFIX))
+            self.assertEqual(self.query([Jfislice(1, 3)]), records[1:3])
+            self.assertEqual(self.query([Jfislice(2, 5)]), records[2:5])
+            self.assertEqual(self.query([Last(3)]), records[-3:])
+            with self.assertRaises(ValueError):
+                LineIndex.build(self.fn)
+
+    def test_chunks(self):
+        """Test splitting the file at the indexed record offsets"""
+        from jf.input import read_file_chunked
+
+        index = LineIndex.build(self.fn)
+        chunks = index.chunks(1000)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(self.fn))
+        self.assertTrue(all(stop in index.offsets for _, stop in chunks[:-1]))
+        index.save()
+        result = list(read_file_chunked(self.fn, 2, chunk_size=1000))
+        self.assertEqual(result, self.records)
+
+    def test_not_jsonl(self):
+        """Test that other json is not indexed"""
+        with open(self.fn, "w") as f:
+            f.write('[\n{"a": 1},\n{"a": 2}\n]\n')
+        self.assertEqual(self.query([Last(1)]), [{"a": 2}])
+        self.assertFalse(os.path.exists(self.fn + INDEX_SUFFIX))
+        with open(self.fn, "w") as f:
+            f.write('{"a": 1}\n[{"a": 2}, {"a": 3}]\n')
+        self.assertEqual(list(read_tail(self.fn, 2)), [{"a": 2}, {"a": 3}])
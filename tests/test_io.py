@@ -1,5 +1,6 @@
 """Tests for the JF tool input/output module"""
 # -*- coding: utf-8 -*-
+import os
 import sys
 import unittest
 import json
@@ -7,7 +8,8 @@ from ruamel import yaml
 
 from io import BytesIO
 
-from jf.input import read_input, yield_json_and_json_lines, import_error
+from jf.input import read_input, read_file, yield_json_and_json_lines, import_error
+from jf.input import RawFilter
 from jf.output import print_results
 from jf.meta import Struct
 
@@ -34,6 +36,13 @@ class BrokenPipeOutput:
         raise BrokenPipeError
 
 
+def worker_settings():
+    """Return the settings of a worker process"""
+    from jf import cache, codec, quarantine
+
+    return codec.backend, cache.cache.path, quarantine.quarantine.path
+
+
 class TestJfIO(unittest.TestCase):
     """Basic jf io testcases"""
 
@@ -158,6 +167,52 @@ class TestJfIO(unittest.TestCase):
         result = list(read_input(args))
         self.assertEqual(result, [{"a": 1, "b": 2, "c": 3}, {"a": 4, "b": 5, "c": 6}])
 
+    def test_excel_sheets(self):
+        """Test streaming the rows of a selected excel sheet"""
+        import tempfile
+        import openpyxl
+        from jf.input import read_excel
+
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["first"])
+        sheet = workbook.create_sheet("Data")
+        sheet.append(["id", "name", "id", None])
+        for idx in range(100):
+            sheet.append([idx, "row %d" % idx, -idx, None])
+            if idx == 10:
+                sheet.append([])
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f:
+            workbook.save(f.name)
+            result = list(read_input(Struct(files=[f.name]), sheet_name="Data"))
+            self.assertEqual(len(result), 100)
+            self.assertEqual(
+                result[11], {"id": 11, "name": "row 11", "id.1": -11, "Unnamed: 3": None}
+            )
+            result = list(read_excel(f.name, sheet_name="1", limit=2))
+            self.assertEqual([val["id"] for val in result], [0, 1])
+            self.assertEqual(list(read_excel(f.name)), [])
+
+    def test_excel_wide_rows(self):
+        """Test keeping the cells of rows wider than the header"""
+        import tempfile
+        import openpyxl
+        from jf.input import read_excel
+
+        workbook = openpyxl.Workbook()
+        for row in (["a", "b"], [1, 2], [3, 4, 5], [6]):
+            workbook.active.append(row)
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f:
+            workbook.save(f.name)
+            result = list(read_excel(f.name))
+        self.assertEqual(
+            result,
+            [
+                {"a": 1, "b": 2, "Unnamed: 2": None},
+                {"a": 3, "b": 4, "Unnamed: 2": 5},
+                {"a": 6, "b": None, "Unnamed: 2": None},
+            ],
+        )
+
     def test_xml_string(self):
         """Test simple query"""
         args = Struct(**{"files": ["tests/test.xml"]})
@@ -271,3 +326,735 @@ class TestJfIO(unittest.TestCase):
         result = list(yield_json_and_json_lines([test_str]))
         expected = ['"a"', '{"a": 2353, "b": "sdaf\\"}f32"}', '{"a": 646}']
         self.assertEqual(result, expected)
+
+    def test_multiple_files(self):
+        """Test reading every file in the argument list"""
+        args = Struct(**{"files": ["tests/test.csv", "tests/test.jsonl"]})
+
+        result = list(read_input(args))
+        self.assertEqual(result[:2], [{"a": 1, "b": 2, "c": 3}, {"a": 4, "b": 5, "c": 6}])
+        self.assertEqual(len(result), 2 + len(list(read_file("tests/test.jsonl"))))
+
+    def test_parallel_files(self):
+        """Test reading files with a worker pool"""
+        args = Struct(**{"files": ["tests/test.csv"] * 3, "workers": 2})
+
+        result = list(read_input(args))
+        self.assertEqual(result, [{"a": 1, "b": 2, "c": 3}, {"a": 4, "b": 5, "c": 6}] * 3)
+
+    def test_parallel_files_unordered(self):
+        """Test reading files with a worker pool without ordering"""
+        args = Struct(
+            **{"files": ["tests/test.csv"] * 3, "workers": 2, "unordered": 1}
+        )
+
+        result = list(read_input(args))
+        self.assertEqual(len(result), 6)
+        args.files = ["tests/test.jsonl"] * 10
+        result = list(read_input(args))
+        expected = list(read_file("tests/test.jsonl")) * 10
+        self.assertEqual(sorted(map(str, result)), sorted(map(str, expected)))
+        args.files = ["tests/test.csv", "tests/missing.jsonl"]
+        with self.assertRaises(FileNotFoundError):
+            list(read_input(args))
+
+    def test_directory_input(self):
+        """Test reading all files in a directory"""
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for idx in range(3):
+                with open(os.path.join(tmpdir, "%d.jsonl" % idx), "w") as f:
+                    f.write('{"a": %d}\n' % idx)
+            args = Struct(**{"files": [tmpdir]})
+            result = list(read_input(args))
+        self.assertEqual(result, [{"a": 0}, {"a": 1}, {"a": 2}])
+
+    def test_jsonl_spans(self):
+        """Test record boundaries from raw bytes"""
+        from jf import jsonlgen
+
+        test_bytes = b'{"a": 2353}\n{"a": "}\\"{"}\n"a"'
+        result = [test_bytes[start:stop] for start, stop in jsonlgen.spans(test_bytes)]
+        self.assertEqual(result, [b'{"a": 2353}', b'{"a": "}\\"{"}', b'"a"'])
+
+    def test_jsonl_spans_range(self):
+        """Test record boundaries from a byte range"""
+        from jf import jsonlgen
+
+        test_bytes = b'{"a": 1}\n{"a": 2}\n{"a": 3}\n'
+        result = list(jsonlgen.spans(test_bytes, 9, 18))
+        self.assertEqual(result, [(9, 17)])
+
+    def test_jsonl_file_mmap(self):
+        """Test reading a regular jsonl file through mmap"""
+        import tempfile
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write('{"a": 1}\n{"a": 2, b: 5}\n["x", "y"]\n')
+            f.flush()
+            result = list(read_file(f.name))
+        self.assertEqual(result, [{"a": 1}, "x", "y"])
+
+    def test_jsonl_split_over_chunks(self):
+        """Test records that continue over several input chunks"""
+        test_strs = ['{"a": ', '"b"}\n{"c"', ": [1, 2]}\n", '{"d": 3}']
+        result = list(yield_json_and_json_lines(test_strs))
+        self.assertEqual(result, ['{"a": "b"}', '{"c": [1, 2]}', '{"d": 3}'])
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "needs /proc")
+    def test_jsonl_stream_memory(self):
+        """Test that splitting a long stream keeps memory usage flat"""
+
+        def rss():
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+        line = '{"a": "%s"}\n' % ("x" * (1 << 20))
+        count = (256 << 20) // len(line)
+        before = rss()
+        peak = before
+        for idx, _ in enumerate(yield_json_and_json_lines([line] * count)):
+            if idx % 64 == 0:
+                peak = max(peak, rss())
+        self.assertEqual(idx, count - 1)
+        self.assertLess(peak - before, 64 << 20)
+
+    def test_compressed_formats(self):
+        """Test reading zstd and lz4 files by extension and magic bytes"""
+        import tempfile
+
+        body = b"".join(b'{"a": %d}\n' % idx for idx in range(100))
+        expected = [{"a": idx} for idx in range(100)]
+        compressors = []
+        try:
+            import zstandard
+
+            compressors.append((".zst", zstandard.ZstdCompressor().compress))
+        except ImportError:
+            pass
+        try:
+            import lz4.frame
+
+            compressors.append((".lz4", lz4.frame.compress))
+        except ImportError:
+            pass
+        if not compressors:
+            self.skipTest("zstandard and lz4 are not installed")
+        for suffix, compress in compressors:
+            for name in ("data.jsonl" + suffix, "data.jsonl"):
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    fn = os.path.join(tmpdir, name)
+                    with open(fn, "wb") as f:
+                        f.write(compress(body))
+                    self.assertEqual(list(read_file(fn)), expected)
+
+    def test_gzip_parallel_members(self):
+        """Test decompressing the members of a gzip file in parallel"""
+        import gzip
+        import tempfile
+        from jf.input import parallel_decompress
+
+        body = b"".join(b'{"a": %d}\n' % idx for idx in range(10000))
+        members = [body[idx : idx + 1000] for idx in range(0, len(body), 1000)]
+        with tempfile.NamedTemporaryFile(suffix=".jsonl.gz") as f:
+            f.write(b"".join(gzip.compress(member) for member in members))
+            f.flush()
+            result = b"".join(parallel_decompress(f.name, "gzip", 3, chunk_size=500))
+            self.assertEqual(result, body)
+            result = list(read_input(Struct(files=[f.name], workers=3)))
+            self.assertEqual(result, [{"a": idx} for idx in range(10000)])
+
+    def test_gzip_parallel_fallback(self):
+        """Test falling back to serial decompression without member boundaries"""
+        import gzip
+        import tempfile
+        from jf.input import parallel_decompress
+
+        body = os.urandom(100000)
+        with tempfile.NamedTemporaryFile(suffix=".gz") as f:
+            f.write(gzip.compress(body[:1000]) + gzip.compress(body))
+            f.flush()
+            result = b"".join(parallel_decompress(f.name, "gzip", 3, chunk_size=100))
+            self.assertEqual(result, body[:1000] + body)
+
+    def test_jsonl_file_chunked(self):
+        """Test decoding a single jsonl file in chunks with a worker pool"""
+        import tempfile
+        from jf.input import read_file_chunked
+        from jf.process import Col
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            for idx in range(1000):
+                f.write('{"a": %d, "b": "x\\\\n}"}\n' % idx)
+            f.flush()
+            result = list(read_file_chunked(f.name, 3, chunk_size=1000))
+            self.assertEqual([val["a"] for val in result], list(range(1000)))
+            result = list(read_file_chunked(f.name, 3, 1000, Col().a > 989))
+            self.assertEqual([val["a"] for val in result], list(range(990, 1000)))
+
+    def test_jsonl_file_chunked_multiline(self):
+        """Test decoding in chunks when records span lines over chunk boundaries"""
+        import tempfile
+        from jf.input import read_file_chunked
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            for idx in range(1000):
+                if idx % 100 == 50:
+                    f.write('{"a": %d,\n "b": ": "}\n' % idx)
+                else:
+                    f.write('{"a": %d}\n' % idx)
+            f.flush()
+            for chunk_size in (100, 333, 1000):
+                result = list(read_file_chunked(f.name, 3, chunk_size=chunk_size))
+                self.assertEqual([val["a"] for val in result], list(range(1000)))
+
+    def test_jsonl_prefilter(self):
+        """Test pushing a leading filter down to the worker processes"""
+        import tempfile
+        from jf.process import Col, Filter, GenProcessor
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            for idx in range(100):
+                f.write('{"a": %d}\n' % idx)
+            f.flush()
+            inp = read_input(Struct(**{"files": [f.name], "workers": 2}))
+            gp = GenProcessor(inp, [Filter(Col().a < 3)])
+            result = list(gp.process())
+        self.assertIsNotNone(inp.prefilter)
+        self.assertEqual(result, [{"a": 0}, {"a": 1}, {"a": 2}])
+
+    def test_csv_chunks(self):
+        """Test reading csv in chunks"""
+        from jf.input import read_csv
+
+        result = list(read_csv("tests/test.csv", chunksize=1))
+        self.assertEqual(result, [{"a": 1, "b": 2, "c": 3}, {"a": 4, "b": 5, "c": 6}])
+
+    def test_csv_strings(self):
+        """Test reading csv values as strings"""
+        args = Struct(**{"files": ["tests/test.csv"], "csv_strings": 1})
+
+        result = list(read_input(args))
+        self.assertEqual(
+            result, [{"a": "1", "b": "2", "c": "3"}, {"a": "4", "b": "5", "c": "6"}]
+        )
+
+    def test_parquet_row_groups(self):
+        """Test reading parquet row group by row group"""
+        import tempfile
+        import pandas
+        from fastparquet import write
+        from jf.input import read_parquet
+
+        df = pandas.DataFrame({"a": range(10), "b": range(10, 20), "c": ["x"] * 10})
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            write(f.name, df, row_group_offsets=[0, 4, 8])
+            result = list(read_input(Struct(**{"files": [f.name]})))
+            self.assertEqual(result, df.to_dict("records"))
+            result = list(read_parquet(f.name, columns={"b", "missing"}))
+        self.assertEqual(result, [{"b": val} for val in range(10, 20)])
+
+    def test_parquet_projection(self):
+        """Test that only the columns used by the query are read"""
+        import tempfile
+        import pandas
+        from fastparquet import write
+        from jf.process import Col, Filter, GenProcessor, Map
+
+        x = Col()
+        df = pandas.DataFrame({"a": range(10), "b": range(10, 20), "c": ["x"] * 10})
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            write(f.name, df, row_group_offsets=[0, 4, 8])
+            inp = read_input(Struct(**{"files": [f.name]}))
+            gp = GenProcessor(inp, [Filter(x.a > 7), Map({"b": x.b})])
+            result = list(gp.process())
+        self.assertEqual(inp.kwargs["columns"], {"a", "b"})
+        self.assertEqual(result, [{"b": 18}, {"b": 19}])
+
+    def test_json_projection(self):
+        """Test that only the paths used by the query are decoded"""
+        import tempfile
+        from jf.process import Col, Filter, GenProcessor, Map
+
+        x = Col()
+        records = [
+            {"id": idx, "meta": {"ts": idx * 10, "big": ["x"] * idx}, "pad": "y"}
+            for idx in range(50)
+        ]
+        expected = [{"id": idx, "ts": idx * 10} for idx in range(45, 50)]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write("".join(json.dumps(val) + "\n" for val in records))
+            f.flush()
+            for workers in (0, 2):
+                inp = read_input(Struct(**{"files": [f.name], "workers": workers}))
+                query = [Filter(x.id >= 45), Map({"id": x.id, "ts": x.meta.ts})]
+                result = list(GenProcessor(inp, query).process())
+                self.assertEqual(result, expected)
+                self.assertEqual(
+                    inp.kwargs["projection"].tree(), {"id": None, "meta": {"ts": None}}
+                )
+
+    def test_parquet_row_group_pruning(self):
+        """Test skipping parquet row groups with min/max statistics"""
+        import tempfile
+        import pandas
+        from fastparquet import write, ParquetFile
+        from jf.input import parquet_row_groups
+        from jf.process import Col, Filter, GenProcessor
+
+        x = Col()
+        df = pandas.DataFrame({"a": range(10), "b": range(10, 20)})
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            write(f.name, df, row_group_offsets=[0, 4, 8])
+            pf = ParquetFile(f.name)
+            self.assertEqual(parquet_row_groups(pf, [(("a",), ">", 6)]), [1, 2])
+            self.assertEqual(parquet_row_groups(pf, [(("a",), "==", 2)]), [0])
+            self.assertEqual(parquet_row_groups(pf, [(("b",), "<", 10)]), [])
+            inp = read_input(Struct(**{"files": [f.name]}))
+            gp = GenProcessor(inp, [Filter(x.a >= 8)])
+            result = list(gp.process())
+        self.assertEqual(inp.kwargs["comparisons"], [(("a",), ">=", 8)])
+        self.assertEqual(result, [{"a": 8, "b": 18}, {"a": 9, "b": 19}])
+
+    def test_parquet_string_and_time_pruning(self):
+        """Test skipping row groups with string and timestamp statistics"""
+        import datetime
+        import tempfile
+        import pandas
+        from fastparquet import write, ParquetFile
+        from jf.input import parquet_row_groups
+
+        times = ["2023-01-01", "2023-02-01", "2023-03-01", "2024-02-01", "2024-03-01"]
+        df = pandas.DataFrame(
+            {
+                "status": ["ok", "error", "ok", "ok", "warn"],
+                "ts": pandas.to_datetime(times, utc=True),
+                "day": pandas.to_datetime(times),
+            }
+        )
+        utc = datetime.timezone.utc
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            write(f.name, df, row_group_offsets=[0, 3], stats=True)
+            pf = ParquetFile(f.name)
+            cases = [
+                ("status", "==", "error", [0]),
+                ("status", ">", "ok", [1]),
+                ("ts", ">", "2024-01-01", [1]),
+                ("ts", "<", datetime.datetime(2023, 6, 1, tzinfo=utc), [0]),
+                ("day", ">=", datetime.date(2024, 3, 2), []),
+                ("day", ">", "x", [0, 1]),
+                ("day", ">", 5, [0, 1]),
+            ]
+            for column, op, value, expected in cases:
+                result = parquet_row_groups(pf, [((column,), op, value)])
+                self.assertEqual(result, expected, (column, op, value))
+
+    def test_parquet_null_pruning(self):
+        """Test that != keeps row groups with nulls outside the statistics"""
+        import tempfile
+        import pandas
+        from fastparquet import write, ParquetFile
+        from jf.input import parquet_row_groups
+
+        df = pandas.DataFrame(
+            {
+                "code": pandas.array([1, None, 1, 1, 1, 1, 2, 2, 2], dtype="Int64"),
+                "score": [1.0, float("nan"), 1.0] + [2.0] * 6,
+            }
+        )
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            write(f.name, df, row_group_offsets=[0, 3, 6], stats=True)
+            pf = ParquetFile(f.name)
+            self.assertEqual(parquet_row_groups(pf, [(("code",), "!=", 1)]), [0, 2])
+            self.assertEqual(parquet_row_groups(pf, [(("code",), "==", 1)]), [0, 1])
+            result = parquet_row_groups(pf, [(("score",), "!=", 2.0)])
+            self.assertEqual(result, [0, 1, 2])
+
+    def test_limit_pushdown(self):
+        """Test that a leading first(N) stops the readers early"""
+        import tempfile
+        import pandas
+        from fastparquet import write
+        from jf.input import read_parquet
+        from jf.process import Col, First, GenProcessor, Map
+
+        x = Col()
+        for fn in ["tests/test.csv", "tests/test.xlsx"]:
+            inp = read_input(Struct(**{"files": [fn]}))
+            result = list(GenProcessor(inp, [Map(x.a), First(1)]).process())
+            self.assertEqual(inp.kwargs["limit"], 1)
+            self.assertEqual(result, [1])
+        result = list(read_file("tests/test.csv", csv_strings=True, limit=1))
+        self.assertEqual(result, [{"a": "1", "b": "2", "c": "3"}])
+        df = pandas.DataFrame({"a": range(10)})
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as f:
+            write(f.name, df, row_group_offsets=[0, 4, 8])
+            result = list(read_parquet(f.name, limit=5))
+            self.assertEqual(result, [{"a": val} for val in range(5)])
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            for idx in range(100):
+                f.write('{"a": %d}\n' % idx)
+            f.flush()
+            inp = read_input(Struct(**{"files": [f.name] * 2, "workers": 2}))
+            inp.set_limit(3)
+            self.assertEqual(list(inp), [{"a": 0}, {"a": 1}, {"a": 2}])
+
+    def test_raw_grep(self):
+        """Test dropping raw json records before decoding them"""
+        import tempfile
+        from jf.process import Col, Filter, GenProcessor, Jfislice
+
+        x = Col()
+        levels = ["INFO", "ERROR", "DEBUG", "ERRORS"]
+        records = [{"id": idx, "level": levels[idx % 4]} for idx in range(100)]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write("".join(json.dumps(val) + "\n" for val in records))
+            f.flush()
+            for workers in (0, 2):
+                args = {"files": [f.name], "grep": "ERROR", "workers": workers}
+                result = list(read_input(Struct(**args)))
+                self.assertEqual(result, [val for val in records if val["id"] % 2])
+                inp = read_input(Struct(**{"files": [f.name], "workers": workers}))
+                gp = GenProcessor(inp, [Filter(x.level == "ERROR")])
+                result = list(gp.process())
+                self.assertEqual(inp.kwargs["grep"].literals, ['"ERROR"'])
+                self.assertEqual(result, records[1::4])
+            inp = read_input(Struct(**{"files": [f.name], "grep": "DEBUG"}))
+            result = list(GenProcessor(inp, [Jfislice(2, 3)]).process())
+            self.assertEqual(result, [records[10]])
+            result = list(read_file(f.name, grep=RawFilter(literals=["ERRORS"])))
+            self.assertEqual(result, records[3::4])
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write('{"level": "\\u0045RROR"}\n{"level": "INFO"}\n')
+            f.flush()
+            inp = read_input(Struct(**{"files": [f.name]}))
+            result = list(GenProcessor(inp, [Filter(x.level == "ERROR")]).process())
+            self.assertEqual(inp.kwargs["grep"].literals, ['"ERROR"'])
+            self.assertEqual(result, [{"level": "ERROR"}])
+
+    def test_stream_path(self):
+        """Test streaming the items of a list inside a huge json document"""
+        import gzip
+        import tempfile
+
+        items = [{"id": idx, "text": "x]}" * (idx % 5)} for idx in range(2000)]
+        doc = {"results": {"count": 2000, "items": items}, "after": [1]}
+        data = json.dumps(doc, indent=1).encode()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for fn, write in (("doc.json", bytes), ("doc.json.gz", gzip.compress)):
+                fn = os.path.join(tmpdir, fn)
+                with open(fn, "wb") as f:
+                    f.write(write(data))
+                args = {"files": [fn], "stream_path": "results.items.*"}
+                self.assertEqual(list(read_input(Struct(**args))), items)
+            args["stream_path"] = "*.count"
+            self.assertEqual(list(read_input(Struct(**args))), [2000])
+
+    def test_stdin_blocks(self):
+        """Test reading stdin in binary blocks that split records"""
+        import io
+        from unittest import mock
+        from jf.input import read_into
+
+        class ShortReads(io.RawIOBase):
+            """Binary stream returning at most 5 bytes per read"""
+
+            def __init__(self, data):
+                self.data = BytesIO(data)
+
+            def readable(self):
+                return True
+
+            def readinto(self, buf):
+                chunk = self.data.read(min(len(buf), 5))
+                buf[: len(chunk)] = chunk
+                return len(chunk)
+
+        records = [
+            {"a": 1, "text": "äö€😀" * 3},
+            {"a": 2, "text": "x\u0000y", "list": [1, {"b": "😀"}]},
+            {"a": 3, "text": "long " * 20},
+        ]
+        lines = [json.dumps(rec, ensure_ascii=False) for rec in records]
+        data = ("\n".join(lines[:2]) + "\n" + lines[2]).encode()
+        with mock.patch.object(sys, "stdin", Struct(buffer=ShortReads(data))):
+            self.assertEqual(list(read_file("-")), records)
+
+        data = b'{"a": "x\x00y"}\n{"b": "\xe2\x82\xac"}'
+        blocks = read_into(ShortReads(data))
+        self.assertEqual(
+            [bytes(rec) for rec in yield_json_and_json_lines(blocks)],
+            [b'{"a": "x\x00y"}', b'{"b": "\xe2\x82\xac"}'],
+        )
+
+    def test_stdin_pipe(self):
+        """Test yielding records from a buffered pipe as they arrive"""
+        import io
+        import threading
+        from unittest import mock
+
+        read_fd, write_fd = os.pipe()
+        received = threading.Event()
+        finished = []
+
+        def writer():
+            with os.fdopen(write_fd, "wb", buffering=0) as f:
+                f.write(b'{"a": 1}\n')
+                received.wait(5)
+                f.write(b'{"a": 2}\n')
+            finished.append(True)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        stdin = io.BufferedReader(io.FileIO(read_fd, "rb"))
+        try:
+            with mock.patch.object(sys, "stdin", Struct(buffer=stdin)):
+                records = read_file("-")
+                self.assertEqual(next(records), {"a": 1})
+                self.assertEqual(finished, [])
+                received.set()
+                self.assertEqual(list(records), [{"a": 2}])
+        finally:
+            received.set()
+            thread.join()
+            stdin.close()
+
+    def test_follow(self):
+        """Test following a growing file over truncation and rotation"""
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "app.jsonl")
+            with open(fn, "w") as f:
+                f.write('{"a": 1}\n{"a": 2}\n{"a": 3, "pad": "%s"}\n' % ("x" * 100))
+            records = iter(read_input(Struct(files=[fn], follow=1)))
+            self.assertEqual([next(records) for _ in range(2)], [{"a": 1}, {"a": 2}])
+            self.assertEqual(next(records)["a"], 3)
+            with open(fn, "a") as f:
+                f.write('{"a": 4}\n{"a": ')
+            self.assertEqual(next(records), {"a": 4})
+            with open(fn, "w") as f:
+                f.write('{"b": 1}\n')
+            self.assertEqual(next(records), {"b": 1})
+            os.rename(fn, fn + ".1")
+            with open(fn, "w") as f:
+                f.write('{"c": 1}\n')
+            self.assertEqual(next(records), {"c": 1})
+
+    def test_follow_long_lines(self):
+        """Test joining and dropping lines split over many blocks"""
+        from jf.input import follow_lines
+
+        blocks = [b'{"a": "'] + [b"x" * 10] * 1000 + [b'"}\n{"b": 1}\n']
+        result = list(follow_lines(blocks, max_line=20000))
+        self.assertEqual(result, [b'{"a": "%s"}' % (b"x" * 10000), b'{"b": 1}'])
+        result = list(follow_lines(blocks, max_line=5000))
+        self.assertEqual(result, [b'{"b": 1}'])
+
+    def test_bad_records(self):
+        """Test writing records that can not be decoded to a quarantine file"""
+        import tempfile
+        from jf import quarantine
+        from jf.input import read_file_chunked
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "data.jsonl")
+            bad = os.path.join(tmpdir, "bad.jsonl")
+            with open(fn, "wb") as f:
+                for idx in range(1000):
+                    f.write(b'{"a": %d}\n' % idx)
+                    if idx % 100 == 0:
+                        f.write(b'{"a": %d, "x": "%s" y}\n' % (idx, b"x" * 10000))
+                f.write(b'{"b": "\xff"}\n')
+            try:
+                q = quarantine.set_quarantine(bad)
+                result = list(read_input(Struct(files=[fn])))
+                self.assertEqual(result, [{"a": idx} for idx in range(1000)])
+                self.assertEqual(q.records.value, 11)
+                result = list(read_file_chunked(fn, 3, chunk_size=10000))
+                self.assertEqual(len(result), 1000)
+                self.assertEqual(q.records.value, 22)
+            finally:
+                quarantine.set_quarantine(None)
+            with open(bad, "rb") as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 22)
+            self.assertEqual(lines[10], b'{"b": "\xff"}')
+            self.assertTrue(all(len(line) > 10000 for line in lines[:10]))
+            self.assertIn("22 bad records", q.summary())
+
+    def test_quarantine_short_writes(self):
+        """Test quarantining records that are written in several parts"""
+        import tempfile
+        from unittest import mock
+        from jf.quarantine import Quarantine
+
+        write = os.write
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bad = os.path.join(tmpdir, "bad.jsonl")
+            q = Quarantine(bad)
+            with mock.patch.object(os, "write", lambda fd, data: write(fd, data[:3])):
+                q.add(b'{"a": 1, "x": y}')
+                q.add(b'{"b"}')
+            q.close()
+            with open(bad, "rb") as f:
+                self.assertEqual(f.read(), b'{"a": 1, "x": y}\n{"b"}\n')
+
+    def test_spawned_workers(self):
+        """Test that spawned worker processes get the command line settings"""
+        import multiprocessing
+        import tempfile
+        from unittest import mock
+        from jf import cache, codec, quarantine
+        from jf.input import read_file_chunked, worker_pool
+
+        spawn = multiprocessing.get_context("spawn")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "data.jsonl")
+            bad = os.path.join(tmpdir, "bad.jsonl")
+            with open(fn, "wb") as f:
+                for idx in range(1000):
+                    f.write(b'{"a": %d}\n' % idx)
+                    if idx % 100 == 0:
+                        f.write(b'{"a": %d, "x": y}\n' % idx)
+            try:
+                codec.set_backend("json")
+                cache.set_cache_dir(os.path.join(tmpdir, "cache"))
+                with mock.patch.object(multiprocessing, "Value", spawn.Value):
+                    q = quarantine.set_quarantine(bad)
+                with mock.patch.object(multiprocessing, "Pool", spawn.Pool):
+                    with worker_pool(1) as pool:
+                        settings = pool.apply(worker_settings)
+                    result = list(read_file_chunked(fn, 2, chunk_size=1000))
+            finally:
+                codec.set_backend()
+                cache.set_cache_dir(None)
+                quarantine.set_quarantine(None)
+            self.assertEqual(settings, ("json", os.path.join(tmpdir, "cache"), bad))
+            self.assertEqual(result, [{"a": idx} for idx in range(1000)])
+            self.assertEqual(q.records.value, 10)
+            with open(bad, "rb") as f:
+                self.assertEqual(len(f.read().splitlines()), 10)
+
+    def test_xml_records(self):
+        """Test streaming xml records"""
+        args = Struct(**{"files": ["tests/test.xml"], "xml_record": "item"})
+
+        result = list(read_input(args))
+        self.assertEqual(
+            result, [{"a": "1", "b": "2", "c": "3"}, {"a": "4", "b": "5", "c": "6"}]
+        )
+
+    def test_yaml_documents(self):
+        """Test streaming a multi-document yaml file"""
+        args = Struct(**{"files": ["input.yaml"]})
+
+        def openhook(a=None, b=None):
+            test_str = "---\nkind: Service\n---\nkind: Pod\nspec: !custom\n  a: 1\n"
+            return BytesIO(test_str.encode())
+
+        result = list(read_input(args, openhook=openhook))
+        self.assertEqual(result, [{"kind": "Service"}, {"kind": "Pod", "spec": {"a": 1}}])
+
+
+try:
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+except ImportError:
+    mock_aws = None
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class TestJfS3(unittest.TestCase):
+    """jf s3 input testcases against a local s3 stand-in"""
+
+    def setUp(self):
+        import boto3
+        from jf.input import s3_client
+
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        self.mock = mock_aws()
+        self.mock.start()
+        s3_client.cache_clear()
+        self.client = boto3.client("s3")
+        self.client.create_bucket(Bucket="jf-test")
+
+    def tearDown(self):
+        from jf.input import s3_client
+
+        s3_client.cache_clear()
+        self.mock.stop()
+
+    def test_s3_ranged_reader(self):
+        """Test reading an object in parallel ranged parts"""
+        from jf.input import S3Reader
+
+        body = b"".join(b'{"a": %d}\n' % idx for idx in range(1000))
+        self.client.put_object(Bucket="jf-test", Key="data.jsonl", Body=body)
+        reader = S3Reader(self.client, "jf-test", "data.jsonl", part_size=1000, workers=3)
+        self.assertEqual(reader.read(), body)
+        reader.close()
+
+    def test_s3_jsonl_gz(self):
+        """Test streaming a compressed jsonl object"""
+        import gzip
+
+        body = b"".join(b'{"a": %d}\n' % idx for idx in range(100))
+        self.client.put_object(
+            Bucket="jf-test", Key="data.jsonl.gz", Body=gzip.compress(body)
+        )
+        result = list(read_input(Struct(**{"files": ["s3://jf-test/data.jsonl.gz"]})))
+        self.assertEqual(result, [{"a": idx} for idx in range(100)])
+
+    def test_s3_csv(self):
+        """Test reading a csv object through a temporary file"""
+        with open("tests/test.csv", "rb") as f:
+            self.client.put_object(Bucket="jf-test", Key="test.csv", Body=f.read())
+        result = list(read_input(Struct(**{"files": ["s3://jf-test/test.csv"]})))
+        self.assertEqual(result, [{"a": 1, "b": 2, "c": 3}, {"a": 4, "b": 5, "c": 6}])
+
+    def test_s3_prefix(self):
+        """Test reading all objects under a prefix and matching a glob"""
+        import gzip
+
+        for idx in range(20):
+            body = b"".join(b'{"a": %d}\n' % (idx * 10 + val) for val in range(10))
+            key = "logs/day/part-%02d.jsonl.gz" % idx
+            self.client.put_object(Bucket="jf-test", Key=key, Body=gzip.compress(body))
+        self.client.put_object(Bucket="jf-test", Key="logs/day/README", Body=b"{}")
+        result = list(read_input(Struct(**{"files": ["s3://jf-test/logs/day/*.gz"]})))
+        self.assertEqual(result, [{"a": idx} for idx in range(200)])
+        result = list(read_input(Struct(**{"files": ["s3://jf-test/logs/"]})))
+        self.assertEqual(len(result), 201)
+
+    def test_s3_cache(self):
+        """Test serving s3 objects from the local cache until they change"""
+        import shutil
+        import tempfile
+        from jf import cache
+
+        cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cachedir, ignore_errors=True)
+        cache.set_cache_dir(cachedir)
+        try:
+            files = ["s3://jf-test/data.jsonl", "s3://jf-test/data.csv"]
+            self.client.put_object(Bucket="jf-test", Key="data.jsonl", Body=b'{"a": 1}')
+            self.client.put_object(Bucket="jf-test", Key="data.csv", Body=b"a\n1\n")
+            result = list(read_input(Struct(**{"files": files})))
+            self.assertEqual(result, [{"a": 1}, {"a": 1}])
+            self.assertEqual(len(os.listdir(cachedir)), 2)
+            result = list(read_input(Struct(**{"files": files[:1]})))
+            self.assertEqual(result, [{"a": 1}])
+            self.assertEqual(len(os.listdir(cachedir)), 2)
+            self.client.put_object(Bucket="jf-test", Key="data.jsonl", Body=b'{"a": 2}')
+            result = list(read_input(Struct(**{"files": files[:1]})))
+            self.assertEqual(result, [{"a": 2}])
+            self.assertEqual(len(os.listdir(cachedir)), 3)
+        finally:
+            cache.set_cache_dir(None)